@@ -0,0 +1,66 @@
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from scraper_danmu import BilibiliScraper
+from utils.rate_limiter import get_limiter
+from utils.video_cache import VideoCache
+from fake_server import FakeBilibiliServer
+
+
+def make_scraper(save_dir: str, base_url: str) -> BilibiliScraper:
+    scraper = BilibiliScraper(save_dir=save_dir)
+    scraper.video_info_url = f'{base_url}/x/web-interface/view'
+    scraper.danmaku_url = base_url + '/{}.xml'
+    scraper.danmaku_seg_url = f'{base_url}/x/v2/dm/web/seg.so'
+    scraper.view_cache = VideoCache(os.path.join(save_dir, 'video_cache.sqlite3'))
+    # 替身服务器不做风控，放开自适应限速的上限，只比较并发本身带来的差异
+    for endpoint in ('view', 'danmaku'):
+        limiter = get_limiter(endpoint)
+        limiter.rate = limiter.max_rate = 10000.0
+    return scraper
+
+
+def main():
+    parser = argparse.ArgumentParser(description='同步/异步弹幕爬取吞吐对比（本地替身服务器）')
+    parser.add_argument('--videos', type=int, default=200, help='异步模式处理的视频数')
+    parser.add_argument('--sync-videos', type=int, default=10, help='同步模式处理的视频数')
+    parser.add_argument('--latency', type=float, default=0.1, help='模拟的单次请求延迟（秒）')
+    parser.add_argument('--danmaku', type=int, default=500, help='每个视频的弹幕条数')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 32])
+    parser.add_argument('--max-rps', type=float, default=200.0, help='异步模式的全局请求预算')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    with FakeBilibiliServer(latency=args.latency, danmaku_per_video=args.danmaku) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        bv_file = os.path.join(tmp, 'bv_list.txt')
+
+        def write_list(n):
+            with open(bv_file, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(f'BVbench{i:05d}' for i in range(n)))
+
+        write_list(args.sync_videos)
+        scraper = make_scraper(os.path.join(tmp, 'sync'), server.base_url)
+        start = time.perf_counter()
+        scraper.process_from_file(bv_file)
+        elapsed = time.perf_counter() - start
+        print(f'sync         videos={args.sync_videos:5d}  {elapsed:8.2f}s  {args.sync_videos / elapsed:8.2f} videos/s')
+
+        write_list(args.videos)
+        for concurrency in args.concurrency:
+            scraper = make_scraper(os.path.join(tmp, f'async_{concurrency}'), server.base_url)
+            start = time.perf_counter()
+            scraper.process_from_file_async(bv_file, concurrency=concurrency, max_rps=args.max_rps)
+            elapsed = time.perf_counter() - start
+            print(f'async c={concurrency:<4d} videos={args.videos:5d}  {elapsed:8.2f}s  {args.videos / elapsed:8.2f} videos/s')
+
+
+if __name__ == '__main__':
+    main()
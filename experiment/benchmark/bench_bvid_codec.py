@@ -0,0 +1,135 @@
+import argparse
+import filecmp
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import scraper_comment
+from utils.bvid_codec import (ALPHABET, MAX_AID, av_to_bv, avs_to_bvs, bv_to_av, bvs_to_avs, is_valid_bvid,
+                              try_bv_to_av)
+from utils.rate_limiter import get_limiter
+from bench_comment_pages import make_crawler
+from fake_server import FakeBilibiliServer, load_recorded_fixtures
+
+
+def check_properties(samples: int, seed: int = 0):
+    """换算的性质：往返一致、标量与批量一致、与录制数据中的真实 bvid/aid 一致、无效输入被拒绝"""
+    rng = random.Random(seed)
+    # 覆盖小aid、2^30附近（算法切换前后）和接近上限的aid
+    aids = [1, 2, 170001, (1 << 30) - 1, 1 << 30, MAX_AID - 1]
+    aids += [rng.randrange(1, MAX_AID) for _ in range(samples)]
+    aids += [rng.randrange(1, 1 << 31) for _ in range(samples)]
+    for aid in aids:
+        bvid = av_to_bv(aid)
+        assert is_valid_bvid(bvid) and bv_to_av(bvid) == aid, (aid, bvid)
+    batch = avs_to_bvs(aids)
+    assert list(batch) == [av_to_bv(aid) for aid in aids]
+    assert bvs_to_avs(batch).tolist() == aids
+
+    for bvid, fixture in load_recorded_fixtures().items():
+        assert bv_to_av(bvid) == fixture['aid'] and av_to_bv(fixture['aid']) == bvid, bvid
+
+    # 随机的BV1开头字符串：能换算的一定能往返，换算不了的标量和批量都拒绝
+    strings = ['BV1' + ''.join(rng.choice(ALPHABET) for _ in range(9)) for _ in range(samples)]
+    decoded = bvs_to_avs(strings).tolist()
+    for bvid, batch_aid in zip(strings, decoded):
+        aid = try_bv_to_av(bvid)
+        assert (aid or -1) == batch_aid, bvid
+        assert aid is None or av_to_bv(aid) == bvid, bvid
+    canonical = sum(aid != -1 for aid in decoded) / len(decoded)
+
+    invalid = ['', 'BV', 'BVbench00001', 'BV1yyC1YQEp', 'BV1yyC1YQEpkk', 'BV1yyC1YQEp0', 'BV1yyC1YQEpl',
+               'av170001', 'BV1yyC1YQEp好', 'bv1yyC1YQEpk']
+    for bvid in invalid:
+        assert try_bv_to_av(bvid) is None, bvid
+    assert (bvs_to_avs(invalid) == -1).all()
+    for aid in (0, -1, MAX_AID):
+        try:
+            av_to_bv(aid)
+        except ValueError:
+            continue
+        raise AssertionError(aid)
+    print(f'properties: {len(aids)} aids round-trip, recorded pairs match, {len(invalid)} invalid ids rejected, '
+          f'{canonical:.1%} of random BV1 strings decode')
+
+
+def measure_throughput(count: int):
+    aids = np.random.default_rng(0).integers(1, MAX_AID, size=count, dtype=np.int64)
+    start = time.perf_counter()
+    bvids = avs_to_bvs(aids)
+    encode = time.perf_counter() - start
+    start = time.perf_counter()
+    decoded = bvs_to_avs(bvids)
+    decode = time.perf_counter() - start
+    assert (decoded == aids).all()
+
+    scalar = bvids[:100000].tolist()
+    start = time.perf_counter()
+    for bvid in scalar:
+        bv_to_av(bvid)
+    per_scalar = (time.perf_counter() - start) / len(scalar)
+    print(f'batch encode {count / encode / 1e6:6.2f} M/s  batch decode {count / decode / 1e6:6.2f} M/s  '
+          f'scalar decode {1 / per_scalar / 1e6:6.2f} M/s')
+
+
+def crawl(base_url: str, bv_file: str, out: str, local: bool) -> float:
+    crawler = make_crawler(out, base_url, 3)
+    if not local:
+        # 改动前的做法：先请求视频信息拿到aid，再请求评论
+        scraper_comment.try_bv_to_av = lambda bvid: None
+    threads = set(threading.enumerate())
+    try:
+        start = time.perf_counter()
+        crawler.process_from_file(bv_file, save_format='both', pages=2)
+        seconds = time.perf_counter() - start
+    finally:
+        scraper_comment.try_bv_to_av = try_bv_to_av
+    # 请求视频信息的线程池每个视频用完就关闭，爬虫对象还在时也不应留下非守护线程
+    leftover = [thread for thread in threading.enumerate() if thread not in threads and not thread.daemon]
+    for thread in leftover:
+        thread.join(timeout=1)
+    assert not any(thread.is_alive() for thread in leftover), [thread.name for thread in leftover]
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BV号/aid本地换算：性质检查、批量吞吐，以及评论爬虫省去的视频信息往返')
+    parser.add_argument('--samples', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=2000000)
+    parser.add_argument('--videos', type=int, default=60)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    check_properties(args.samples)
+    measure_throughput(args.batch)
+
+    logging.disable(logging.INFO)
+    limiter = get_limiter('reply')
+    limiter.rate = limiter.max_rate = 10000.0
+    with FakeBilibiliServer(latency=args.latency, replies_per_video=40) as server, tempfile.TemporaryDirectory() as tmp:
+        bv_file = os.path.join(tmp, 'bv_list.txt')
+        with open(bv_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(avs_to_bvs(range(1000001, 1000001 + args.videos))))
+        seconds = {}
+        for name, local in (('view_first', False), ('local_aid', True)):
+            seconds[name] = crawl(server.base_url, bv_file, os.path.join(tmp, name), local)
+        files = [name for name in os.listdir(os.path.join(tmp, 'view_first')) if name.endswith(('.json', '.csv'))]
+        assert len(files) == 2 * args.videos
+        for name in files:
+            assert filecmp.cmp(os.path.join(tmp, 'view_first', name), os.path.join(tmp, 'local_aid', name),
+                               shallow=False), name
+    print(f"comment crawl {args.videos} videos: view first {seconds['view_first']:.2f}s, "
+          f"local aid {seconds['local_aid']:.2f}s ({seconds['view_first'] / seconds['local_aid']:.2f}x), "
+          f"{len(files)} files identical")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from scraper_danmu import BilibiliScraper
+from scraper_comment import BilibiliCrawler
+from utils.columnar import read_metadata
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def dir_size(path: str, pattern: str) -> int:
+    return sum(os.path.getsize(p) for p in glob.glob(os.path.join(path, '**', pattern), recursive=True))
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def check_danmaku_roundtrip(path: str, data: dict, video_info: dict):
+    """Parquet读回来的弹幕和视频级字段必须与原数据一致"""
+    rows = pq.read_table(path).to_pylist()
+    expected = [dict(c, dmid=int(c['dmid']), page=c.get('page'), part=c.get('part')) for c in data['comments']]
+    assert rows == expected, f'弹幕往返不一致: {path}'
+    metadata = read_metadata(path)
+    assert metadata['video_info'] == video_info
+    assert metadata['danmaku_info'] == {k: v for k, v in data.items() if k != 'comments'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON+CSV vs Parquet 输出的体积和写入耗时')
+    parser.add_argument('--scale', type=int, default=1, help='把样本弹幕重复多少倍（重复的数据压缩比会偏高）')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    samples = []
+    for path in sorted(glob.glob(os.path.join(ROOT, 'bilibili_data', '*.json'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            sample = json.load(f)
+        sample['danmaku_data']['comments'] *= args.scale
+        samples.append(sample)
+    comment_samples = []
+    for path in sorted(glob.glob(os.path.join(ROOT, 'bilibili_comment_data', '*.json'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            comment_samples.append(json.load(f))
+    total = sum(len(s['danmaku_data']['comments']) for s in samples)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for save_format in ('both', 'parquet', 'dataset'):
+            scraper = BilibiliScraper(save_dir=os.path.join(tmp, save_format))
+
+            def write_all():
+                for sample in samples:
+                    scraper.save_data(sample['danmaku_data'], sample['video_info'], save_format)
+                scraper.close_dataset()
+
+            elapsed = timed(write_all)
+            size = sum(dir_size(scraper.save_dir, pattern) for pattern in ('*.json', '*.csv', '*.parquet'))
+            print(f'danmaku  {save_format:8s} {total:8d} rows  {elapsed:7.2f}s  {size / 1024 / 1024:8.2f} MB')
+
+        for sample in samples:
+            scraper = BilibiliScraper(save_dir=os.path.join(tmp, 'parquet'))
+            path = scraper.output_paths(sample['video_info'], 'parquet')[0]
+            check_danmaku_roundtrip(path, sample['danmaku_data'], sample['video_info'])
+
+        dataset = ds.dataset(os.path.join(tmp, 'dataset', 'danmaku_dataset'), partitioning='hive')
+        assert dataset.count_rows() == total
+        print(f'dataset  {len(dataset.files)} file(s), '
+              f'{sum(pq.ParquetFile(f).num_row_groups for f in dataset.files)} row group(s)')
+
+        if comment_samples:
+            for save_format in ('both', 'parquet'):
+                crawler = BilibiliCrawler(save_dir=os.path.join(tmp, 'comment_' + save_format))
+                for sample in comment_samples:
+                    info = sample['video_info']
+                    video_info = {'title': info['title'], 'bvid': info['bvid'], 'aid': info['aid'],
+                                  'owner': {'name': info['author']},
+                                  'pubdate': time.mktime(time.strptime(info['pub_date'], '%Y-%m-%d %H:%M:%S'))}
+                    crawler.save_comments(sample['comments_data'], video_info, save_format)
+                    if save_format == 'parquet':
+                        path = os.path.join(crawler.save_dir,
+                                            crawler.sanitize_filename(info['title']) + '_comments.parquet')
+                        assert read_metadata(path)['video_info'] == info
+                size = sum(dir_size(crawler.save_dir, pattern) for pattern in ('*.json', '*.csv', '*.parquet'))
+                print(f'comments {save_format:8s} {len(comment_samples):8d} videos  {size / 1024 / 1024:8.2f} MB')
+
+    print('round trip identical')
+
+
+if __name__ == '__main__':
+    main()
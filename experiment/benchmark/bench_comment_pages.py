@@ -0,0 +1,88 @@
+import argparse
+import filecmp
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from scraper_comment import BilibiliCrawler, HOT_MODE, TIME_MODE, reply_to_comment
+from utils.rate_limiter import get_limiter
+from utils.video_cache import VideoCache
+from fake_server import FakeBilibiliServer
+
+
+def make_crawler(save_dir: str, base_url: str, prefetch: int) -> BilibiliCrawler:
+    crawler = BilibiliCrawler(save_dir=save_dir, comment_prefetch=prefetch)
+    crawler.video_info_url = f'{base_url}/x/web-interface/view'
+    crawler.reply_url = f'{base_url}/x/v2/reply/main'
+    crawler.view_cache = VideoCache(os.path.join(save_dir, 'video_cache.sqlite3'))
+    return crawler
+
+
+def reference_comments(crawler: BilibiliCrawler, aid: int, pages: int) -> list:
+    """改动前 get_comments 的写法：next=页码逐页请求，上一页处理完才发下一页"""
+    comments = []
+    for page in range(1, pages + 1):
+        data = crawler.http.get(crawler.reply_url, params={"oid": aid, "type": 1, "next": page, "mode": 3},
+                                endpoint="reply").json()
+        replies = data["data"]["replies"]
+        if not replies:
+            break
+        comments.extend(reply_to_comment(reply) for reply in replies)
+    return comments
+
+
+def main():
+    parser = argparse.ArgumentParser(description='评论翻页：逐页请求 vs 按游标预取（本地替身服务器）')
+    parser.add_argument('--replies', type=int, default=1000, help='每个视频的评论条数')
+    parser.add_argument('--latency', type=float, default=0.2, help='模拟的单次请求延迟（秒）')
+    parser.add_argument('--rate', type=float, default=20.0, help='评论接口的限速（请求/秒）')
+    parser.add_argument('--prefetch', type=int, nargs='+', default=[1, 3, 8])
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    limiter = get_limiter('reply')
+    limiter.rate = limiter.max_rate = args.rate
+    pages = -(-args.replies // 20)
+    bvid = 'BVbenchreply'
+
+    for offset in (False, True):
+        with FakeBilibiliServer(latency=args.latency, replies_per_video=args.replies, reply_offset=offset) as server, \
+                tempfile.TemporaryDirectory() as tmp:
+            crawler = make_crawler(os.path.join(tmp, 'reference'), server.base_url, 1)
+            video_info = crawler.bv_to_aid(bvid)
+            aid = video_info['aid']
+
+            start = time.perf_counter()
+            expected = reference_comments(crawler, aid, pages + 1)
+            elapsed = time.perf_counter() - start
+            assert len(expected) == args.replies
+            crawler.save_comments(expected, video_info, 'both')
+            reference_paths = crawler.output_paths(video_info, 'both')
+            label = 'offset' if offset else 'next'
+            print(f'{label:6s} sequential   pages={pages:4d}  {elapsed:7.2f}s')
+
+            for prefetch in args.prefetch:
+                crawler = make_crawler(os.path.join(tmp, f'prefetch_{prefetch}'), server.base_url, prefetch)
+                before = server.reply_requests
+                start = time.perf_counter()
+                assert crawler.process_video(bvid, 'both', pages=None)
+                elapsed = time.perf_counter() - start
+                for a, b in zip(reference_paths, crawler.output_paths(video_info, 'both')):
+                    assert filecmp.cmp(a, b, shallow=False), (prefetch, b)
+                print(f'{label:6s} prefetch={prefetch:<3d} pages={pages:4d}  {elapsed:7.2f}s  '
+                      f'requests={server.reply_requests - before}')
+
+            # 按时间排序：游标是楼层号，每条评论恰好出现一次，从新到旧
+            comments = crawler.get_comments(aid, pages=None, mode=TIME_MODE)
+            assert [int(c['rpid']) % 100000 for c in comments] == list(range(args.replies - 1, -1, -1))
+            # 页数限制
+            assert len(crawler.get_comments(aid, pages=3, mode=HOT_MODE)) == min(60, args.replies)
+    print('outputs identical')
+
+
+if __name__ == '__main__':
+    main()
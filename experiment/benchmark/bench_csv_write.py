@@ -0,0 +1,104 @@
+import argparse
+import csv
+import filecmp
+import glob
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from scraper_danmu import BilibiliScraper, CSV_HEADER
+from scraper_comment import BilibiliCrawler
+from utils.timefmt import format_timestamp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def reference_danmaku_csv(path, comments, video_info):
+    """改动前 save_data 的CSV写法：每行都调用 datetime.fromtimestamp().strftime()"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        for comment in comments:
+            writer.writerow([
+                video_info['title'], video_info['bvid'], comment['time'], comment['type'], comment['size'],
+                comment['color'], datetime.fromtimestamp(comment['timestamp']).strftime('%Y-%m-%d %H:%M:%S'),
+                comment['pool'], comment['user_hash'], comment['dmid'], comment['content'],
+                comment.get('page'), comment.get('part'),
+            ])
+
+
+def reference_comment_csv(path, comments, video_info):
+    """改动前 save_comments 的CSV写法：每行都格式化一次视频发布时间"""
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, escapechar='\\', quoting=csv.QUOTE_ALL)
+        writer.writerow([
+            '视频标题', '视频BV号', '视频AV号', '作者', '发布时间',
+            '评论用户名', '评论内容', '点赞数', '评论时间', '评论ID', '用户ID'
+        ])
+        for comment in comments:
+            content = comment['content'].replace('\n', ' ').replace('\r', ' ')
+            writer.writerow([
+                video_info['title'], video_info['bvid'], str(video_info['aid']), video_info['owner']['name'],
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(video_info['pubdate'])),
+                comment['user'], content, comment['likes'], comment['reply_time'],
+                comment.get('rpid', ''), comment.get('mid', '')
+            ])
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CSV写入：逐行strftime vs 按天缓存的时间格式化')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--tz', nargs='+', default=[os.environ.get('TZ', 'Asia/Shanghai'), 'America/New_York'],
+                        help='在这些时区下分别校验输出一致')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    random.seed(0)
+    samples = []
+    for path in sorted(glob.glob(os.path.join(ROOT, 'bilibili_data', '*.json'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            samples.extend(json.load(f)['danmaku_data']['comments'])
+    # 时间戳分布在几年内，覆盖夏令时切换
+    comments = [dict(random.choice(samples), timestamp=random.randrange(1500000000, 1730000000))
+                for _ in range(args.rows)]
+    video_info = {'title': 'bench', 'cid': 1, 'bvid': 'BVbench'}
+    replies = [{'user': 'u', 'content': c['content'] or '', 'likes': 1, 'reply_time': format_timestamp(c['timestamp']),
+                'rpid': c['dmid'], 'mid': '1'} for c in comments]
+    crawler_info = {'title': 'bench', 'bvid': 'BVbench', 'aid': 1, 'owner': {'name': 'a'}, 'pubdate': 1714971773}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        scraper = BilibiliScraper(save_dir=os.path.join(tmp, 'danmaku'))
+        crawler = BilibiliCrawler(save_dir=os.path.join(tmp, 'comment'))
+        reference = os.path.join(tmp, 'reference.csv')
+
+        for tz in args.tz:
+            os.environ['TZ'] = tz
+            time.tzset()
+            format_timestamp.clear()
+
+            old = timed(lambda: reference_danmaku_csv(reference, comments, video_info))
+            new = timed(lambda: scraper.save_data({'comments': comments}, video_info, 'csv'))
+            assert filecmp.cmp(reference, scraper.output_paths(video_info, 'csv')[0], shallow=False), tz
+            print(f'{tz:18s} danmaku  {args.rows} rows  strftime {old:6.2f}s  cached {new:6.2f}s  x{old / new:.2f}  identical')
+
+            old = timed(lambda: reference_comment_csv(reference, replies, crawler_info))
+            new = timed(lambda: crawler.save_comments(replies, crawler_info, 'csv'))
+            assert filecmp.cmp(reference, os.path.join(crawler.save_dir, 'bench_comments.csv'), shallow=False), tz
+            print(f'{tz:18s} comments {args.rows} rows  per-row   {old:6.2f}s  hoisted {new:6.2f}s  x{old / new:.2f}  identical')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from utils.bvid_codec import av_to_bv, avs_to_bvs, bvs_to_avs
+from utils.generate_bv import filter_known, stratified_aids, time_strata, uniform_aids, write_bvids
+from utils.video_cache import VideoCache
+from fake_server import load_recorded_fixtures
+
+BASE62 = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def random_string_bvids(count: int, seed: int = 0) -> list:
+    """改动前 generate_bv.py 的做法：BV 加10个随机的62进制字符"""
+    rng = random.Random(seed)
+    return ['BV' + ''.join(rng.choice(BASE62) for _ in range(10)) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BV号生成：随机字符串 vs 按aid范围抽样（有效率、吞吐、按缓存过滤）')
+    parser.add_argument('--count', type=int, default=1000000)
+    args = parser.parse_args()
+
+    # 录制数据中的真实视频作为已知视频，aid范围和发布时间都取自它们
+    fixtures = load_recorded_fixtures()
+    known_aids = sorted(fixture['aid'] for fixture in fixtures.values())
+    low, high = 1, 2000000000  # 2024年aid改成大数之前的连续区间
+    rng = np.random.default_rng(0)
+
+    old = random_string_bvids(min(args.count, 200000))
+    old_aids = bvs_to_avs(old)
+    valid = old_aids != -1
+    in_range = valid & (old_aids >= low) & (old_aids < high)
+    print(f'random strings: {valid.mean():.4%} decode to an aid, {in_range.mean():.6%} fall in [{low}, {high})')
+
+    start = time.perf_counter()
+    aids = uniform_aids(low, high, args.count, rng)
+    sampled = avs_to_bvs(aids)
+    with tempfile.TemporaryDirectory() as tmp:
+        written = write_bvids(os.path.join(tmp, 'bv_list.txt'), sampled, append=False)
+        seconds = time.perf_counter() - start
+        with open(os.path.join(tmp, 'bv_list.txt'), encoding='utf-8') as f:
+            assert f.read().split('\n')[:-1] == sampled.tolist()
+        assert written == args.count and len(set(sampled.tolist())) == args.count
+        assert (bvs_to_avs(sampled) == aids).all() and ((aids >= low) & (aids < high)).all()
+        print(f'aid sampler:    100.0000% decode, 100.000000% fall in range, '
+              f'{args.count / seconds / 1e6:.2f} M ids/s sampled+encoded+written')
+
+        # 已知视频按aid顺序每隔30天发布一个，构成缓存中的 (发布时间, aid) 时间线
+        cache = VideoCache(os.path.join(tmp, 'video_cache.sqlite3'))
+        for i, aid in enumerate(known_aids):
+            cache.put(av_to_bv(aid), {'aid': aid, 'bvid': av_to_bv(aid), 'pubdate': 1500000000 + i * 30 * 86400})
+        timeline = cache.aid_timeline()
+        ranges = time_strata(timeline, timeline[0][0], timeline[-1][0], 4)
+        stratified = stratified_aids(ranges, 4000, rng)
+        counts = [int(((stratified >= lo) & (stratified < hi)).sum()) for lo, hi in ranges]
+        assert sum(counts) == len(stratified) == 4000, counts
+
+        candidates = np.concatenate([avs_to_bvs(known_aids), avs_to_bvs(stratified)])
+        filtered = filter_known(candidates, cache)
+        assert len(filtered) == len(candidates) - len(known_aids)
+        assert not set(filtered.tolist()) & cache.known(candidates.tolist())
+        print(f'stratified: {len(ranges)} aid ranges from cache timeline, {counts} ids per stratum, '
+              f'{len(known_aids)} known ids filtered')
+        cache.close()
+
+if __name__ == '__main__':
+    main()
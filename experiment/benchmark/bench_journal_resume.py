@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from utils.crawl_journal import CrawlJournal, journal_path
+from utils.rate_limiter import get_limiter
+from utils.task_context import bind
+from bench_async_crawl import make_scraper
+from bench_comment_pages import make_crawler
+from fake_server import FakeBilibiliServer
+
+
+def run_child(kind: str, base_url: str, out_dir: str, bv_file: str):
+    """子进程：跑一轮批量爬取，父进程在中途把它杀掉"""
+    logging.disable(logging.INFO)
+    if kind == 'danmaku':
+        scraper = make_scraper(out_dir, base_url)
+        scraper.process_from_file(bv_file, save_format='csv')
+    else:
+        limiter = get_limiter('reply')
+        limiter.rate = limiter.max_rate = 10000.0
+        crawler = make_crawler(out_dir, base_url, 3)
+        crawler.store_path = os.path.join(out_dir, 'store.sqlite3')
+        crawler.process_from_file(bv_file, save_format='sqlite', pages=None)
+
+
+def kill_when(proc: subprocess.Popen, ready) -> None:
+    """等到 ready() 为真时用SIGKILL杀掉子进程，模拟进程被强制结束"""
+    while not ready():
+        assert proc.poll() is None, '子进程在被杀掉之前就结束了'
+        time.sleep(0.05)
+    proc.kill()
+    proc.wait()
+
+
+def journal_lines(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as f:
+        return f.read().count(b'\n')
+
+
+def check_attribution(tmp: str):
+    """
+    并发处理的视频各记各的失败原因和风控：线程池里打出的错误算在提交它的视频上，
+    别的视频被风控不会让同时失败的视频记成待重试
+    """
+    journal = CrawlJournal(os.path.join(tmp, 'attribution.jsonl'))
+    journal.begin(3)
+    logger = logging.getLogger('attribution')
+    limiter = get_limiter('attribution')
+    throttled = asyncio.Event()
+
+    async def executor_error():
+        await asyncio.get_running_loop().run_in_executor(None, bind(lambda: logger.error('分P下载失败: BVexecutor')))
+        await throttled.wait()
+        return False
+
+    async def throttle():
+        limiter.on_throttle()
+        throttled.set()
+        return False
+
+    async def plain():
+        await throttled.wait()
+        return False
+
+    async def run():
+        await asyncio.gather(journal.track_async('BVexecutor', executor_error),
+                             journal.track_async('BVthrottled', throttle),
+                             journal.track_async('BVplain', plain))
+
+    asyncio.run(run())
+    assert journal.get('BVexecutor')['status'] == 'failed', journal.get('BVexecutor')
+    assert journal.get('BVexecutor')['reason'] == '分P下载失败: BVexecutor'
+    assert journal.get('BVthrottled')['status'] == 'retry'
+    assert journal.get('BVplain')['status'] == 'failed' and journal.get('BVplain')['reason'] == '未获取到数据'
+    journal.close()
+    print('attribution: executor error and throttling recorded on their own videos only')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量爬取被杀掉后从断点日志继续（本地替身服务器）')
+    parser.add_argument('--videos', type=int, default=60)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--child', choices=['danmaku', 'comment'], help='内部使用：子进程模式')
+    parser.add_argument('--base-url', help='内部使用')
+    parser.add_argument('--out', help='内部使用')
+    parser.add_argument('--bv-file', help='内部使用')
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.base_url, args.out, args.bv_file)
+        return
+
+    logging.disable(logging.INFO)
+    child = [sys.executable, __file__, '--out']
+    with FakeBilibiliServer(latency=args.latency, danmaku_per_video=200, replies_per_video=2000) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        check_attribution(tmp)
+        bv_file = os.path.join(tmp, 'bv_list.txt')
+        bv_list = [f'BVfail{i:04d}' if i % 20 == 7 else f'BVjournal{i:04d}' for i in range(args.videos)]
+        failures = sum(bvid.startswith('BVfail') for bvid in bv_list)
+        with open(bv_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(bv_list))
+
+        # 弹幕：跑到一半被杀掉，重新运行只处理剩下的视频
+        out = os.path.join(tmp, 'danmaku')
+        path = journal_path(out, bv_file)
+        proc = subprocess.Popen(child + [out, '--child', 'danmaku', '--base-url', server.base_url, '--bv-file', bv_file])
+        kill_when(proc, lambda: journal_lines(path) > args.videos // 2)
+        # 模拟写到一半的最后一行
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write('{"bvid": "BVjour')
+        recorded = journal_lines(path) - 1
+
+        scraper = make_scraper(out, server.base_url)
+        before = server.request_count
+        start = time.perf_counter()
+        scraper.process_from_file(bv_file, save_format='csv')
+        elapsed = time.perf_counter() - start
+        summary = CrawlJournal(path).summary(bv_list)
+        assert summary['done'] == args.videos - failures and summary['failed'] == failures, summary
+        assert all(reason for reason in summary['failures'].values())
+        print(f'danmaku  killed after {recorded} records, resumed {args.videos - recorded} videos  '
+              f'{elapsed:6.2f}s  requests={server.request_count - before}')
+
+        before = server.request_count
+        scraper.process_from_file(bv_file, save_format='csv', retry_failed=True)
+        assert server.request_count - before == failures, '只重试失败的视频'
+        print(f'danmaku  retry_failed: {failures} videos, requests={server.request_count - before}')
+
+        # 上一轮跑完之后再运行，从头开始
+        scraper.process_from_file(bv_file, save_format='csv')
+        assert os.path.exists(path + '.prev')
+        assert CrawlJournal(path).summary(bv_list)['done'] == args.videos - failures
+
+        # 评论写入数据库：在一个视频翻页到一半时被杀掉，从记录的游标继续
+        out = os.path.join(tmp, 'comment')
+        with open(bv_file, 'w', encoding='utf-8') as f:
+            f.write('BVjournalreply')
+        path = journal_path(out, bv_file)
+        proc = subprocess.Popen(child + [out, '--child', 'comment', '--base-url', server.base_url, '--bv-file', bv_file])
+        kill_when(proc, lambda: journal_lines(path) > 30)
+        before = server.reply_requests
+        crawler = make_crawler(out, server.base_url, 3)
+        crawler.store_path = os.path.join(out, 'store.sqlite3')
+        crawler.process_from_file(bv_file, save_format='sqlite', pages=None)
+        resumed = server.reply_requests - before
+        conn = sqlite3.connect(crawler.store_path)
+        rows, distinct = conn.execute('SELECT COUNT(*), COUNT(DISTINCT rpid) FROM comments').fetchone()
+        assert rows == distinct == 2000, rows
+        assert resumed < 100
+        print(f'comment  resumed from cursor: {resumed}/100 pages requested, {rows} comments stored')
+
+
+if __name__ == '__main__':
+    main()
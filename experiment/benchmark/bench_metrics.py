@@ -0,0 +1,112 @@
+import argparse
+import json
+import logging
+import os
+import re
+import socket
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from scraper_comment import BilibiliCrawler
+from utils.metrics import REGISTRY, REQUEST_SECONDS, Histogram
+from utils.rate_limiter import get_limiter
+from bench_async_crawl import make_scraper
+from bench_comment_pages import make_crawler
+from fake_server import FakeBilibiliServer
+
+_SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})? (-?[0-9.e+]+|\+Inf)$')
+
+
+def parse_exposition(text: str) -> dict:
+    """解析Prometheus文本格式，顺便检查每一行的格式"""
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith('#'):
+            assert line.startswith(('# HELP ', '# TYPE ')), line
+            continue
+        match = _SAMPLE.match(line)
+        assert match, line
+        samples[match.group(1) + (match.group(2) or '')] = float(match.group(3))
+    return samples
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='指标采集：Prometheus接口、运行结束的JSON汇总和采集开销（本地替身服务器）')
+    parser.add_argument('--videos', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.02)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    port = free_port()
+    with FakeBilibiliServer(latency=args.latency, danmaku_per_video=500, replies_per_video=100) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        bv_file = os.path.join(tmp, 'bv_list.txt')
+        bv_list = [f'BVfail{i:04d}' if i % 10 == 3 else f'BVmetric{i:04d}' for i in range(args.videos)]
+        with open(bv_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(bv_list))
+        failures = sum(bvid.startswith('BVfail') for bvid in bv_list)
+
+        scraper = make_scraper(os.path.join(tmp, 'danmaku'), server.base_url)
+        BilibiliCrawler(save_dir=os.path.join(tmp, 'unused'), metrics_port=port)
+        scraper.process_from_file(bv_file, save_format='csv')
+        limiter = get_limiter('reply')
+        limiter.rate = limiter.max_rate = 10000.0
+        crawler = make_crawler(os.path.join(tmp, 'comment'), server.base_url, 3)
+        crawler.process_from_file(bv_file, save_format='json', pages=None)
+
+        text = urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics').read().decode('utf-8')
+        samples = parse_exposition(text)
+        requests = sum(value for name, value in samples.items() if name.startswith('bilibili_request_seconds_count'))
+        assert requests == server.request_count, (requests, server.request_count)
+        for endpoint in ('view', 'danmaku', 'reply'):
+            count = samples[f'bilibili_request_seconds_count{{endpoint="{endpoint}"}}']
+            assert samples[f'bilibili_request_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}}'] == count
+        # 弹幕和评论爬虫都要请求一次视频信息
+        assert samples['bilibili_errors_total{endpoint="view",type="api_-404"}'] == 2 * failures, samples
+        assert samples['bilibili_items_total{kind="danmaku"}'] == 500 * (args.videos - failures)
+        assert samples['bilibili_items_total{kind="comments"}'] == 100 * (args.videos - failures)
+        assert samples['bilibili_videos_total{status="done"}'] == 2 * (args.videos - failures)
+        downloaded = samples['bilibili_downloaded_bytes_total{endpoint="danmaku"}']
+        assert downloaded > 0
+        print(f'/metrics: {len(samples)} samples, {int(requests)} requests, {int(downloaded)} danmaku bytes')
+
+        def read_summary(kind: str) -> dict:
+            directory = os.path.join(tmp, kind, 'metrics')
+            with open(os.path.join(directory, os.listdir(directory)[0]), 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        # 每轮的汇总只统计这一轮，评论爬虫的汇总不包含同一进程中之前弹幕爬虫的数据
+        danmaku_summary, summary = read_summary('danmaku'), read_summary('comment')
+        assert danmaku_summary['metrics']['bilibili_parse_seconds']['danmaku']['count'] == args.videos - failures
+        assert danmaku_summary['metrics']['bilibili_write_seconds']['danmaku/csv']['count'] == args.videos - failures
+        assert set(danmaku_summary['per_second']) == {'danmaku'}
+        assert set(summary['per_second']) == {'comments'}
+        assert 'danmaku' not in summary['metrics']['bilibili_parse_seconds'], summary
+        remote = json.loads(urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics.json').read())
+        assert remote['metrics'].keys() == summary['metrics'].keys()
+        print(f"summary: {danmaku_summary['per_second']} / {summary['per_second']} per second, "
+              f"request p95={danmaku_summary['metrics']['bilibili_request_seconds']['danmaku']['p95']}s")
+
+    # 每次记录的开销，和一次请求的耗时相比可以忽略
+    histogram = Histogram('bench_seconds', '', ['endpoint'])
+    n = 200000
+    start = time.perf_counter()
+    for i in range(n):
+        histogram.observe(0.03, 'danmaku')
+    elapsed = time.perf_counter() - start
+    print(f'observe: {elapsed / n * 1e6:.2f} us per call, {len(REGISTRY.render())} bytes exposition')
+    assert REQUEST_SECONDS.summary()
+
+
+if __name__ == '__main__':
+    main()
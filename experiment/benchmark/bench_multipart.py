@@ -0,0 +1,48 @@
+import argparse
+import csv
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from bench_async_crawl import make_scraper
+from fake_server import FakeBilibiliServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多P视频：逐P下载 vs 所有分P并发下载（本地替身服务器）')
+    parser.add_argument('--parts', type=int, default=24, help='每个视频的分P数')
+    parser.add_argument('--latency', type=float, default=0.1, help='模拟的单次请求延迟（秒）')
+    parser.add_argument('--danmaku', type=int, default=500, help='每P的弹幕条数')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--source', choices=['xml', 'seg'], default='xml')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    with FakeBilibiliServer(latency=args.latency, danmaku_per_video=args.danmaku,
+                            parts_per_video=args.parts) as server:
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory() as tmp:
+                scraper = make_scraper(tmp, server.base_url)
+                scraper.danmaku_source = args.source
+                scraper.part_workers = workers
+                scraper.get_video_pages('BVbenchparts')
+
+                start = time.perf_counter()
+                assert scraper.process_video('BVbenchparts', save_format='csv')
+                elapsed = time.perf_counter() - start
+
+                csv_path = scraper.output_paths(scraper.get_video_info('BVbenchparts'), 'csv')[0]
+                with open(csv_path, 'r', encoding='utf-8') as f:
+                    rows = list(csv.DictReader(f))
+                assert len(rows) == args.parts * args.danmaku
+                assert {row['分P'] for row in rows} == {str(i) for i in range(1, args.parts + 1)}
+                print(f'part_workers={workers:<3d} parts={args.parts:3d}  rows={len(rows):7d}  {elapsed:8.2f}s')
+
+
+if __name__ == '__main__':
+    main()
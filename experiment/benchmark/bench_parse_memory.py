@@ -0,0 +1,110 @@
+import argparse
+import filecmp
+import gc
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+
+def write_synthetic_xml(path: str, count: int):
+    """分块写出一个包含count条弹幕的XML文件，生成过程本身不占用大量内存"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?><i><chatserver>chat.bilibili.com</chatserver>'
+                '<chatid>1</chatid><mission>0</mission><maxlimit>%d</maxlimit><state>0</state>'
+                '<real_name>0</real_name><source>k-v</source>\n' % count)
+        batch = []
+        for i in range(count):
+            batch.append(f'<d p="{i * 0.013:.3f},1,25,16777215,{1700000000 + i // 7},0,{i * 2654435761 & 0xffffffff:x},'
+                         f'{1500000000000000000 + i},11">第{i}条弹幕 &lt;测试&gt;</d>\n')
+            if len(batch) == 10000:
+                f.write(''.join(batch))
+                batch.clear()
+        f.write(''.join(batch))
+        f.write('</i>')
+
+
+MODES = ['tree', 'stream', 'fast', 'batch']
+
+
+def run_mode(mode: str, xml_path: str, out_dir: str):
+    """在子进程中运行，单独统计峰值内存"""
+    from scraper_danmu import BilibiliScraper
+
+    logging.disable(logging.INFO)
+    engine = {'tree': 'etree', 'fast': 'fast', 'batch': 'batch'}.get(mode, 'etree')
+    scraper = BilibiliScraper(save_dir=out_dir, xml_engine=engine)
+    video_info = {'title': 'bench', 'cid': 1, 'bvid': 'BVbench'}
+
+    start = time.perf_counter()
+    if mode != 'stream':
+        with open(xml_path, 'r', encoding='utf-8') as f:
+            data = scraper.parse_xml(f.read())
+        scraper.save_data(data, video_info)
+    else:
+        def chunks():
+            with open(xml_path, 'rb') as f:
+                while True:
+                    chunk = f.read(64 * 1024)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        info, comments = scraper.parse_xml_stream(chunks())
+        scraper.save_data_stream(info, comments, video_info)
+    elapsed = time.perf_counter() - start
+
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if mode == 'stream':
+        print(f'{mode:6s}  {elapsed:8.2f}s  peak RSS {peak_mb:9.1f} MB')
+        return
+
+    # 解析结果本身常驻的内存，多P视频和批量处理时要同时持有多份
+    del data
+    with open(xml_path, 'r', encoding='utf-8') as f:
+        xml_content = f.read()
+    gc.collect()
+    tracemalloc.start()
+    data = scraper.parse_xml(xml_content)
+    gc.collect()
+    retained_mb = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+    print(f'{mode:6s}  {elapsed:8.2f}s  peak RSS {peak_mb:9.1f} MB  parsed data {retained_mb:7.1f} MB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='整棵树解析、流式解析、紧凑弹幕容器的峰值内存对比')
+    parser.add_argument('--count', type=int, default=1000000, help='合成XML中的弹幕条数')
+    parser.add_argument('--mode', choices=MODES, help='内部使用：只运行一种模式')
+    parser.add_argument('--xml', help='内部使用：XML文件路径')
+    parser.add_argument('--out', help='内部使用：输出目录')
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.xml, args.out)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_path = os.path.join(tmp, 'danmaku.xml')
+        write_synthetic_xml(xml_path, args.count)
+        print(f'synthetic XML: {args.count} danmaku, {os.path.getsize(xml_path) / 1024 / 1024:.1f} MB')
+        for mode in MODES:
+            subprocess.run([sys.executable, __file__, '--mode', mode, '--xml', xml_path,
+                            '--out', os.path.join(tmp, mode)], check=True)
+
+        # 各种方式保存的JSON和CSV应当逐字节相同
+        for name in sorted(os.listdir(os.path.join(tmp, 'tree'))):
+            for mode in MODES[1:]:
+                assert filecmp.cmp(os.path.join(tmp, 'tree', name), os.path.join(tmp, mode, name), shallow=False), \
+                    (mode, name)
+        print('outputs identical')
+
+
+if __name__ == '__main__':
+    main()
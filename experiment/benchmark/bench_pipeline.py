@@ -0,0 +1,109 @@
+import argparse
+import filecmp
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from utils.crawl_journal import CrawlJournal, journal_path
+from utils.metrics import WRITE_SECONDS
+from utils.pipeline import Pipeline, Stage
+from bench_async_crawl import make_scraper
+from fake_server import FakeBilibiliServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='逐个视频处理 vs 下载/解析/写入三阶段流水线（本地替身服务器）')
+    parser.add_argument('--videos', type=int, default=40)
+    parser.add_argument('--latency', type=float, default=0.05, help='模拟的单次请求延迟（秒）')
+    parser.add_argument('--danmaku', type=int, default=8000, help='每个视频的弹幕条数')
+    parser.add_argument('--engine', default='etree', choices=['etree', 'fast', 'batch'])
+    parser.add_argument('--format', default='both')
+    parser.add_argument('--parse-workers', type=int, default=4)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    print(f'cpus={os.cpu_count()}  parse workers={args.parse_workers}  engine={args.engine}  format={args.format}')
+    with FakeBilibiliServer(latency=args.latency, danmaku_per_video=args.danmaku) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        bv_file = os.path.join(tmp, 'bv_list.txt')
+        bv_list = [f'BVfail{i:04d}' if i % 20 == 7 else f'BVpipe{i:04d}' for i in range(args.videos)]
+        with open(bv_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(bv_list))
+
+        failures = len([bvid for bvid in bv_list if bvid.startswith('BVfail')])
+        outputs = {}
+        for mode in ('sequential', 'pipeline'):
+            out = os.path.join(tmp, mode)
+            scraper = make_scraper(out, server.base_url)
+            scraper.xml_engine = args.engine
+            writes_before = WRITE_SECONDS.values().get(('danmaku', args.format), [None, 0, 0])[2]
+            start = time.perf_counter()
+            if mode == 'pipeline':
+                scraper.process_pipeline(bv_list, args.format, parse_workers=args.parse_workers,
+                                         journal=scraper.open_journal(bv_file, bv_list, True, False))
+            else:
+                scraper.process_from_file(bv_file, save_format=args.format)
+            elapsed = time.perf_counter() - start
+            summary = CrawlJournal(journal_path(out, bv_file)).summary(bv_list)
+            assert summary['failed'] == failures, summary
+            # 所有保存格式的写文件都在写入阶段完成并计入写入耗时
+            writes = WRITE_SECONDS.values().get(('danmaku', args.format), [None, 0, 0])[2] - writes_before
+            assert writes == summary['done'], (mode, writes, summary)
+            outputs[mode] = sorted(name for name in os.listdir(out) if name.endswith(('.json', '.csv', '.parquet')))
+            print(f'{mode:10s} {elapsed:7.2f}s  done={summary["done"]} failed={summary["failed"]}')
+
+        assert outputs['sequential'] == outputs['pipeline'] and outputs['pipeline']
+        for name in outputs['pipeline']:
+            a, b = os.path.join(tmp, 'sequential', name), os.path.join(tmp, 'pipeline', name)
+            if name.endswith('.parquet'):
+                assert pq.read_table(a).equals(pq.read_table(b)), name
+            else:
+                assert filecmp.cmp(a, b, shallow=False), name
+
+        # 写入阶段抛出异常（这里是更新变化检测清单失败）时，这批中还没完成的视频记入断点日志，下一轮重新处理
+        out = os.path.join(tmp, 'write_error')
+        scraper = make_scraper(out, server.base_url)
+        broken = bv_list[3]
+        update = scraper.manifest.update
+
+        def update_or_fail(**record):
+            if record['bvid'] == broken:
+                raise OSError('磁盘已满')
+            update(**record)
+
+        scraper.manifest.update = update_or_fail
+        journal = scraper.open_journal(bv_file, bv_list, True, False)
+        scraper.process_pipeline(bv_list, args.format, parse_workers=args.parse_workers, journal=journal)
+        assert journal.get(broken)['status'] == 'failed' and '磁盘已满' in journal.get(broken)['reason']
+        summary = journal.summary(bv_list)
+        assert summary['pending'] == 0 and summary['done'] == len(bv_list) - failures - 1, summary
+        scraper.manifest.update = update
+        scraper.process_pipeline([broken], args.format, parse_workers=args.parse_workers,
+                                 journal=scraper.open_journal(bv_file, bv_list, True, True))
+        assert CrawlJournal(journal_path(out, bv_file)).get(broken)['status'] == 'done'
+        print(f'write stage error: {broken} recorded as failed, done on retry')
+
+        # 背压：写入很慢时上游停下来等待，每个队列都不超过容量
+        queue_size = 2
+        pipeline = Pipeline([
+            Stage('fetch', lambda i: bytes(1 << 20), workers=4, queue_size=queue_size),
+            Stage('parse', len, workers=2, queue_size=queue_size),
+            Stage('write', lambda batch: time.sleep(0.05), queue_size=queue_size, batch_size=2),
+        ])
+        pipeline.run(range(40))
+        stats = pipeline.stats()
+        assert all(stage['max_depth'] <= queue_size for stage in stats.values()), stats
+        assert stats['write']['processed'] == 40 and stats['parse']['blocked_seconds'] > 0.5, stats
+        print(f"slow writer: max depths {[stage['max_depth'] for stage in stats.values()]}, "
+              f"parse blocked {stats['parse']['blocked_seconds']}s, fetch blocked {stats['fetch']['blocked_seconds']}s")
+    print('outputs identical')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import argparse
+import filecmp
+import glob
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import zlib
+
+import zstandard as zstd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from reprocess import reprocess
+from utils.rate_limiter import get_limiter
+from utils.raw_archive import RawArchive
+from bench_async_crawl import make_scraper
+from bench_comment_pages import make_crawler
+from fake_server import ROOT, FakeBilibiliServer, load_recorded_fixtures, make_danmaku_xml
+
+
+def recorded_xml_samples(window: int) -> list:
+    """把 bilibili_data 中保存的弹幕按 window 条切开，还原成一批接口返回的XML"""
+    samples = []
+    for i, path in enumerate(sorted(glob.glob(os.path.join(ROOT, 'bilibili_data', '*.json')))):
+        with open(path, 'r', encoding='utf-8') as f:
+            comments = json.load(f)['danmaku_data']['comments']
+        for start in range(0, len(comments), window):
+            samples.append(make_danmaku_xml(i * 1000 + start, comments=comments[start:start + window]).encode('utf-8'))
+    return samples
+
+
+def compare_compression(samples: list):
+    """一半样本训练字典，另一半比较压缩比和速度"""
+    train, test = samples[::2], samples[1::2]
+    raw = sum(map(len, test))
+    trained = zstd.train_dictionary(112640, train)
+    trained.precompute_compress(level=3)
+    codecs = [
+        ('zlib-6', lambda body: zlib.compress(body, 6)),
+        ('zstd-3', zstd.ZstdCompressor(level=3).compress),
+        ('zstd-19', zstd.ZstdCompressor(level=19).compress),
+        ('zstd-3+dict', zstd.ZstdCompressor(level=3, dict_data=trained).compress),
+    ]
+    print(f'{len(train)} training / {len(test)} test XML samples, {raw / len(test) / 1024:.1f} KB average')
+    for name, compress in codecs:
+        start = time.perf_counter()
+        stored = sum(len(compress(body)) for body in test)
+        elapsed = time.perf_counter() - start
+        print(f'{name:12s} ratio {raw / stored:6.2f}  {raw / elapsed / 1e6:8.1f} MB/s')
+
+
+def compare_outputs(a: str, b: str) -> int:
+    names = sorted(name for name in os.listdir(a) if name.endswith(('.json', '.csv')))
+    assert names and names == sorted(name for name in os.listdir(b) if name.endswith(('.json', '.csv'))), (a, b)
+    for name in names:
+        assert filecmp.cmp(os.path.join(a, name), os.path.join(b, name), shallow=False), name
+    return len(names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='原始响应存档：压缩比，以及从存档离线重新处理与在线爬取的输出对比')
+    parser.add_argument('--videos', type=int, default=80)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--window', type=int, default=100, help='切分录制弹幕时每份XML的弹幕条数')
+    args = parser.parse_args()
+
+    compare_compression(recorded_xml_samples(args.window))
+
+    logging.disable(logging.INFO)
+    fixtures = load_recorded_fixtures()
+    with FakeBilibiliServer(latency=args.latency, danmaku_per_video=2000, replies_per_video=200,
+                            fixtures=fixtures) as server, tempfile.TemporaryDirectory() as tmp:
+        archive_path = os.path.join(tmp, 'raw_archive.sqlite3')
+        bv_file = os.path.join(tmp, 'bv_list.txt')
+        bv_list = list(fixtures) + [f'BVarchive{i:04d}' for i in range(args.videos - len(fixtures))]
+        with open(bv_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(bv_list))
+        limiter = get_limiter('reply')
+        limiter.rate = limiter.max_rate = 10000.0
+
+        timings = {}
+        for name, archived in (('plain', False), ('archived', True)):
+            scraper = make_scraper(os.path.join(tmp, f'{name}_danmaku'), server.base_url)
+            crawler = make_crawler(os.path.join(tmp, f'{name}_comments'), server.base_url, 3)
+            if archived:
+                scraper.archive = crawler.archive = RawArchive(archive_path)
+            start = time.perf_counter()
+            scraper.process_from_file(bv_file, save_format='both')
+            crawler.process_from_file(bv_file, save_format='both', pages=None)
+            timings[name] = time.perf_counter() - start
+        print(f"crawl: {timings['plain']:.2f}s without archive, {timings['archived']:.2f}s with archive")
+        for endpoint, stats in scraper.archive.stats().items():
+            print(f"  {endpoint:10s} {stats['responses']:5d} responses  {stats['raw_bytes'] / 1e6:7.2f} MB -> "
+                  f"{stats['stored_bytes'] / 1e6:6.2f} MB  ratio {stats['ratio']}")
+
+        requests = server.request_count
+        for kind in ('danmaku', 'comments'):
+            out = os.path.join(tmp, f'reprocessed_{kind}')
+            result = reprocess(kind, bv_list, archive_path, out, 'both', cache_path=None)
+            assert result['done'] == len(bv_list), result
+            files = compare_outputs(os.path.join(tmp, f'archived_{kind}'), out)
+            print(f"reprocess {kind:8s} {result['seconds']:6.2f}s  {len(bv_list) / result['seconds']:7.1f} videos/s  "
+                  f"{files} files identical")
+        assert server.request_count == requests, '重新处理时不应发出请求'
+    print('no requests during reprocess')
+
+
+if __name__ == '__main__':
+    main()
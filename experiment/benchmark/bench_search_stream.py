@@ -0,0 +1,96 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from utils import search_bv
+from utils.rate_limiter import get_limiter
+from utils.seen_set import open_seen_set
+from fake_server import SEARCH_SPAN, FakeBilibiliServer
+from run_benchmarks import peak_rss_mb
+
+
+def child(mode: str, base_url: str, out: str, seen_path: str, offset: int):
+    """在子进程中爬一遍搜索结果，最后一行输出JSON，峰值内存只包含爬虫本身"""
+    logging.disable(logging.INFO)
+    search_bv.SEARCH_API_URL = f'{base_url}/x/web-interface/search/type'
+    limiter = get_limiter('search')
+    limiter.rate = limiter.max_rate = 10000.0
+    csv_file, bv_file = os.path.join(out, 'videos.csv'), os.path.join(out, 'bv.txt')
+    start_time, end_time = SEARCH_SPAN[0] + offset, SEARCH_SPAN[1] - 1
+    stats = {}
+    start = time.perf_counter()
+    if mode == 'list':
+        video_list = search_bv.search_videos('视频', start_time, end_time, 8, stats=stats)
+        search_bv.save_to_csv(video_list, csv_file)
+        search_bv.save_bv_to_txt(video_list, bv_file)
+        stats['written'] = len(video_list)
+    else:
+        seen = open_seen_set(seen_path)
+        search_bv.crawl_to_files('视频', start_time, end_time, csv_file, bv_file, seen, 8, stats=stats)
+        seen.close()
+    stats['seconds'] = time.perf_counter() - start
+    stats['peak_rss_mb'] = peak_rss_mb()
+    print(json.dumps(stats))
+
+
+def run(mode: str, base_url: str, out: str, seen_path: str = '', offset: int = 0) -> dict:
+    os.makedirs(out, exist_ok=True)
+    process = subprocess.run([sys.executable, __file__, '--child', mode, '--base-url', base_url, '--out', out,
+                              '--seen', seen_path, '--offset', str(offset)], capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr)
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def read_bv(out: str) -> list:
+    with open(os.path.join(out, 'bv.txt'), 'r', encoding='utf-8') as f:
+        return f.read().split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='搜索结果：全部放在内存最后写出 vs 逐页去重追加写出（本地替身服务器）')
+    parser.add_argument('--results', type=int, nargs='+', default=[20000, 80000], help='替身服务器上的搜索结果数')
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    parser.add_argument('--out', help=argparse.SUPPRESS)
+    parser.add_argument('--seen', help=argparse.SUPPRESS)
+    parser.add_argument('--offset', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.base_url, args.out, args.seen, args.offset)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in args.results:
+            with FakeBilibiliServer(latency=args.latency, search_results=count) as server:
+                expected = {video['bvid'] for video in server.httpd.search_videos}
+                for mode in ('list', 'stream'):
+                    out = os.path.join(tmp, f'{mode}_{count}')
+                    result = run(mode, server.base_url, out, os.path.join(out, 'seen.sqlite3'))
+                    assert set(read_bv(out)) == expected
+                    print(f"{count:6d} results  {mode:6s}  written={result['written']:6d}  {result['seconds']:6.2f}s  "
+                          f"peak RSS {result['peak_rss_mb']:6.1f} MB")
+
+                # 再跑一遍错开半天的时间窗口：与第一遍全部重叠，不应再写出任何结果
+                for seen_name in ('seen.sqlite3', 'seen.bloom'):
+                    out = os.path.join(tmp, f'rerun_{count}_{seen_name}')
+                    seen_path = os.path.join(out, seen_name)
+                    run('stream', server.base_url, out, seen_path)
+                    result = run('stream', server.base_url, out, seen_path, offset=43200)
+                    bv_list = read_bv(out)
+                    assert result['written'] == 0 and result['duplicates'] > 0, result
+                    assert len(bv_list) == len(set(bv_list)) and set(bv_list) == expected
+                    print(f"{count:6d} results  rerun {seen_name:12s}  written=0  duplicates={result['duplicates']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from utils import search_bv
+from utils.rate_limiter import get_limiter
+from fake_server import SEARCH_SPAN, FakeBilibiliServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='搜索：逐天逐页顺序爬取 vs 并发时间窗口+自动切分（本地替身服务器）')
+    parser.add_argument('--results', type=int, default=60000, help='替身服务器上的搜索结果数')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--error-rate', type=float, default=0.05, help='检查失败重试时替身服务器返回502的比例')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    limiter = get_limiter('search')
+    limiter.rate = limiter.max_rate = 10000.0
+    start_time, end_time = SEARCH_SPAN[0], SEARCH_SPAN[1] - 1
+    with FakeBilibiliServer(latency=args.latency, search_results=args.results) as server:
+        search_bv.SEARCH_API_URL = f'{server.base_url}/x/web-interface/search/type'
+        expected = {video['bvid'] for video in server.httpd.search_videos}
+
+        # 原来的做法：一天一个窗口，每个窗口顺序翻页
+        start = time.perf_counter()
+        sequential = []
+        for begin, end in search_bv.day_windows(start_time, end_time):
+            sequential += search_bv.get_bilibili_search_results('视频', begin, end, search_bv.SEARCH_PAGE_CAP + 1)
+        sequential_seconds = time.perf_counter() - start
+        sequential_requests = server.search_requests
+
+        stats = {}
+        start = time.perf_counter()
+        found = search_bv.search_videos('视频', start_time, end_time, args.workers, stats=stats)
+        concurrent_seconds = time.perf_counter() - start
+        concurrent_requests = server.search_requests - sequential_requests
+
+    bvids = [video['BV号'] for video in found]
+    assert len(bvids) == len(set(bvids)), '时间窗口之间不应有重复结果'
+    assert set(bvids) == expected, (len(expected), len(set(bvids)))
+    print(f'{len(expected)} videos on server')
+    print(f'sequential: {len({v["BV号"] for v in sequential}):6d} found  {sequential_requests:5d} requests  '
+          f'{sequential_seconds:6.2f}s')
+    print(f'concurrent: {len(set(bvids)):6d} found  {concurrent_requests:5d} requests  {concurrent_seconds:6.2f}s  '
+          f'split={stats["split"]} truncated={stats["truncated"]} failed={stats["failed"]}  '
+          f'({sequential_seconds / concurrent_seconds:.1f}x)')
+
+    # 服务器随机返回502时，失败的页重新排队，结果仍然完整
+    flaky_stats = {}
+    with FakeBilibiliServer(latency=args.latency, search_results=args.results, error_rate=args.error_rate,
+                            seed=1) as server:
+        search_bv.SEARCH_API_URL = f'{server.base_url}/x/web-interface/search/type'
+        flaky = search_bv.search_videos('视频', start_time, end_time, args.workers, stats=flaky_stats)
+        errors = server.httpd.error_count
+    assert errors and flaky_stats['retried'], '替身服务器应当返回过502'
+    assert not flaky_stats['failed'] and not flaky_stats['missing'], flaky_stats['missing']
+    assert {video['BV号'] for video in flaky} == expected
+    print(f'flaky:      {errors} errors injected  retried={flaky_stats["retried"]} failed={flaky_stats["failed"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from bench_async_crawl import make_scraper
+from fake_server import FakeBilibiliServer, make_fixture
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def load_fixtures():
+    """用 bilibili_data 中保存的弹幕生成录制数据，同一批弹幕分别以XML和分段protobuf提供"""
+    fixtures = {}
+    for i, path in enumerate(sorted(glob.glob(os.path.join(ROOT, 'bilibili_data', '*.json'))), 1):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        fixtures[f'BVfixture{i:04d}'] = make_fixture(i, data['video_info']['title'], data['danmaku_data']['comments'])
+    return fixtures
+
+
+def sort_key(comment):
+    return comment['time'], int(comment['dmid'])
+
+
+def check_identical(scraper, bvid: str) -> int:
+    """XML接口和分段接口拿到的弹幕必须完全一致，返回弹幕条数"""
+    video_info = scraper.get_video_info(bvid)
+    reference = sorted(scraper.parse_xml(scraper.get_danmaku(video_info['cid']))['comments'], key=sort_key)
+    segments = scraper.get_danmaku_segments(str(video_info['cid']), scraper.get_video_duration(video_info))
+    merged = scraper.merge_segments(str(video_info['cid']), segments)['comments']
+    assert merged == reference, f'分段弹幕与XML弹幕不一致: {video_info["title"]}'
+    return len(merged)
+
+
+def check_source_switch(base_url: str, bvid: str):
+    """
+    变化检测清单记录弹幕来源：XML（会截断）爬过的视频换成分段再爬时，弹幕数没变也要重新下载；
+    再用分段爬一次才按弹幕数跳过
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        scraper = make_scraper(tmp, base_url)
+        assert scraper.process_video(bvid, 'csv')
+        scraper.danmaku_source = 'seg'
+        assert scraper.process_video(bvid, 'csv')
+        assert scraper.manifest.stats()['changed'] == 2, scraper.manifest.stats()
+        assert scraper.process_video(bvid, 'csv')
+        assert scraper.manifest.stats()['count_unchanged'] == 1, scraper.manifest.stats()
+        entry = scraper.manifest.get(str(scraper.get_video_info(bvid)['cid']))
+        assert (entry['source'], entry['parts']) == ('seg', 1), entry
+    print('source switch xml -> seg re-downloaded despite unchanged danmaku count')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分段protobuf弹幕：与XML结果对比，以及分段并发带来的提速')
+    parser.add_argument('--latency', type=float, default=0.1, help='模拟的单次请求延迟（秒）')
+    parser.add_argument('--danmaku', type=int, default=30000, help='长视频测试中每个视频的弹幕条数')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    fixtures = load_fixtures()
+
+    with FakeBilibiliServer(latency=0, fixtures=fixtures) as server, tempfile.TemporaryDirectory() as tmp:
+        scraper = make_scraper(tmp, server.base_url)
+        for bvid, fixture in fixtures.items():
+            count = check_identical(scraper, bvid)
+            print(f'identical  {count:7d} danmaku  {len(fixture["segments"]):3d} segments  {fixture["title"]}')
+        check_source_switch(server.base_url, next(iter(fixtures)))
+
+    # 合成长视频：弹幕均匀分布在整个时长上
+    with FakeBilibiliServer(latency=args.latency, danmaku_per_video=args.danmaku) as server:
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory() as tmp:
+                scraper = make_scraper(tmp, server.base_url)
+                scraper.segment_workers = workers
+                video_info = scraper.get_video_info('BVbenchlong')
+                duration = scraper.get_video_duration(video_info)
+
+                start = time.perf_counter()
+                segments = scraper.get_danmaku_segments(str(video_info['cid']), duration)
+                data = scraper.merge_segments(str(video_info['cid']), segments)
+                elapsed = time.perf_counter() - start
+                print(f'workers={workers:<3d} segments={len(segments):4d}  danmaku={len(data["comments"]):7d}  '
+                      f'{elapsed:8.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from scraper_danmu import BilibiliScraper
+from scraper_comment import BilibiliCrawler
+from utils.sqlite_store import SQLiteStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def load_samples(directory: str):
+    samples = []
+    for path in sorted(glob.glob(os.path.join(ROOT, directory, '*.json'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            samples.append(json.load(f))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite存储：重复写入去重和按索引查询')
+    parser.add_argument('--rounds', type=int, default=2, help='重复写入同一批数据的次数')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    danmaku_samples = load_samples('bilibili_data')
+    comment_samples = load_samples('bilibili_comment_data')
+    total = sum(len(s['danmaku_data']['comments']) for s in danmaku_samples)
+    expected_dmids = {c['dmid'] for s in danmaku_samples for c in s['danmaku_data']['comments']}
+    expected_rpids = {c['rpid'] for s in comment_samples for c in s['comments_data']}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SQLiteStore(os.path.join(tmp, 'bilibili.sqlite3'))
+        scraper = BilibiliScraper(save_dir=os.path.join(tmp, 'danmaku'))
+        crawler = BilibiliCrawler(save_dir=os.path.join(tmp, 'comment'))
+        scraper.store_path = crawler.store_path = store.path
+
+        for round_no in range(1, args.rounds + 1):
+            start = time.perf_counter()
+            added = sum(scraper.store.save_danmaku(s['video_info'], s['danmaku_data']['comments'])
+                        for s in danmaku_samples)
+            for s in comment_samples:
+                info = s['video_info']
+                video_info = {'title': info['title'], 'bvid': info['bvid'], 'aid': info['aid'],
+                              'owner': {'name': info['author']},
+                              'pubdate': time.mktime(time.strptime(info['pub_date'], '%Y-%m-%d %H:%M:%S'))}
+                crawler.save_comments(s['comments_data'], video_info, 'sqlite')
+            elapsed = time.perf_counter() - start
+            print(f'round {round_no}: {total} danmaku offered, {added} added  {elapsed:6.2f}s  {store.stats()}')
+
+        stats = store.stats()
+        assert stats['danmaku'] == len(expected_dmids), '弹幕按dmid去重后的行数不对'
+        assert stats['comments'] == len(expected_rpids), '评论按rpid去重后的行数不对'
+
+        conn = store._conn
+        bvid = danmaku_samples[0]['video_info']['bvid']
+        for sql, params in (
+                ('SELECT COUNT(*) FROM danmaku WHERE bvid = ?', (bvid,)),
+                ('SELECT COUNT(*) FROM danmaku WHERE timestamp BETWEEN ? AND ?', (1700000000, 1720000000)),
+                ('SELECT bvid, COUNT(*) FROM danmaku WHERE user_hash = ? GROUP BY bvid', ('49818c8a',)),
+                ('SELECT COUNT(*) FROM comments WHERE mid = ?', (1,)),
+        ):
+            plan = ' | '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params))
+            start = time.perf_counter()
+            result = conn.execute(sql, params).fetchall()
+            print(f'{(time.perf_counter() - start) * 1000:7.2f} ms  {plan}  -> {result[:3]}')
+            assert 'USING' in plan and 'INDEX' in plan, f'查询没有用到索引: {sql}'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import csv
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from scraper_comment import SUB_REPLY_PAGE_SIZE, BilibiliCrawler
+from utils.rate_limiter import get_limiter
+from bench_comment_pages import make_crawler
+from fake_server import FakeBilibiliServer, make_replies, make_sub_replies, sub_reply_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='楼中楼回复：逐楼请求 vs 按回复数优先的并发抓取（本地替身服务器）')
+    parser.add_argument('--replies', type=int, default=200, help='每个视频的一级评论条数')
+    parser.add_argument('--latency', type=float, default=0.1, help='模拟的单次请求延迟（秒）')
+    parser.add_argument('--rate', type=float, default=50.0, help='评论接口的限速（请求/秒），一级评论和楼中楼共用')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    limiter = get_limiter('reply')
+    limiter.rate = limiter.max_rate = args.rate
+    bvid = 'BVbenchthread'
+
+    with FakeBilibiliServer(latency=args.latency, replies_per_video=args.replies) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        crawler = make_crawler(os.path.join(tmp, 'info'), server.base_url, 3)
+        aid = crawler.bv_to_aid(bvid)['aid']
+        roots = make_replies(aid, args.replies)
+        expected = {}
+        for root in roots:
+            for sub in make_sub_replies(root['rpid'], root['rcount']):
+                expected[str(sub['rpid'])] = (str(sub['root']), str(sub['parent']))
+        print(f'roots={args.replies}  sub replies={len(expected)}')
+
+        for workers in args.workers:
+            crawler = make_crawler(os.path.join(tmp, f'workers_{workers}'), server.base_url, 3)
+            crawler.sub_replies = True
+            crawler.sub_reply_workers = workers
+            crawler.sub_reply_url = f'{server.base_url}/x/v2/reply/reply'
+            before = server.sub_reply_requests
+            start = time.perf_counter()
+            assert crawler.process_video(bvid, 'csv', pages=None)
+            elapsed = time.perf_counter() - start
+
+            with open(crawler.output_paths(crawler.bv_to_aid(bvid), 'csv')[0], 'r', encoding='utf-8-sig') as f:
+                rows = list(csv.DictReader(f, escapechar='\\'))
+            top = [row for row in rows if not row['根评论ID']]
+            subs = {row['评论ID']: (row['根评论ID'], row['父评论ID']) for row in rows if row['根评论ID']}
+            assert len(top) == args.replies
+            assert len(subs) == len(rows) - len(top) == len(expected) and subs == expected
+            print(f'sub_reply_workers={workers:<3d} {elapsed:7.2f}s  sub reply requests={server.sub_reply_requests - before}')
+
+        # 请求数有上限时，回复最多的楼先抓
+        budget = 5
+        crawler.sub_reply_budget = budget
+        crawler.sub_reply_workers = 1
+        fetched = {c['root'] for page in crawler.iter_thread_pages(aid, pages=1) for c in page if c.get('root')}
+        page_roots = next(crawler.iter_reply_pages(aid, pages=1))
+        previewed = {str(r['rpid']) for r in page_roots if 0 < r['rcount'] <= 3}
+        largest = sorted((r for r in page_roots if r['rcount'] > 3), key=lambda r: -r['rcount'])
+        first_pages = []
+        for r in largest:
+            first_pages.extend([str(r['rpid'])] * -(-r['rcount'] // SUB_REPLY_PAGE_SIZE))
+        assert fetched - previewed == set(first_pages[:budget]), (fetched, first_pages)
+        assert all(sub_reply_count(r['rpid'] % 100000) == r['rcount'] for r in page_roots)
+
+        # 0个线程不会调度任何楼中楼请求，构造时直接拒绝
+        try:
+            BilibiliCrawler(save_dir=os.path.join(tmp, 'zero'), sub_replies=True, sub_reply_workers=0)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('sub_reply_workers=0 应该被拒绝')
+    print('sub replies complete, parents linked')
+
+
+if __name__ == '__main__':
+    main()
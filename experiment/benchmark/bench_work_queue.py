@@ -0,0 +1,160 @@
+import argparse
+import collections
+import glob
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from utils.work_queue import WorkQueue
+from bench_async_crawl import make_scraper
+from fake_server import FakeBilibiliServer
+
+
+def run_child(base_url: str, out_dir: str, queue_path: str, worker_id: str, lease: float):
+    """子进程：一个worker，开始处理每个视频时记一行，用来检查有没有视频被两个worker处理"""
+    logging.disable(logging.INFO)
+    scraper = make_scraper(out_dir, base_url)
+    process_video = scraper.process_video
+    started = open(os.path.join(out_dir, f'started-{worker_id}.txt'), 'a', encoding='utf-8')
+
+    def process(bvid, save_format):
+        started.write(bvid + '\n')
+        started.flush()
+        return process_video(bvid, save_format)
+
+    scraper.process_video = process
+    scraper.process_from_queue(queue_path, save_format='csv', worker_id=worker_id, lease_seconds=lease)
+
+
+def started_by(out_dir: str) -> dict:
+    """bvid -> 开始处理过它的worker列表"""
+    result = collections.defaultdict(list)
+    for path in glob.glob(os.path.join(out_dir, 'started-*.txt')):
+        worker = os.path.basename(path)[len('started-'):-len('.txt')]
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                result[line.strip()].append(worker)
+    return result
+
+
+def check_clock_skew(tmp: str, lease: float = 0.3):
+    """租约过期不比较不同机器的时钟：时钟快一小时的另一台机器也不会领走还在续约的条目"""
+    path = os.path.join(tmp, 'skew.sqlite3')
+    holder = WorkQueue(path, 'danmaku', lease_seconds=lease)
+    other = WorkQueue(path, 'danmaku', lease_seconds=lease)
+    assert holder._conn.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    holder.enqueue(['BVskew'])
+    assert holder.lease('holder') == ['BVskew']
+
+    real_time = time.time
+
+    def lease_skewed():
+        time.time = lambda: real_time() + 3600
+        try:
+            return other.lease('other')
+        finally:
+            time.time = real_time
+
+    for _ in range(int(3 * lease / 0.05)):
+        assert lease_skewed() == [], '还在续约的条目被时钟快的机器领走'
+        holder.heartbeat('holder', ['BVskew'])
+        time.sleep(0.05)
+    # 持有者不再续约，租约时长之后才被领走
+    start = time.monotonic()
+    while not lease_skewed():
+        assert time.monotonic() - start < 10 * lease
+        time.sleep(0.05)
+    assert time.monotonic() - start >= lease
+    holder.close()
+    other.close()
+    print(f'clock skew  +3600s on the other host: live lease kept, stale lease reclaimed after {lease}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多个worker进程共用SQLite租约队列（本地替身服务器）')
+    parser.add_argument('--videos', type=int, default=60)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--lease', type=float, default=2.0, help='崩溃测试的租约时长（秒）')
+    parser.add_argument('--child', action='store_true', help='内部使用：worker子进程')
+    parser.add_argument('--base-url', help='内部使用')
+    parser.add_argument('--out', help='内部使用')
+    parser.add_argument('--queue', help='内部使用')
+    parser.add_argument('--worker-id', help='内部使用')
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.base_url, args.out, args.queue, args.worker_id, args.lease)
+        return
+
+    def spawn(out: str, queue_path: str, worker_id: str, lease: float) -> subprocess.Popen:
+        return subprocess.Popen([sys.executable, __file__, '--child', '--base-url', server.base_url, '--out', out,
+                                 '--queue', queue_path, '--worker-id', worker_id, '--lease', str(lease)])
+
+    bv_list = [f'BVfail{i:04d}' if i % 20 == 7 else f'BVqueue{i:04d}' for i in range(args.videos)]
+    failures = sum(bvid.startswith('BVfail') for bvid in bv_list)
+    with FakeBilibiliServer(latency=args.latency, danmaku_per_video=200) as server, \
+            tempfile.TemporaryDirectory() as tmp:
+        check_clock_skew(tmp)
+        for workers in args.workers:
+            out = os.path.join(tmp, f'workers_{workers}')
+            queue_path = os.path.join(out, 'queue.sqlite3')
+            queue = WorkQueue(queue_path, 'danmaku')
+            queue.enqueue(bv_list)
+            start = time.perf_counter()
+            procs = [spawn(out, queue_path, f'w{i}', 300) for i in range(workers)]
+            for proc in procs:
+                assert proc.wait() == 0
+            elapsed = time.perf_counter() - start
+
+            stats = queue.stats()
+            assert stats['done'] == args.videos - failures and stats['failed'] == failures, stats
+            assert stats['pending'] == stats['leased'] == 0
+            # 失败的视频每次放回队列，最多尝试 max_attempts 次；成功的视频只被处理一次
+            started = started_by(out)
+            assert all(len(started[bvid]) == (3 if bvid.startswith('BVfail') else 1) for bvid in bv_list)
+            print(f'workers={workers}  {elapsed:6.2f}s  {stats["per_minute"]:8.1f} videos/min  '
+                  f'per worker={sorted(stats["workers"].values())}')
+            queue.close()
+
+        # 崩溃：一个worker处理到一半被杀掉，它持有的租约过期后由别的worker接着处理
+        out = os.path.join(tmp, 'crash')
+        queue_path = os.path.join(out, 'queue.sqlite3')
+        queue = WorkQueue(queue_path, 'danmaku', lease_seconds=args.lease)
+        queue.enqueue(bv_list)
+        victim = spawn(out, queue_path, 'victim', args.lease)
+        while len([b for b, w in started_by(out).items() if 'victim' in w]) < 3:
+            assert victim.poll() is None
+            time.sleep(0.01)
+        victim.kill()
+        victim.wait()
+        held = [row[0] for row in sqlite3.connect(queue_path).execute(
+            "SELECT bvid FROM items WHERE state = 'leased' AND owner = 'victim'")]
+        start = time.perf_counter()
+        procs = [spawn(out, queue_path, f'w{i}', args.lease) for i in range(2)]
+        for proc in procs:
+            assert proc.wait() == 0
+        elapsed = time.perf_counter() - start
+
+        stats = queue.stats()
+        assert stats['done'] == args.videos - failures and stats['failed'] == failures, stats
+        started = started_by(out)
+        for bvid in bv_list:
+            if bvid in held:
+                assert 'victim' in started[bvid] and len(started[bvid]) == 2, started[bvid]
+            elif not bvid.startswith('BVfail'):
+                assert len(started[bvid]) == 1, (bvid, started[bvid])
+        print(f'crash    victim held {held}, reclaimed after lease expiry; '
+              f'remaining workers {elapsed:6.2f}s  retried={stats["retried"]}')
+        queue.close()
+    print('every video processed once')
+
+
+if __name__ == '__main__':
+    main()
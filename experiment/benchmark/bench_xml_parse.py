@@ -0,0 +1,120 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from xml.sax.saxutils import escape
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(ROOT)
+
+from scraper_danmu import BilibiliScraper
+from utils.danmaku_fastparse import parse_xml_fast, columns_to_comments
+
+
+def json_to_xml(path: str) -> str:
+    """用 bilibili_data 中保存的弹幕还原出接口返回的XML"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)['danmaku_data']
+
+    lines = ['<?xml version="1.0" encoding="UTF-8"?><i>']
+    for field in ('chatserver', 'chatid', 'mission', 'maxlimit', 'state', 'real_name', 'source'):
+        lines.append(f'<{field}>{escape(data[field] or "")}</{field}>')
+    for c in data['comments']:
+        p = f"{c['time']},{c['type']},{c['size']},{c['color']},{c['timestamp']},{c['pool']},{c['user_hash']},{c['dmid']},11"
+        lines.append(f'<d p="{p}">{escape(c["content"] or "")}</d>')
+    lines.append('</i>')
+    return '\n'.join(lines)
+
+
+def check_identical(scraper: BilibiliScraper, xml: str) -> int:
+    """两种解析结果必须完全一致，返回弹幕条数"""
+    scraper.xml_engine = 'etree'
+    reference = scraper.parse_xml(xml)
+    scraper.xml_engine = 'fast'
+    fast = scraper.parse_xml(xml)
+    assert fast == reference, '快速解析与ElementTree解析结果不一致'
+    assert columns_to_comments(parse_xml_fast(xml.encode('utf-8'))[1]) == reference['comments']
+    return len(reference['comments'])
+
+
+def check_error_bodies(scraper: BilibiliScraper):
+    """接口返回HTML或JSON错误页时，快速解析和ElementTree一样报解析失败，不会当作0条弹幕保存"""
+    bodies = ['<!DOCTYPE html><html><head><title>502 Bad Gateway</title></head><body><i>502</i></body></html>',
+              '{"code":-412,"message":"请求被拦截"}', '']
+    for engine in ('etree', 'fast', 'batch'):
+        scraper.xml_engine = engine
+        for body in bodies:
+            assert scraper.parse_xml(body) is None, (engine, body)
+    print(f'error bodies rejected by all engines: {len(bodies)} bodies')
+
+
+def check_unusual_ids(scraper: BilibiliScraper):
+    """isdigit() 为真但不是ASCII数字的dmid（上标、全角数字）在 batch 中原样记入溢出表"""
+    dmids = ['²', '１２３', '0012', '-5', '42']
+    lines = ['<?xml version="1.0" encoding="UTF-8"?><i><chatid>1</chatid>']
+    lines += [f'<d p="1.5,1,25,16777215,1700000000,0,abcd1234,{dmid},11">弹幕</d>' for dmid in dmids]
+    xml = '\n'.join(lines + ['</i>'])
+    scraper.xml_engine = 'etree'
+    reference = scraper.parse_xml(xml)
+    scraper.xml_engine = 'batch'
+    batch = scraper.parse_xml(xml)
+    assert batch is not None and [dict(row) for row in batch['comments']] == reference['comments']
+    assert [row['dmid'] for row in batch['comments']] == dmids
+    print(f'unusual dmids kept verbatim by batch: {len(dmids)} ids')
+
+
+def measure(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ElementTree解析 vs 快速字节扫描解析')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scale', type=int, default=20, help='把所有样本拼接放大多少倍做吞吐测试')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as tmp:
+        run(BilibiliScraper(save_dir=tmp), args)
+
+
+def run(scraper: BilibiliScraper, args):
+    samples = []
+    for path in sorted(glob.glob(os.path.join(ROOT, 'bilibili_data', '*.json'))):
+        xml = json_to_xml(path)
+        count = check_identical(scraper, xml)
+        samples.append(xml)
+        print(f'identical  {count:7d} danmaku  {os.path.basename(path)}')
+    check_error_bodies(scraper)
+    check_unusual_ids(scraper)
+
+    # 把所有样本的弹幕拼接成一个大文件
+    body = ''.join(xml.split('<source>', 1)[1].split('</source>', 1)[1].rsplit('</i>', 1)[0] for xml in samples)
+    big = samples[0].split('</source>', 1)[0] + '</source>' + body * args.scale + '</i>'
+    big_bytes = big.encode('utf-8')
+    count = check_identical(scraper, big)
+
+    def etree():
+        scraper.xml_engine = 'etree'
+        scraper.parse_xml(big)
+
+    def fast_dicts():
+        scraper.xml_engine = 'fast'
+        scraper.parse_xml(big)
+
+    for name, func in (('etree', etree),
+                       ('fast(dicts)', fast_dicts),
+                       ('fast(columns)', lambda: parse_xml_fast(big_bytes))):
+        elapsed = measure(func, args.repeat)
+        print(f'{name:14s} {count} records  {elapsed * 1000:8.1f} ms  {count / elapsed:12,.0f} records/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,473 @@
+import bisect
+import glob
+import json
+import random
+import threading
+import time
+import os
+import sys
+import zlib
+from datetime import datetime
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+from xml.sax.saxutils import escape
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from utils.bvid_codec import try_bv_to_av
+from utils.dm_protobuf import SEGMENT_SECONDS, comment_to_elem, encode_segment
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 搜索接口每页条数和最多能翻到的页数，超出的结果要缩小时间窗口才能拿到
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGES = 50
+# 合成搜索结果的默认发布时间范围：2024-11-01 ~ 2024-11-28（北京时间）
+SEARCH_SPAN = (1730390400, 1732723200)
+
+
+def make_danmaku_comments(cid: int, count: int) -> List[Dict]:
+    """生成合成弹幕，XML接口和分段接口返回的是同一批弹幕"""
+    return [{
+        'time': float(f'{i * 0.731:.3f}'),
+        'type': 1,
+        'size': 25,
+        'color': 16777215,
+        'timestamp': 1700000000 + i,
+        'pool': 0,
+        'user_hash': f'{(cid * 31 + i) & 0xffffffff:x}',
+        'dmid': str(1500000000000000000 + cid * 1000 + i),
+        'content': f'弹幕{i} & test',
+    } for i in range(count)]
+
+
+def make_danmaku_xml(cid: int, count: int = None, comments: List[Dict] = None) -> str:
+    """生成与 comment.bilibili.com 格式一致的弹幕XML"""
+    if comments is None:
+        comments = make_danmaku_comments(cid, count)
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<i>',
+        '<chatserver>chat.bilibili.com</chatserver>',
+        f'<chatid>{cid}</chatid>',
+        '<mission>0</mission>',
+        '<maxlimit>3000</maxlimit>',
+        '<state>0</state>',
+        '<real_name>0</real_name>',
+        '<source>k-v</source>',
+    ]
+    for c in comments:
+        lines.append(
+            f'<d p="{c["time"]},{c["type"]},{c["size"]},{c["color"]},{c["timestamp"]},{c["pool"]},'
+            f'{c["user_hash"]},{c["dmid"]},11">{escape(c["content"] or "")}</d>'
+        )
+    lines.append('</i>')
+    return '\n'.join(lines)
+
+
+def make_segments(comments: List[Dict]) -> Dict[int, bytes]:
+    """把弹幕按6分钟一段编码成 seg.so 接口的protobuf数据，键为segment_index"""
+    buckets = {}
+    for c in comments:
+        buckets.setdefault(int(c['time'] // SEGMENT_SECONDS) + 1, []).append(comment_to_elem(c))
+    return {index: encode_segment(elems) for index, elems in buckets.items()}
+
+
+@lru_cache(maxsize=256)
+def synthetic_segments(cid: int, count: int) -> Dict[int, bytes]:
+    """合成弹幕的分段数据，同一个cid的各分段请求共用"""
+    return make_segments(make_danmaku_comments(cid, count))
+
+
+def sub_reply_count(index: int) -> int:
+    """第index条一级评论下的楼中楼回复数：多数没有回复，少数几条有上百条"""
+    return (0, 0, 0, 2, 3, 8, 25, 0, 1, 130)[index % 10]
+
+
+def make_sub_replies(root: int, count: int) -> List[Dict]:
+    """生成一条一级评论下的楼中楼回复，每隔几条回复上一条回复而不是根评论"""
+    return [{
+        'rpid': root * 1000 + j,
+        'root': root,
+        'parent': root * 1000 + j - 1 if j % 3 == 2 else root,
+        'ctime': 1700000000 + j * 11,
+        'like': j % 5,
+        'member': {'uname': f'回复用户{j}', 'mid': 20000 + j},
+        'content': {'message': f'回复{j}'},
+    } for j in range(count)]
+
+
+@lru_cache(maxsize=64)
+def make_replies(oid: int, count: int) -> List[Dict]:
+    """生成合成评论，floor为楼层号，越新的评论楼层越高；replies为接口自带的最多3条楼中楼预览"""
+    replies = []
+    for i in range(count):
+        rpid = oid * 100000 + i
+        rcount = sub_reply_count(i)
+        replies.append({
+            'rpid': rpid,
+            'floor': i + 1,
+            'ctime': 1700000000 + i * 37,
+            'like': i * 7919 % 1000,
+            'member': {'uname': f'用户{i}', 'mid': 10000 + i},
+            'content': {'message': f'评论{i}\n第二行 "引号"'},
+            'rcount': rcount,
+            'replies': make_sub_replies(rpid, min(rcount, 3)),
+        })
+    return replies
+
+
+def reply_page(replies: List[Dict], mode: int, cursor: int, offset: bool, page_size: int = 20) -> Dict:
+    """
+    按 /x/v2/reply/main 的游标规则返回一页评论
+
+    热度排序(mode=3)的游标是页码；时间排序(mode=2)的游标是楼层号，从最新的楼层往前翻。
+    offset=True 时按新版接口在 pagination_reply.next_offset 中返回游标字符串
+    """
+    total = len(replies)
+    if mode == 3:
+        page = max(cursor, 1)
+        ordered = sorted(replies, key=lambda r: (-r['like'], r['rpid']))
+        items = ordered[(page - 1) * page_size:page * page_size]
+        following = page + 1
+        is_end = page * page_size >= total
+    else:
+        top = cursor if 0 < cursor <= total else total
+        items = [replies[floor - 1] for floor in range(top, max(top - page_size, 0), -1)]
+        following = top - page_size
+        is_end = following <= 0
+    cursor = {'all_count': total, 'is_begin': cursor == 0, 'is_end': is_end, 'mode': mode, 'next': following}
+    if offset and not is_end:
+        cursor['pagination_reply'] = {'next_offset': str(following)}
+    return {'code': 0, 'message': '0', 'data': {'cursor': cursor, 'replies': items}}
+
+
+def make_fixture(cid: int, title: str, comments: List[Dict], duration: int = None) -> Dict:
+    """
+    由一批弹幕生成一个视频的录制数据，供 FakeBilibiliServer.fixtures 使用
+
+    :param duration: 视频时长（秒），默认取最后一条弹幕的时间
+    """
+    if duration is None:
+        duration = int(max((c['time'] for c in comments), default=0)) + 1
+    return {
+        'cid': cid,
+        'title': title,
+        'duration': duration,
+        'xml': make_danmaku_xml(cid, comments=comments).encode('utf-8'),
+        'segments': make_segments(comments),
+        'count': len(comments),
+    }
+
+
+def recorded_replies(comments: List[Dict]) -> List[Dict]:
+    """把 bilibili_comment_data 中保存的评论还原成接口返回的评论，按发布时间编楼层号"""
+    replies = []
+    for comment in comments:
+        ctime = int(datetime.strptime(comment['reply_time'], '%Y-%m-%d %H:%M:%S').timestamp())
+        replies.append({
+            'rpid': int(comment['rpid']),
+            'ctime': ctime,
+            'like': comment['likes'],
+            'member': {'uname': comment['user'], 'mid': int(comment['mid'])},
+            'content': {'message': comment['content']},
+            'rcount': 0,
+            'replies': [],
+        })
+    replies.sort(key=lambda r: (r['ctime'], r['rpid']))
+    for floor, reply in enumerate(replies, 1):
+        reply['floor'] = floor
+    return replies
+
+
+def load_recorded_fixtures(root: str = ROOT) -> Dict[str, Dict]:
+    """
+    用仓库中 bilibili_data 和 bilibili_comment_data 保存的数据生成录制数据，键为真实BV号
+
+    弹幕按原cid以XML和分段protobuf两种形式提供，评论按原aid提供
+    """
+    comments = {}
+    for path in sorted(glob.glob(os.path.join(root, 'bilibili_comment_data', '*.json'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        comments[data['video_info']['bvid']] = data
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(root, 'bilibili_data', '*.json'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        info = data['video_info']
+        fixture = make_fixture(int(info['cid']), info['title'], data['danmaku_data']['comments'])
+        recorded = comments.get(info['bvid'])
+        if recorded:
+            fixture['aid'] = recorded['video_info']['aid']
+            fixture['replies'] = recorded_replies(recorded['comments_data'])
+        fixtures[info['bvid']] = fixture
+    return fixtures
+
+
+def make_search_videos(count: int, span: Tuple[int, int] = SEARCH_SPAN, recorded: Dict[str, Dict] = None) -> List[Dict]:
+    """
+    生成搜索接口的视频结果，发布时间均匀分布在 span 内，按发布时间排序
+
+    :param recorded: 录制数据，其中的视频排在合成视频之前参与搜索
+    """
+    videos = [{
+        'bvid': bvid,
+        'title': f'<em class="keyword">{fixture["title"]}</em>',
+        'author': 'UP主',
+        'play': 100000 + fixture['count'],
+        'video_review': fixture['count'],
+        'pubdate': span[0] + i * 3607 % (span[1] - span[0]),
+    } for i, (bvid, fixture) in enumerate((recorded or {}).items())]
+    step = (span[1] - span[0]) / max(count, 1)
+    videos.extend({
+        'bvid': f'BVsearch{i:06d}',
+        'title': f'测试<em class="keyword">视频</em>{i}',
+        'author': f'UP主{i % 97}',
+        'play': i * 7919 % 100000,
+        'video_review': i * 31 % 500,
+        'pubdate': span[0] + int(i * step),
+    } for i in range(count))
+    videos.sort(key=lambda v: (v['pubdate'], v['bvid']))
+    return videos
+
+
+def search_page(videos: List[Dict], pubdates: List[int], begin: int, end: int, page: int) -> Dict:
+    """按 /x/web-interface/search/type 的规则返回一页搜索结果，最多翻 SEARCH_MAX_PAGES 页"""
+    lo = bisect.bisect_left(pubdates, begin)
+    hi = bisect.bisect_right(pubdates, end)
+    matched = hi - lo
+    shown = min(matched, SEARCH_PAGE_SIZE * SEARCH_MAX_PAGES)
+    start = (page - 1) * SEARCH_PAGE_SIZE
+    items = videos[lo + start:lo + min(start + SEARCH_PAGE_SIZE, shown)] if page >= 1 else []
+    return {'code': 0, 'message': '0', 'data': {
+        'page': page, 'pagesize': SEARCH_PAGE_SIZE, 'numResults': shown,
+        'numPages': -(-shown // SEARCH_PAGE_SIZE), 'result': items,
+    }}
+
+
+class FakeBilibiliHandler(BaseHTTPRequestHandler):
+    """模拟B站视频信息接口、弹幕接口和评论接口"""
+
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体分两次写出，不关掉Nagle会和客户端的延迟确认叠加出约40ms的额外延迟
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        with server.lock:
+            server.request_count += 1
+            fault = server.inject_fault()
+        if fault == 'throttle':
+            # 与真实接口被风控时一样：HTTP 412，JSON返回码 -412
+            body = json.dumps({'code': -412, 'message': '请求被拦截'}, ensure_ascii=False).encode('utf-8')
+            self._send(412, body, 'application/json; charset=utf-8')
+            return
+        if fault == 'error':
+            self._send(502, b'bad gateway', 'text/html')
+            return
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/x/web-interface/view':
+            bvid = query.get('bvid', [''])[0]
+            fixture = server.fixtures.get(bvid)
+            if bvid.startswith('BVfail'):
+                # 模拟已删除的视频
+                body = json.dumps({'code': -404, 'message': '啥都木有'}, ensure_ascii=False).encode('utf-8')
+                self._send(200, body, 'application/json; charset=utf-8')
+                return
+            if fixture:
+                cid, title, duration, count = fixture['cid'], fixture['title'], fixture['duration'], fixture['count']
+                pages = [{'cid': cid, 'page': 1, 'part': title, 'duration': duration}]
+                aid = fixture.get('aid', cid)
+            else:
+                cid = zlib.crc32(bvid.encode()) + 1
+                title = f'测试视频_{bvid}'
+                duration = int(server.danmaku_per_video * 0.731) + 1
+                # 分P的cid互不相同，第1P的cid与视频cid相同
+                pages = [{'cid': cid + (page << 32), 'page': page + 1, 'part': f'{title}_P{page + 1}', 'duration': duration}
+                         for page in range(server.parts_per_video)]
+                count = server.danmaku_per_video * server.parts_per_video
+                duration *= server.parts_per_video
+                # 格式正确的BV号与B站一样用换算出的aid，其他合成BV号用cid
+                aid = try_bv_to_av(bvid) or cid
+            body = json.dumps({
+                'code': 0,
+                'message': '0',
+                'data': {
+                    'bvid': bvid, 'aid': aid, 'cid': cid, 'title': title, 'duration': duration,
+                    'pages': pages, 'owner': {'name': 'UP主', 'mid': 1}, 'pubdate': 1714971773,
+                    'stat': {'danmaku': count},
+                }
+            }, ensure_ascii=False).encode('utf-8')
+            self._send(200, body, 'application/json; charset=utf-8')
+        elif url.path.endswith('.xml'):
+            cid = int(url.path.strip('/').split('.')[0])
+            fixture = server.fixtures_by_cid.get(cid)
+            etag = f'"{cid}-{fixture["count"] if fixture else server.danmaku_per_video}"'
+            if self.headers.get('If-None-Match') == etag:
+                self._send(304, b'', 'text/xml; charset=utf-8', {'ETag': etag})
+                return
+            body = fixture['xml'] if fixture else make_danmaku_xml(cid, server.danmaku_per_video).encode('utf-8')
+            self._send(200, body, 'text/xml; charset=utf-8', {'ETag': etag})
+        elif url.path == '/x/v2/dm/web/seg.so':
+            cid = int(query.get('oid', ['0'])[0])
+            index = int(query.get('segment_index', ['1'])[0])
+            fixture = server.fixtures_by_cid.get(cid)
+            if fixture:
+                segments = fixture['segments']
+            else:
+                segments = synthetic_segments(cid, server.danmaku_per_video)
+            # 没有弹幕的分段返回空body，与真实接口一致
+            self._send(200, segments.get(index, b''), 'application/octet-stream')
+        elif url.path == '/x/v2/reply/main':
+            oid = int(query.get('oid', ['0'])[0])
+            mode = int(query.get('mode', ['3'])[0])
+            if 'pagination_str' in query:
+                cursor = int(json.loads(query['pagination_str'][0]).get('offset') or 0)
+            else:
+                cursor = int(query.get('next', ['0'])[0])
+            replies = server.replies_by_aid.get(oid) or make_replies(oid, server.replies_per_video)
+            data = reply_page(replies, mode, cursor, server.reply_offset)
+            with server.lock:
+                server.reply_requests += 1
+            self._send(200, json.dumps(data, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+        elif url.path == '/x/v2/reply/reply':
+            root = int(query.get('root', ['0'])[0])
+            pn = int(query.get('pn', ['1'])[0])
+            ps = int(query.get('ps', ['20'])[0])
+            count = sub_reply_count(root % 100000)
+            items = make_sub_replies(root, count)[(pn - 1) * ps:pn * ps]
+            data = {'code': 0, 'message': '0',
+                    'data': {'page': {'num': pn, 'size': ps, 'count': count}, 'replies': items}}
+            with server.lock:
+                server.sub_reply_requests += 1
+            self._send(200, json.dumps(data, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+        elif url.path == '/x/web-interface/search/type':
+            begin = int(query.get('pubtime_begin_s', ['0'])[0])
+            end = int(query.get('pubtime_end_s', [str(2 ** 40)])[0])
+            page = int(query.get('page', ['1'])[0])
+            data = search_page(server.search_videos, server.search_pubdates, begin, end, page)
+            with server.lock:
+                server.search_requests += 1
+            self._send(200, json.dumps(data, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+        else:
+            self._send(404, b'not found', 'text/plain')
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    def inject_fault(self) -> Optional[str]:
+        """按设定的比例随机返回 'throttle'（风控）或 'error'（5xx），调用方持有 lock"""
+        if not (self.throttle_rate or self.error_rate):
+            return None
+        roll = self.random.random()
+        if roll < self.throttle_rate:
+            self.throttled_count += 1
+            return 'throttle'
+        if roll < self.throttle_rate + self.error_rate:
+            self.error_count += 1
+            return 'error'
+        return None
+
+    def handle_error(self, request, client_address):
+        # 客户端进程被杀掉时连接会被重置，不打印异常
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeBilibiliServer:
+    """
+    本地替身服务器，在后台线程中运行
+
+    :param latency: 每个请求的模拟网络延迟（秒）
+    :param danmaku_per_video: 每个视频返回的弹幕条数
+    :param parts_per_video: 合成视频的分P数
+    :param fixtures: 录制好的视频数据 {bvid: make_fixture(...)}，其余bvid返回合成数据
+    :param replies_per_video: 每个视频的评论条数
+    :param reply_offset: 评论接口是否按新版格式返回游标字符串
+    :param throttle_rate: 随机返回风控（HTTP 412 / -412）的请求比例
+    :param error_rate: 随机返回 502 的请求比例
+    :param search_results: 搜索接口的合成视频数，录制数据中的视频也会出现在搜索结果中
+    :param seed: 风控和错误注入的随机种子，同样的请求顺序得到同样的结果
+    """
+
+    def __init__(self, latency: float = 0.05, danmaku_per_video: int = 500, parts_per_video: int = 1,
+                 fixtures: Dict[str, Dict] = None, replies_per_video: int = 200, reply_offset: bool = False,
+                 throttle_rate: float = 0.0, error_rate: float = 0.0, search_results: int = 0, seed: int = 0):
+        self.httpd = _QuietHTTPServer(('127.0.0.1', 0), FakeBilibiliHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.danmaku_per_video = danmaku_per_video
+        self.httpd.parts_per_video = parts_per_video
+        self.httpd.request_count = 0
+        self.httpd.replies_per_video = replies_per_video
+        self.httpd.reply_offset = reply_offset
+        self.httpd.reply_requests = 0
+        self.httpd.sub_reply_requests = 0
+        self.httpd.fixtures = fixtures or {}
+        self.httpd.fixtures_by_cid = {fixture['cid']: fixture for fixture in self.httpd.fixtures.values()}
+        self.httpd.replies_by_aid = {fixture['aid']: fixture['replies']
+                                     for fixture in self.httpd.fixtures.values() if fixture.get('replies')}
+        self.httpd.search_videos = make_search_videos(search_results, recorded=self.httpd.fixtures)
+        self.httpd.search_pubdates = [video['pubdate'] for video in self.httpd.search_videos]
+        self.httpd.search_requests = 0
+        self.httpd.throttle_rate = throttle_rate
+        self.httpd.error_rate = error_rate
+        self.httpd.throttled_count = 0
+        self.httpd.error_count = 0
+        self.httpd.random = random.Random(seed)
+        self.httpd.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address
+        return f'http://{host}:{port}'
+
+    @property
+    def request_count(self) -> int:
+        return self.httpd.request_count
+
+    @property
+    def reply_requests(self) -> int:
+        return self.httpd.reply_requests
+
+    @property
+    def sub_reply_requests(self) -> int:
+        return self.httpd.sub_reply_requests
+
+    @property
+    def search_requests(self) -> int:
+        return self.httpd.search_requests
+
+    @property
+    def throttled_count(self) -> int:
+        return self.httpd.throttled_count
+
+    @property
+    def error_count(self) -> int:
+        return self.httpd.error_count
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,215 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from utils.crawl_journal import CrawlJournal, journal_path
+from utils.rate_limiter import get_limiter
+from fake_server import SEARCH_SPAN, FakeBilibiliServer, load_recorded_fixtures
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# 越大越好的指标和越小越好的指标，超出容差算退化
+HIGHER_IS_BETTER = ('videos_per_second',)
+LOWER_IS_BETTER = ('peak_rss_mb',)
+
+
+def peak_rss_mb() -> float:
+    """本进程的峰值内存；ru_maxrss 会在 exec 时继承父进程的值，父进程跑过的场景越多越大，优先用 VmHWM"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def read_bv_list(bv_file: str) -> List[str]:
+    with open(bv_file, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def journal_counts(out: str, bv_file: str) -> Tuple[int, int]:
+    summary = CrawlJournal(journal_path(out, bv_file)).summary(read_bv_list(bv_file))
+    return summary['done'], summary['failed']
+
+
+def run_danmaku(base_url: str, bv_file: str, out: str) -> Tuple[int, int]:
+    from bench_async_crawl import make_scraper
+    make_scraper(out, base_url).process_from_file(bv_file, save_format='csv')
+    return journal_counts(out, bv_file)
+
+
+def run_danmaku_async(base_url: str, bv_file: str, out: str) -> Tuple[int, int]:
+    from bench_async_crawl import make_scraper
+    make_scraper(out, base_url).process_from_file_async(bv_file, save_format='csv', concurrency=16, max_rps=500.0)
+    return journal_counts(out, bv_file)
+
+
+def run_comments(base_url: str, bv_file: str, out: str) -> Tuple[int, int]:
+    from bench_comment_pages import make_crawler
+    limiter = get_limiter('reply')
+    limiter.rate = limiter.max_rate = 10000.0
+    make_crawler(out, base_url, 3).process_from_file(bv_file, save_format='json', pages=None)
+    return journal_counts(out, bv_file)
+
+
+def run_search(base_url: str, bv_file: str, out: str) -> Tuple[int, int]:
+    from utils import search_bv
+    search_bv.SEARCH_API_URL = f'{base_url}/x/web-interface/search/type'
+    limiter = get_limiter('search')
+    limiter.rate = limiter.max_rate = 10000.0
+    # 与 search_bv.main 一样按天切分时间窗口并发搜索
+    stats = {}
+    found = {video['BV号'] for video in search_bv.search_videos('视频', SEARCH_SPAN[0], SEARCH_SPAN[1] - 1, 8, stats=stats)}
+    return len(found), stats['failed']
+
+
+# 场景：替身服务器的设置、视频数（录制数据之外补足合成视频）和在子进程中执行的负载
+SCENARIOS: Dict[str, Dict] = {
+    'danmaku': {
+        'server': {'latency': 0.02, 'danmaku_per_video': 2000},
+        'videos': 60,
+        'run': run_danmaku,
+    },
+    'danmaku_async': {
+        'server': {'latency': 0.05, 'danmaku_per_video': 2000},
+        'videos': 200,
+        'run': run_danmaku_async,
+    },
+    'comments': {
+        'server': {'latency': 0.02, 'replies_per_video': 400},
+        'videos': 40,
+        'run': run_comments,
+    },
+    'search': {
+        'server': {'latency': 0.02, 'search_results': 6000},
+        'videos': 0,
+        'run': run_search,
+    },
+    'danmaku_faults': {
+        'server': {'latency': 0.02, 'danmaku_per_video': 2000, 'throttle_rate': 0.03, 'error_rate': 0.05},
+        'videos': 60,
+        'run': run_danmaku,
+    },
+}
+
+
+def child(name: str, base_url: str, bv_file: str, out: str):
+    """在子进程中执行一个场景，最后一行输出JSON结果，峰值内存只包含爬虫本身"""
+    logging.disable(logging.INFO)
+    run: Callable = SCENARIOS[name]['run']
+    start = time.perf_counter()
+    done, failed = run(base_url, bv_file, out)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'videos': done, 'failed': failed, 'seconds': elapsed, 'peak_rss_mb': peak_rss_mb()}))
+
+
+def run_scenario(name: str, fixtures: Dict[str, Dict], tmp: str) -> Dict:
+    """启动替身服务器，在子进程中跑一个场景，返回吞吐和峰值内存"""
+    scenario = SCENARIOS[name]
+    out = os.path.join(tmp, name)
+    os.makedirs(out)
+    bv_file = os.path.join(out, 'bv_list.txt')
+    synthetic = max(scenario['videos'] - len(fixtures), 0)
+    with open(bv_file, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(list(fixtures) + [f'BVbench{i:05d}' for i in range(synthetic)]))
+
+    with FakeBilibiliServer(fixtures=fixtures, **scenario['server']) as server:
+        process = subprocess.run([sys.executable, __file__, '--child', name, '--base-url', server.base_url,
+                                  '--bv-file', bv_file, '--out', out], capture_output=True, text=True)
+        if process.returncode != 0:
+            raise RuntimeError(f'场景 {name} 运行失败:\n{process.stderr}')
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        requests = server.request_count
+        injected = {'throttled': server.throttled_count, 'errors': server.error_count}
+    seconds = result['seconds']
+    return {
+        'videos': result['videos'],
+        'failed': result['failed'],
+        'seconds': round(seconds, 2),
+        'requests': requests,
+        'videos_per_second': round(result['videos'] / seconds, 2),
+        'requests_per_second': round(requests / seconds, 1),
+        'peak_rss_mb': round(result['peak_rss_mb'], 1),
+        'injected': injected,
+    }
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """和基线比较，返回退化的指标说明"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for key in HIGHER_IS_BETTER:
+            if result[key] < base[key] * (1 - tolerance):
+                regressions.append(f'{name}.{key}: {base[key]} -> {result[key]}')
+        for key in LOWER_IS_BETTER:
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append(f'{name}.{key}: {base[key]} -> {result[key]}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线性能测试：用本地替身服务器回放录制数据，记录吞吐和峰值内存并和基线比较')
+    parser.add_argument('--scenario', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='基线文件')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果写入基线文件')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的相对退化幅度')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    parser.add_argument('--bv-file', help=argparse.SUPPRESS)
+    parser.add_argument('--out', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.base_url, args.bv_file, args.out)
+        return
+
+    fixtures = load_recorded_fixtures()
+    print(f'cpus={os.cpu_count()}  recorded videos={len(fixtures)}')
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.scenario:
+            result = results[name] = run_scenario(name, fixtures, tmp)
+            print(f"{name:15s} videos={result['videos']:4d} failed={result['failed']:3d}  {result['seconds']:7.2f}s  "
+                  f"{result['videos_per_second']:7.2f} videos/s  {result['requests_per_second']:7.1f} req/s  "
+                  f"peak RSS {result['peak_rss_mb']:6.1f} MB  injected={result['injected']}")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f'基线已保存到 {args.baseline}')
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    if not baseline:
+        print('没有基线文件，使用 --save-baseline 保存本次结果')
+    elif regressions:
+        print('性能退化:')
+        for line in regressions:
+            print(f'  {line}')
+        sys.exit(1)
+    else:
+        print(f'与基线相比没有超过 {args.tolerance:.0%} 的退化')
+
+
+if __name__ == '__main__':
+    main()
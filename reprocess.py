@@ -0,0 +1,251 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from scraper_danmu import FILE_FORMATS, BilibiliScraper, segment_key, video_pages
+from scraper_comment import (HOT_MODE, SUB_REPLY_PAGE_SIZE, TIME_MODE, BilibiliCrawler, convert_page,
+                             next_cursor, reply_key, sub_reply_key, sub_reply_to_comment)
+from utils.dm_protobuf import segment_count
+from utils.raw_archive import DEFAULT_ARCHIVE_PATH, RawArchive
+from utils.video_cache import DEFAULT_CACHE_PATH, VideoCache
+
+# 多个进程可以同时写入的保存格式；数据集只能由一个进程追加，不支持
+REPROCESS_FORMATS = FILE_FORMATS + ('sqlite',)
+
+# 每个解析进程各自打开的存档、视频信息缓存和用来解析保存的爬虫，由 _init_worker 创建
+_archive: Optional[RawArchive] = None
+_view_cache: Optional[VideoCache] = None
+_scraper: Union[BilibiliScraper, BilibiliCrawler, None] = None
+_save_format = 'both'
+_pages: Optional[int] = None
+
+
+def load_view(archive: RawArchive, view_cache: Optional[VideoCache], bvid: str) -> Optional[Dict]:
+    """存档中最近一次的视频信息（view接口的data字段）；没有存档过时从视频信息缓存中取"""
+    data = archive.get_json('view', bvid)
+    if data is not None and data.get('code') == 0:
+        return data['data']
+    if view_cache is not None:
+        return view_cache.get(bvid, fields=())
+    return None
+
+
+def load_danmaku_raw(archive: RawArchive, page: Dict, duration: Optional[int],
+                     prefer: str = 'xml') -> Optional[Union[str, List[bytes]]]:
+    """
+    一个分P存档的原始弹幕：XML文本，或各分段数据（要求每一段都在存档中）
+
+    :param duration: 分P没有时长时使用的视频时长
+    :param prefer: 两种都存档过时优先使用的来源，'xml' 或 'seg'
+    """
+    cid = str(page['cid'])
+
+    def xml():
+        body = archive.get('danmaku', cid)
+        return None if body is None else body.decode('utf-8')
+
+    def seg():
+        length = page.get('duration') or duration
+        if not length:
+            return None
+        segments = [archive.get('danmaku_seg', segment_key(cid, index))
+                    for index in range(1, segment_count(length) + 1)]
+        return segments if all(segment is not None for segment in segments) else None
+
+    for load in ((seg, xml) if prefer == 'seg' else (xml, seg)):
+        raw = load()
+        if raw is not None:
+            return raw
+    return None
+
+
+def replay_reply_pages(archive: RawArchive, aid: int, mode: int, pages: Optional[int] = None) -> Iterator[List[Dict]]:
+    """
+    按存档重放一级评论的翻页：从游标0开始，按每页响应中的游标找下一页，顺序与 iter_reply_pages 相同
+
+    :param pages: 最多重放的页数，None 为存档中能接上的全部页
+    """
+    cursor = 0
+    page = 0
+    while pages is None or page < pages:
+        data = archive.get_json('reply', reply_key(aid, mode, cursor))
+        if data is None or data['code'] != 0:
+            break
+        replies = data['data'].get('replies')
+        if not replies:
+            break
+        page += 1
+        yield replies
+        cursor_info = data['data'].get('cursor') or {}
+        following = next_cursor(cursor_info)
+        if cursor_info.get('is_end') or following is None:
+            break
+        cursor = following
+
+
+def replay_sub_replies(archive: RawArchive, aid: int, replies: List[Dict]) -> Iterator[List[Dict]]:
+    """按存档重放一页一级评论下的楼中楼回复，按楼的顺序逐页产出（在线爬取时按回复数优先，顺序不同）"""
+    for reply in replies:
+        rcount = reply.get('rcount') or 0
+        preview = reply.get('replies') or []
+        if rcount and rcount <= len(preview):
+            yield convert_page(preview, sub_reply_to_comment, 'sub_replies')
+            continue
+        pn = 1
+        while rcount:
+            data = archive.get_json('sub_reply', sub_reply_key(aid, reply['rpid'], pn))
+            if data is None or data['code'] != 0:
+                break
+            items = data['data'].get('replies') or []
+            if items:
+                yield convert_page(items, sub_reply_to_comment, 'sub_replies')
+            count = (data['data'].get('page') or {}).get('count', 0)
+            if not items or pn * SUB_REPLY_PAGE_SIZE >= count:
+                break
+            pn += 1
+
+
+def _init_worker(kind: str, archive_path: str, cache_path: Optional[str], save_dir: str, save_format: str,
+                 pages: Optional[int], options: Dict):
+    global _archive, _view_cache, _scraper, _save_format, _pages
+    # 只读存档，不在解析进程中训练字典
+    _archive = RawArchive(archive_path, train_samples=0)
+    _view_cache = VideoCache(cache_path) if cache_path and os.path.exists(cache_path) else None
+    _scraper = BilibiliScraper(save_dir, **options) if kind == 'danmaku' else BilibiliCrawler(save_dir, **options)
+    _save_format = save_format
+    _pages = pages
+
+
+def reprocess_danmaku(bvid: str) -> Tuple[str, bool, Optional[str]]:
+    """在解析进程中从存档重新解析保存一个视频的弹幕，返回 (bvid, 是否成功, 失败原因)"""
+    view = load_view(_archive, _view_cache, bvid)
+    if view is None:
+        return bvid, False, '存档中没有视频信息'
+    video_info = {'title': view['title'], 'cid': view['cid'], 'bvid': bvid}
+    pages = video_pages(view)
+    raws = []
+    for page in pages:
+        raw = load_danmaku_raw(_archive, page, view.get('duration'), _scraper.danmaku_source)
+        if raw is None:
+            return bvid, False, f"存档中没有弹幕: 第{page['page']}P (cid {page['cid']})"
+        raws.append(raw)
+    data = _scraper.parse_parts(pages, raws)
+    if not data:
+        return bvid, False, '解析弹幕失败'
+    if not _scraper.save_data(data, video_info, _save_format):
+        return bvid, False, '保存数据失败'
+    return bvid, True, None
+
+
+def reprocess_comments(bvid: str) -> Tuple[str, bool, Optional[str]]:
+    """在解析进程中从存档重新解析保存一个视频的评论，返回 (bvid, 是否成功, 失败原因)"""
+    view = load_view(_archive, _view_cache, bvid)
+    if view is None:
+        return bvid, False, '存档中没有视频信息'
+
+    def comment_pages():
+        for replies in replay_reply_pages(_archive, view['aid'], _scraper.comment_mode, _pages):
+            yield convert_page(replies)
+            if _scraper.sub_replies:
+                yield from replay_sub_replies(_archive, view['aid'], replies)
+
+    pages = comment_pages()
+    first_page = next(pages, None)
+    if not first_page:
+        return bvid, False, '存档中没有评论'
+    try:
+        _scraper.save_comment_pages(chain([first_page], pages), view, _save_format)
+    except Exception as e:
+        return bvid, False, f'保存数据失败: {str(e)}'
+    return bvid, True, None
+
+
+def reprocess(kind: str, bv_list: Optional[List[str]] = None, archive_path: str = DEFAULT_ARCHIVE_PATH,
+              save_dir: Optional[str] = None, save_format: str = 'both', workers: Optional[int] = None,
+              cache_path: Optional[str] = DEFAULT_CACHE_PATH, pages: Optional[int] = None,
+              options: Optional[Dict] = None) -> Dict:
+    """
+    从原始响应存档重新解析并保存，不发任何网络请求
+
+    每个视频在进程池中独立解析和写出，吞吐只取决于CPU核数和磁盘。
+
+    :param kind: 'danmaku' 或 'comments'
+    :param bv_list: 要处理的BV号，默认为存档中有视频信息的全部视频
+    :param save_dir: 输出目录，默认与对应爬虫相同
+    :param workers: 进程数，默认为CPU核数
+    :param cache_path: 存档中没有视频信息时使用的视频信息缓存
+    :param pages: 评论最多重放的页数，None 为全部
+    :param options: 传给 BilibiliScraper / BilibiliCrawler 的参数，例如 xml_engine、danmaku_source、comment_mode
+    :return: {'done', 'failed', 'failures': {bvid: 原因}, 'seconds'}
+    """
+    if save_format not in REPROCESS_FORMATS:
+        raise ValueError(f'不支持的保存格式: {save_format}，可选 {REPROCESS_FORMATS}')
+    save_dir = save_dir or ('bilibili_data' if kind == 'danmaku' else 'bilibili_comment_data')
+    logger = logging.getLogger(__name__)
+    if bv_list is None:
+        archive = RawArchive(archive_path, train_samples=0)
+        bv_list = list(archive.keys('view'))
+        archive.close()
+    worker = reprocess_danmaku if kind == 'danmaku' else reprocess_comments
+
+    start = time.perf_counter()
+    failures = {}
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, initializer=_init_worker,
+                             initargs=(kind, archive_path, cache_path, save_dir, save_format, pages,
+                                       options or {})) as pool:
+        for i, (bvid, ok, reason) in enumerate(pool.map(worker, bv_list, chunksize=4), 1):
+            if ok:
+                done += 1
+            else:
+                failures[bvid] = reason
+                logger.error(f"重新处理失败: {bvid} - {reason}")
+            if i % 100 == 0:
+                logger.info(f"重新处理进度: {i}/{len(bv_list)}")
+    seconds = time.perf_counter() - start
+    logger.info(f"重新处理完成: 成功{done}, 失败{len(failures)}, 耗时{seconds:.1f}秒")
+    return {'done': done, 'failed': len(failures), 'failures': failures, 'seconds': seconds}
+
+
+def main():
+    """
+    修改解析或字段映射后，从原始响应存档重新生成输出，例如
+
+        python reprocess.py danmaku --input results/bv_list.txt --format both --xml-engine fast
+        python reprocess.py comments --format sqlite --workers 8
+    """
+    parser = argparse.ArgumentParser(description='从原始响应存档离线重新解析保存弹幕/评论')
+    parser.add_argument('kind', choices=['danmaku', 'comments'])
+    parser.add_argument('--archive', default=DEFAULT_ARCHIVE_PATH, help='存档数据库路径')
+    parser.add_argument('--input', help='BV号列表文件，默认为存档中的全部视频')
+    parser.add_argument('--save-dir', help='输出目录，默认与爬虫相同')
+    parser.add_argument('--format', default='both', choices=REPROCESS_FORMATS)
+    parser.add_argument('--workers', type=int, help='进程数，默认为CPU核数')
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help='存档中没有视频信息时使用的视频信息缓存')
+    parser.add_argument('--xml-engine', default='etree', choices=['etree', 'fast', 'batch'])
+    parser.add_argument('--danmaku-source', default='xml', choices=['xml', 'seg'],
+                        help='XML和分段弹幕都存档过时优先使用哪个')
+    parser.add_argument('--mode', default='hot', choices=['hot', 'time'], help='评论排序方式，与爬取时一致')
+    parser.add_argument('--pages', type=int, help='评论最多重放的页数')
+    parser.add_argument('--sub-replies', action='store_true', help='同时重放楼中楼回复')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    bv_list = None
+    if args.input:
+        with open(args.input, 'r', encoding='utf-8') as f:
+            bv_list = [line.strip() for line in f if line.strip()]
+    if args.kind == 'danmaku':
+        options = {'xml_engine': args.xml_engine, 'danmaku_source': args.danmaku_source}
+    else:
+        options = {'comment_mode': HOT_MODE if args.mode == 'hot' else TIME_MODE, 'sub_replies': args.sub_replies}
+    reprocess(args.kind, bv_list, args.archive, args.save_dir, args.format, args.workers, args.cache,
+              args.pages, options)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,138 @@
-import requests
-import time
 import json
 import os
 import logging
 import csv
-from typing import Dict, Optional 
+import heapq
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import chain
+from typing import Callable, Dict, Optional, Iterable, Iterator, List, Tuple
+
+from utils.http_client import get_client
+from utils.rate_limiter import limiter_stats
+from utils.video_cache import get_video_cache
+from utils.columnar import COMMENT_SCHEMA, ParquetDataset, write_parquet
+from utils.sqlite_store import DEFAULT_STORE_PATH, SQLiteStore, get_store
+from utils.timefmt import format_timestamp
+from utils.crawl_journal import PROGRESS, CrawlJournal, journal_path
+from utils.metrics import ITEMS, PARSE_SECONDS, WRITE_SECONDS, start_metrics_server, start_run, write_summary
+from utils.work_queue import DEFAULT_QUEUE_PATH, WorkQueue, run_worker
+from utils.raw_archive import RawArchive, get_archive
+from utils.bvid_codec import try_bv_to_av
+from utils.task_context import bind
+
+# 评论排序方式：3 按热度，2 按时间
+HOT_MODE = 3
+TIME_MODE = 2
+
+# 评论CSV表头
+CSV_HEADER = [
+    '视频标题', '视频BV号', '视频AV号', '作者', '发布时间',
+    '评论用户名', '评论内容', '点赞数', '评论时间', '评论ID', '用户ID'
+]
+# 爬取楼中楼时追加的两列，一级评论为空
+SUB_REPLY_HEADER = ['根评论ID', '父评论ID']
+
+# 楼中楼接口每页条数
+SUB_REPLY_PAGE_SIZE = 20
+
+
+def reply_to_comment(reply: Dict) -> Dict:
+    """把接口返回的一条评论转换为保存用的评论字典"""
+    return {
+        "user": reply["member"]["uname"],
+        "content": reply["content"]["message"],
+        "likes": reply["like"],
+        "reply_time": format_timestamp(reply["ctime"]),
+        "rpid": str(reply["rpid"]),  # 添加评论ID
+        "mid": str(reply["member"]["mid"])  # 添加用户ID
+    }
+
+
+def sub_reply_to_comment(reply: Dict) -> Dict:
+    """楼中楼回复：在评论字典的基础上记录根评论和被回复的评论"""
+    comment = reply_to_comment(reply)
+    comment["root"] = str(reply["root"])
+    comment["parent"] = str(reply["parent"])
+    return comment
+
+
+def convert_page(replies: List[Dict], convert: Callable[[Dict], Dict] = reply_to_comment,
+                 kind: str = 'comments') -> List[Dict]:
+    """把接口返回的一页评论转换为评论字典，计入解析耗时和条数"""
+    with PARSE_SECONDS.time(kind):
+        comments = [convert(reply) for reply in replies]
+    ITEMS.inc(kind, amount=len(comments))
+    return comments
+
+
+def reply_key(aid: int, mode: int, cursor) -> str:
+    """一页评论在原始响应存档中的键"""
+    return f'{aid}:{mode}:{cursor}'
+
+
+def sub_reply_key(aid: int, root: int, pn: int) -> str:
+    """一页楼中楼回复在原始响应存档中的键"""
+    return f'{aid}:{root}:{pn}'
+
+
+def next_cursor(cursor: Dict):
+    """
+    从响应的cursor中取下一页的游标
+
+    新版响应在 pagination_reply.next_offset 中给出偏移量字符串，旧版直接给出 next
+    """
+    offset = (cursor.get('pagination_reply') or {}).get('next_offset')
+    return offset if offset else cursor.get('next')
+
 
 class BilibiliCrawler:
-    def __init__(self, save_dir: str = 'bilibili_comment_data'):
-        self.headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "Referer": "https://www.bilibili.com",
-        }
+    def __init__(self, save_dir: str = 'bilibili_comment_data', comment_mode: int = HOT_MODE,
+                 comment_prefetch: int = 3, sub_replies: bool = False, sub_reply_workers: int = 4,
+                 sub_reply_budget: Optional[int] = None, metrics_port: Optional[int] = None,
+                 archive_path: Optional[str] = None):
+        """
+        :param comment_mode: 评论排序方式，HOT_MODE 按热度，TIME_MODE 按时间
+        :param comment_prefetch: 翻页时最多同时在途的请求数。游标按固定步长前进时，
+                                 按推算的游标提前请求后面几页；推算错了就丢弃，按真实游标重新请求
+        :param sub_replies: 是否同时爬取楼中楼回复
+        :param sub_reply_workers: 同时请求楼中楼的线程数（至少为1），与一级评论共用reply接口的限速
+        :param sub_reply_budget: 每个视频最多发出的楼中楼请求数，None 为不限；回复多的楼优先
+        :param metrics_port: 在本机这个端口上提供Prometheus格式的指标（/metrics），None 为不启动
+        :param archive_path: 把视频信息和评论的原始响应压缩保存到这个存档（utils/raw_archive.py），
+                             修改字段映射后用 reprocess.py 离线重新处理；None 为不保存
+        """
+        # 共享的连接池客户端，请求头和超时统一在 utils/http_client.py 中设置
+        self.http = get_client()
+        # 视频信息缓存，与弹幕爬虫等共用
+        self.view_cache = get_video_cache()
+        if metrics_port:
+            start_metrics_server(metrics_port)
+        # 原始响应存档，与弹幕爬虫共用
+        self.archive: Optional[RawArchive] = get_archive(archive_path) if archive_path else None
+
+        # API URLs
+        self.video_info_url = "https://api.bilibili.com/x/web-interface/view"
+        self.reply_url = "https://api.bilibili.com/x/v2/reply/main"
+        self.sub_reply_url = "https://api.bilibili.com/x/v2/reply/reply"
+
+        self.comment_mode = comment_mode
+        # process_from_file 运行期间的断点日志
+        self.journal: Optional[CrawlJournal] = None
+        self.comment_prefetch = comment_prefetch
+        self.sub_replies = sub_replies
+        if sub_reply_workers < 1:
+            # 为0时线程池不会调度任何楼中楼请求；不需要楼中楼时用 sub_replies=False
+            raise ValueError("sub_reply_workers 必须大于0")
+        self.sub_reply_workers = sub_reply_workers
+        self.sub_reply_budget = sub_reply_budget
 
         self.save_dir = save_dir
+        # save_format='dataset' 时所有视频追加写入的Parquet数据集，用到时才创建
+        self._dataset = None
+        # save_format='sqlite' 写入的数据库，与弹幕爬虫共用
+        self.store_path = DEFAULT_STORE_PATH
         if not os.path.exists(save_dir):
             os.makedirs(save_dir)
             
@@ -35,163 +154,527 @@ class BilibiliCrawler:
             filename = filename.replace(char, '_')
         return filename.strip()[:100]  # 限制文件名长度
 
+    def archive_response(self, endpoint: str, key: str, body: bytes):
+        """启用了原始响应存档时保存一次响应"""
+        if self.archive is not None:
+            self.archive.put(endpoint, key, body)
+
+    def fetch_view(self, bvid: str) -> Optional[Dict]:
+        """请求视频信息接口（不经过缓存）"""
+        response = self.http.get(self.video_info_url, params={"bvid": bvid}, endpoint="view")
+        data = response.json()
+        if data["code"] == 0:
+            self.archive_response("view", bvid, response.content)
+            return data["data"]
+        else:
+            self.logger.error(f"获取视频信息失败: {data['message']}")
+            return None
+
     def bv_to_aid(self, bvid: str) -> Optional[Dict]:
         """将BV号转换为aid并获取视频信息"""
-        url = f"https://api.bilibili.com/x/web-interface/view?bvid={bvid}"
         try:
-            response = requests.get(url, headers=self.headers)
-            data = response.json()
-            if data["code"] == 0:
-                return data["data"]
-            else:
-                self.logger.error(f"获取视频信息失败: {data['message']}")
-                return None
+            return self.view_cache.get_or_fetch(
+                bvid, self.fetch_view, fields=("aid", "title", "bvid", "owner", "pubdate")
+            )
         except Exception as e:
             self.logger.error(f"获取视频信息时发生错误: {str(e)}")
             return None
 
-    def get_comments(self, aid: int, pages: int = 1) -> list:
-        """获取视频评论"""
-        all_comments = []
+    def resolve_aid(self, bvid: str) -> Optional[int]:
+        """BV号对应的aid：格式正确的BV号在本地换算，不发请求；否则通过视频信息接口获取"""
+        aid = try_bv_to_av(bvid)
+        if aid is not None:
+            return aid
+        video_info = self.bv_to_aid(bvid)
+        return video_info['aid'] if video_info else None
 
-        for page in range(1, pages + 1):
-            url = "https://api.bilibili.com/x/v2/reply/main"
-            params = {"oid": aid, "type": 1, "next": page, "mode": 3}
+    def fetch_reply_page(self, aid: int, mode: int, cursor) -> Tuple[Dict, bytes]:
+        """
+        请求一页评论，在预取线程中执行
 
-            try:
-                response = requests.get(url, headers=self.headers, params=params)
-                data = response.json()
-
-                if data["code"] == 0:
-                    replies = data["data"]["replies"]
-                    if not replies:
-                        break
-
-                    for reply in replies:
-                        comment = {
-                            "user": reply["member"]["uname"],
-                            "content": reply["content"]["message"],
-                            "likes": reply["like"],
-                            "reply_time": time.strftime(
-                                "%Y-%m-%d %H:%M:%S", time.localtime(reply["ctime"])
-                            ),
-                            "rpid": str(reply["rpid"]),  # 添加评论ID
-                            "mid": str(reply["member"]["mid"])  # 添加用户ID
-                        }
-                        all_comments.append(comment)
-
-                    self.logger.info(f"成功获取第{page}页评论")
-                    time.sleep(1)  # 避免请求过快
-                else:
+        :return: (解析后的JSON, 原始响应)；推算的游标可能作废，由调用方确认是真实的一页后再存档
+        """
+        params = {"oid": aid, "type": 1, "mode": mode}
+        if isinstance(cursor, str):
+            params["pagination_str"] = json.dumps({"offset": cursor})
+        else:
+            params["next"] = cursor
+        response = self.http.get(self.reply_url, params=params, endpoint="reply")
+        return response.json(), response.content
+
+    def iter_reply_pages(self, aid: int, pages: Optional[int] = None, mode: Optional[int] = None,
+                         cursor=0, done_pages: int = 0,
+                         checkpoint: Optional[Callable[[int, object], None]] = None) -> Iterator[List[Dict]]:
+        """
+        按接口返回的游标逐页产出一级评论的原始数据，当前页处理时下一页的请求已经发出
+
+        :param pages: 最多获取的页数，None 为直到最后一页
+        :param mode: 排序方式，默认使用 comment_mode
+        :param cursor: 从这个游标开始翻页，用于从断点继续
+        :param done_pages: 断点之前已经获取的页数，计入pages
+        :param checkpoint: 调用方处理完一页、要下一页时调用 checkpoint(已处理的页数, 下一页的游标)，最后一页之后不调用
+        """
+        mode = self.comment_mode if mode is None else mode
+        window = max(1, self.comment_prefetch)
+        pool = ThreadPoolExecutor(max_workers=window, thread_name_prefix='reply')
+        # 在途的请求: (游标, future)，按翻页顺序排列
+        inflight = deque()
+        inflight.append((cursor, pool.submit(bind(self.fetch_reply_page), aid, mode, cursor)))
+        page = done_pages
+        # 最近两次真实游标的差，游标按固定步长前进时据此推算后面几页
+        last_cursor = step = None
+        # 接口给出评论总数时，推算请求不超过最后一页
+        last_page = pages
+        # 推算错一次说明这个视频的游标不是固定步长，之后不再推算
+        speculate = True
+        try:
+            while inflight:
+                requested, future = inflight.popleft()
+                try:
+                    data, body = future.result()
+                except Exception as e:
+                    self.logger.error(f"获取评论时发生错误: {str(e)}")
+                    break
+                if data["code"] != 0:
                     self.logger.error(f"获取评论失败: {data['message']}")
                     break
+                self.archive_response("reply", reply_key(aid, mode, requested), body)
+                replies = data["data"].get("replies")
+                if not replies:
+                    break
+                page += 1
 
-            except Exception as e:
-                self.logger.error(f"获取评论时发生错误: {str(e)}")
-                break
+                cursor = data["data"].get("cursor") or {}
+                following = next_cursor(cursor)
+                if page == done_pages + 1 and cursor.get("all_count"):
+                    total_pages = -(-cursor["all_count"] // len(replies))
+                    last_page = total_pages if pages is None else min(pages, total_pages)
+                done = cursor.get("is_end") or following is None or (pages is not None and page >= pages)
+
+                if done:
+                    self._drop_inflight(inflight)
+                else:
+                    if isinstance(following, int) and isinstance(last_cursor, int):
+                        step = following - last_cursor
+                    last_cursor = following
+                    # 提前发出的请求游标推算错了，全部作废，还没开始的请求不再发出
+                    if inflight and inflight[0][0] != following:
+                        self._drop_inflight(inflight)
+                        speculate = False
+                    if not inflight:
+                        inflight.append((following, pool.submit(bind(self.fetch_reply_page), aid, mode, following)))
+                    while speculate and step and len(inflight) < window and \
+                            (last_page is None or page + len(inflight) < last_page):
+                        predicted = inflight[-1][0] + step
+                        inflight.append((predicted, pool.submit(bind(self.fetch_reply_page), aid, mode, predicted)))
+
+                self.logger.info(f"成功获取第{page}页评论")
+                yield replies
+                if done:
+                    break
+                if checkpoint:
+                    checkpoint(page, following)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _drop_inflight(inflight: deque):
+        """作废在途的预取请求，还在排队的直接取消"""
+        while inflight:
+            _, future = inflight.popleft()
+            future.cancel()
+
+    def iter_comment_pages(self, aid: int, pages: Optional[int] = None, mode: Optional[int] = None,
+                           **kwargs) -> Iterator[List[Dict]]:
+        """逐页产出一级评论字典，参数同 iter_reply_pages"""
+        for replies in self.iter_reply_pages(aid, pages=pages, mode=mode, **kwargs):
+            yield convert_page(replies)
+
+    def fetch_sub_reply_page(self, aid: int, root: int, pn: int) -> Dict:
+        """请求某条一级评论下的一页楼中楼回复，返回解析后的JSON"""
+        params = {"oid": aid, "type": 1, "root": root, "pn": pn, "ps": SUB_REPLY_PAGE_SIZE}
+        response = self.http.get(self.sub_reply_url, params=params, endpoint="reply")
+        data = response.json()
+        if data["code"] == 0:
+            self.archive_response("sub_reply", sub_reply_key(aid, root, pn), response.content)
+        return data
+
+    def iter_thread_pages(self, aid: int, pages: Optional[int] = None,
+                          mode: Optional[int] = None) -> Iterator[List[Dict]]:
+        """
+        逐页产出一级评论和楼中楼回复
+
+        一级评论翻页的同时，楼中楼按页调度到线程池中：待抓取的楼按回复数（rcount）排序，
+        回复多的楼先抓，每抓完一页再把同一楼的下一页放回队列，抓到的每一页立即产出，
+        不会把整楼回复攒在内存里。一级评论自带的预览回复已经是整楼时不再请求。
+        """
+        # 待抓取的楼中楼页: (-rcount, 序号, root, pn)
+        queue = []
+        seq = 0
+        budget = self.sub_reply_budget
+        pool = ThreadPoolExecutor(max_workers=self.sub_reply_workers, thread_name_prefix='sub_reply')
+        running = {}
+
+        def schedule():
+            nonlocal budget
+            while queue and len(running) < self.sub_reply_workers and (budget is None or budget > 0):
+                _, _, root, pn = item = heapq.heappop(queue)
+                running[pool.submit(bind(self.fetch_sub_reply_page), aid, root, pn)] = item
+                if budget is not None:
+                    budget -= 1
 
-        return all_comments
+        def collect(done) -> Iterator[List[Dict]]:
+            for future in done:
+                priority, order, root, pn = running.pop(future)
+                try:
+                    data = future.result()
+                except Exception as e:
+                    self.logger.error(f"获取楼中楼回复时发生错误: {root} 第{pn}页 {str(e)}")
+                    continue
+                if data["code"] != 0:
+                    self.logger.error(f"获取楼中楼回复失败: {root} 第{pn}页 {data['message']}")
+                    continue
+                replies = data["data"].get("replies") or []
+                count = (data["data"].get("page") or {}).get("count", 0)
+                if replies and pn * SUB_REPLY_PAGE_SIZE < count:
+                    heapq.heappush(queue, (priority, order, root, pn + 1))
+                if replies:
+                    yield convert_page(replies, sub_reply_to_comment, 'sub_replies')
+
+        try:
+            for replies in self.iter_reply_pages(aid, pages=pages, mode=mode):
+                yield convert_page(replies)
+                for reply in replies:
+                    rcount = reply.get("rcount") or 0
+                    preview = reply.get("replies") or []
+                    if rcount and rcount <= len(preview):
+                        yield convert_page(preview, sub_reply_to_comment, 'sub_replies')
+                    elif rcount:
+                        heapq.heappush(queue, (-rcount, seq, reply["rpid"], 1))
+                        seq += 1
+                schedule()
+                yield from collect([future for future in list(running) if future.done()])
+                schedule()
+
+            while running:
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                yield from collect(done)
+                schedule()
+            if queue:
+                self.logger.warning(f"楼中楼请求数达到上限，{len(queue)}页回复未抓取")
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def get_comments(self, aid: int, pages: int = 1, mode: Optional[int] = None) -> list:
+        """获取视频评论"""
+        return list(chain.from_iterable(self.iter_comment_pages(aid, pages=pages, mode=mode)))
+
+    def get_comments_by_bvid(self, bvid: str, pages: int = 1, mode: Optional[int] = None) -> list:
+        """按BV号获取视频评论，aid在本地换算，不请求视频信息"""
+        aid = self.resolve_aid(bvid)
+        if aid is None:
+            return []
+        return self.get_comments(aid, pages=pages, mode=mode)
+
+    def summary_info(self, video_info: Dict) -> Dict:
+        """保存到输出文件中的视频级字段"""
+        return {
+            'title': video_info['title'],
+            'bvid': video_info['bvid'],
+            'aid': video_info['aid'],
+            'author': video_info['owner']['name'],
+            'pub_date': format_timestamp(video_info['pubdate'])
+        }
+
+    @property
+    def dataset(self) -> ParquetDataset:
+        """save_format='dataset' 使用的分区数据集，位于保存目录下的 comment_dataset"""
+        if self._dataset is None:
+            self._dataset = ParquetDataset(os.path.join(self.save_dir, 'comment_dataset'), COMMENT_SCHEMA)
+        return self._dataset
+
+    @property
+    def store(self) -> SQLiteStore:
+        """save_format='sqlite' 使用的数据库"""
+        return get_store(self.store_path)
+
+    def close_dataset(self):
+        """写出数据集中还没落盘的行"""
+        if self._dataset is not None:
+            self._dataset.close()
+            self._dataset = None
 
     def save_comments(self, comments: list, video_info: Dict, save_format: str = 'both'):
-        """保存评论数据"""
+        """
+        保存评论数据
+
+        :param save_format: 'json'、'csv'、'both'，'parquet' 为每个视频一个列式文件，
+                            'dataset' 为追加写入保存目录下的 comment_dataset 分区数据集，
+                            'sqlite' 为写入 store_path 数据库，按rpid去重
+        """
         try:
             # 使用视频标题作为文件名
             base_filename = self.sanitize_filename(video_info['title'])
+
+            if save_format == 'parquet':
+                parquet_path = os.path.join(self.save_dir, f'{base_filename}_comments.parquet')
+                write_parquet(parquet_path, comments, COMMENT_SCHEMA, self.summary_info(video_info),
+                              {'total_comments': len(comments)})
+                self.logger.info(f"已保存Parquet文件: {parquet_path}")
+
+            if save_format == 'dataset':
+                self.dataset.append(comments, self.summary_info(video_info), {'total_comments': len(comments)})
+                self.logger.info(f"已追加到数据集: {video_info['title']} ({len(comments)}条)")
+
+            if save_format == 'sqlite':
+                changed = self.store.save_comments(self.summary_info(video_info), comments)
+                self.logger.info(f"已写入数据库: {video_info['title']} (新增或更新{changed}条)")
             
-            if save_format in ['json', 'both']:
-                # 保存JSON格式
-                json_path = os.path.join(self.save_dir, f'{base_filename}_comments.json')
-                with open(json_path, 'w', encoding='utf-8') as f:
-                    json.dump({
-                        'video_info': {
-                            'title': video_info['title'],
-                            'bvid': video_info['bvid'],
-                            'aid': video_info['aid'],
-                            'author': video_info['owner']['name'],
-                            'pub_date': time.strftime('%Y-%m-%d %H:%M:%S', 
-                                                    time.localtime(video_info['pubdate']))
-                        },
-                        'comments_data': comments,
-                        'total_comments': len(comments)
-                    }, f, ensure_ascii=False, indent=2)
-                self.logger.info(f"已保存JSON文件: {json_path}")
-            
-            if save_format in ['csv', 'both']:
-                # 保存CSV格式
-                csv_path = os.path.join(self.save_dir, f'{base_filename}_comments.csv')
-                with open(csv_path, 'w', encoding='utf-8-sig', newline='') as f:  # 使用 utf-8-sig 编码，支持Excel打开
-                    writer = csv.writer(f, escapechar='\\', quoting=csv.QUOTE_ALL)  # 添加转义字符和引号
-                    # 写入表头
-                    writer.writerow([
-                        '视频标题', '视频BV号', '视频AV号', '作者', '发布时间',
-                        '评论用户名', '评论内容', '点赞数', '评论时间', '评论ID', '用户ID'
-                    ])
-                    # 写入评论数据
+            if save_format in ['json', 'csv', 'both']:
+                for path in self.save_comments_stream([comments], video_info, save_format):
+                    self.logger.info(f"已保存文件: {path}")
+
+        except Exception as e:
+            self.logger.error(f"保存数据失败: {str(e)}")
+            raise
+
+    def output_paths(self, video_info: Dict, save_format: str = 'both') -> List[str]:
+        """save_format 为json/csv/both时的输出文件路径"""
+        base_filename = self.sanitize_filename(video_info['title'])
+        paths = []
+        if save_format in ['json', 'both']:
+            paths.append(os.path.join(self.save_dir, f'{base_filename}_comments.json'))
+        if save_format in ['csv', 'both']:
+            paths.append(os.path.join(self.save_dir, f'{base_filename}_comments.csv'))
+        return paths
+
+    def save_comments_stream(self, pages: Iterable[List[Dict]], video_info: Dict,
+                             save_format: str = 'both') -> List[str]:
+        """
+        逐页写出评论，同时写JSON和CSV，内存中只有当前一页，输出内容与一次性 json.dump 相同
+
+        :param pages: 每个元素为一页评论，可以是 iter_comment_pages 的生成器
+        :return: 写入的文件路径
+        """
+        paths = self.output_paths(video_info, save_format)
+        # CSV使用 utf-8-sig 编码，支持Excel打开
+        files = [open(path, 'w', encoding='utf-8-sig' if path.endswith('.csv') else 'utf-8',
+                      newline='' if path.endswith('.csv') else None) for path in paths]
+        try:
+            json_file = csv_writer = None
+            for path, f in zip(paths, files):
+                if path.endswith('.json'):
+                    json_file = f
+                else:
+                    csv_writer = csv.writer(f, escapechar='\\', quoting=csv.QUOTE_ALL)  # 添加转义字符和引号
+                    csv_writer.writerow(CSV_HEADER + SUB_REPLY_HEADER if self.sub_replies else CSV_HEADER)
+            # 视频级字段每行都一样，只算一次
+            video_columns = [
+                video_info['title'],
+                video_info['bvid'],
+                str(video_info['aid']),
+                video_info['owner']['name'],
+                format_timestamp(video_info['pubdate']),
+            ]
+
+            # JSON先写出 "comments_data": [ 之前的部分，缩进与 json.dump(indent=2) 一致，评论总数最后写
+            json_tail = ''
+            if json_file:
+                skeleton = json.dumps({
+                    'video_info': self.summary_info(video_info),
+                    'comments_data': [],
+                    'total_comments': 0
+                }, ensure_ascii=False, indent=2)
+                json_head, json_tail = skeleton.rsplit('"comments_data": []', 1)
+                json_file.write(json_head + '"comments_data": [')
+
+            count = 0
+            for comments in pages:
+                start = time.perf_counter()
+                if json_file:
                     for comment in comments:
-                        # 处理可能包含换行符的内容
-                        content = comment['content'].replace('\n', ' ').replace('\r', ' ')
-                        writer.writerow([
-                            video_info['title'],
-                            video_info['bvid'],
-                            str(video_info['aid']),
-                            video_info['owner']['name'],
-                            time.strftime('%Y-%m-%d %H:%M:%S', 
-                                        time.localtime(video_info['pubdate'])),
+                        item = json.dumps(comment, ensure_ascii=False, indent=2).replace('\n', '\n    ')
+                        json_file.write((',\n    ' if count else '\n    ') + item)
+                        count += 1
+                else:
+                    count += len(comments)
+                if csv_writer:
+                    # 处理可能包含换行符的内容
+                    rows = (
+                        video_columns + [
                             comment['user'],
-                            content,  # 使用处理过的内容
+                            comment['content'].replace('\n', ' ').replace('\r', ' '),
                             comment['likes'],
                             comment['reply_time'],
                             comment.get('rpid', ''),
                             comment.get('mid', '')
-                        ])
-                self.logger.info(f"已保存CSV文件: {csv_path}")
-                
-        except Exception as e:
-            self.logger.error(f"保存数据失败: {str(e)}")
-            raise
+                        ]
+                        for comment in comments
+                    )
+                    if self.sub_replies:
+                        rows = (row + [comment.get('root', ''), comment.get('parent', '')]
+                                for row, comment in zip(rows, comments))
+                    csv_writer.writerows(rows)
+                WRITE_SECONDS.observe(time.perf_counter() - start, 'comments', save_format)
+
+            if json_file:
+                json_tail = json_tail.replace('"total_comments": 0', f'"total_comments": {count}')
+                json_file.write(('\n  ]' if count else ']') + json_tail)
+        finally:
+            for f in files:
+                f.close()
+        return paths
 
     def process_video(self, bvid: str, save_format: str = 'both', pages: int = 100) -> bool:
         """处理单个视频"""
         self.logger.info(f"开始处理视频: {bvid}")
         
-        # 获取视频信息
-        video_info = self.bv_to_aid(bvid)
-        if not video_info:
-            return False
-            
-        # 获取评论
-        comments = self.get_comments(video_info['aid'], pages=pages)  # 获取100页评论
-        if not comments:
-            self.logger.warning(f"未获取到评论: {video_info['title']} ({bvid})")
-            return False
+        # 评论接口只需要aid，格式正确的BV号在本地换算，视频信息（标题、UP主等保存时才用到）
+        # 与第一页评论同时请求；换算不了的BV号先请求视频信息拿到aid
+        aid = try_bv_to_av(bvid)
+        # 每次调用单独的线程池，处理完就关闭，不会在爬虫对象上留下线程
+        pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='view') if aid is not None else None
+        try:
+            view = pool.submit(bind(self.bv_to_aid), bvid) if pool is not None else None
+            if view is None:
+                video_info = self.bv_to_aid(bvid)
+                if not video_info:
+                    return False
+                aid = video_info['aid']
             
-        # 保存数据
-        self.save_comments(comments, video_info, save_format)
+            # 逐页获取评论（和楼中楼回复），第一页为空时不创建输出文件
+            if self.sub_replies:
+                comment_pages = self.iter_thread_pages(aid, pages=pages)
+            elif save_format == 'sqlite' and self.journal:
+                # 数据库逐页提交，断点日志记下每页之后的游标，中断后从这里继续
+                entry = self.journal.get(bvid)
+                resume = entry if entry and entry['status'] == PROGRESS else {'cursor': 0, 'page': 0}
+                if resume['page']:
+                    self.logger.info(f"从第{resume['page'] + 1}页继续: {bvid}")
+                comment_pages = self.iter_comment_pages(
+                    aid, pages=pages, cursor=resume['cursor'], done_pages=resume['page'],
+                    checkpoint=lambda page, cursor: self.journal.progress(bvid, cursor, page)
+                )
+            else:
+                comment_pages = self.iter_comment_pages(aid, pages=pages)
+            first_page = next(comment_pages, None)
+            if view is not None:
+                video_info = view.result()
+                if not video_info:
+                    comment_pages.close()
+                    return False
+            if not first_page:
+                self.logger.warning(f"未获取到评论: {video_info['title']} ({bvid})")
+                return False
+            self.save_comment_pages(chain([first_page], comment_pages), video_info, save_format)
         
-        self.logger.info(f"视频处理完成: {video_info['title']} ({bvid})")
-        return True
+            self.logger.info(f"视频处理完成: {video_info['title']} ({bvid})")
+            return True
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def save_comment_pages(self, comment_pages: Iterable[List[Dict]], video_info: Dict, save_format: str = 'both'):
+        """保存逐页产出的评论：JSON/CSV边翻页边写出，数据库逐页提交，其他格式需要整个视频的评论"""
+        if save_format in ['json', 'csv', 'both']:
+            try:
+                for path in self.save_comments_stream(comment_pages, video_info, save_format):
+                    self.logger.info(f"已保存文件: {path}")
+            except Exception as e:
+                self.logger.error(f"保存数据失败: {str(e)}")
+                raise
+        elif save_format == 'sqlite':
+            changed = 0
+            for comments in comment_pages:
+                with WRITE_SECONDS.time('comments', save_format):
+                    changed += self.store.save_comments(self.summary_info(video_info), comments)
+            self.logger.info(f"已写入数据库: {video_info['title']} (新增或更新{changed}条)")
+        else:
+            comments = list(chain.from_iterable(comment_pages))
+            with WRITE_SECONDS.time('comments', save_format):
+                self.save_comments(comments, video_info, save_format)
+
+    def process_from_file(self, input_file: str, save_format: str = "both", pages: int = 10,
+                          resume: bool = True, retry_failed: bool = False):
+        """
+        从文件读取BV号并处理
+
+        处理结果逐个写入保存目录下的断点日志（journal/输入文件名.jsonl），中途被杀掉后重新运行只处理剩下的视频；
+        save_format='sqlite' 时还记录评论翻到的游标，从中断的那一页继续。
 
-    def process_from_file(self, input_file: str, save_format: str = "both",pages: int = 10):
-        """从文件读取BV号并处理"""
+        :param resume: 接着上一轮没跑完的断点日志继续；为False或上一轮已经跑完时从头开始
+        :param retry_failed: 只重新处理断点日志中失败的视频
+        """
+        # 结束时的指标汇总只统计这一轮
+        start_run()
         try:
             with open(input_file, "r", encoding="utf-8") as f:
                 bv_list = [line.strip() for line in f if line.strip()]
 
-            total = len(bv_list)
+            self.journal = CrawlJournal(journal_path(self.save_dir, input_file))
+            self.journal.begin(len(bv_list), resume=resume, retry_failed=retry_failed)
+            todo = self.journal.pending(bv_list, retry_failed)
+            total = len(todo)
             success = 0
+            self.logger.info(f"共{len(bv_list)}个BV号，本轮需要处理{total}个")
 
-            for i, bvid in enumerate(bv_list, 1):
+            for i, bvid in enumerate(todo, 1):
                 self.logger.info(f"处理进度: {i}/{total} - {bvid}")
 
-                if self.process_video(bvid, save_format, pages):
+                # 请求速率由各接口族的自适应限速器控制，不再固定sleep
+                # 数据集在关闭时才真正写完，成功记录也推迟到那时
+                if self.journal.track(bvid, lambda: self.process_video(bvid, save_format, pages),
+                                      defer_done=save_format == 'dataset'):
                     success += 1
-
-                time.sleep(2)  # 增加延时到2秒，避免请求过快
+            self.close_dataset()
+            self.journal.finish()
 
             self.logger.info(f"处理完成，成功: {success}/{total}")
+            summary = self.journal.summary(bv_list)
+            failures = summary.pop('failures')
+            self.logger.info(f"断点日志统计: {summary} ({self.journal.path})")
+            for bvid, reason in failures.items():
+                self.logger.info(f"失败: {bvid} - {reason}")
+            self.logger.info(f"连接复用统计: {self.http.connection_stats()}")
+            self.logger.info(f"限速状态: {limiter_stats()}")
+            self.logger.info(f"指标汇总: {write_summary(self.save_dir)}")
+            self.logger.info(f"视频信息缓存: {self.view_cache.stats()}")
+            if save_format == 'sqlite':
+                self.logger.info(f"数据库: {self.store.stats()}")
 
         except Exception as e:
             self.logger.error(f"处理文件失败: {str(e)}")
+        finally:
+            if self.journal:
+                self.journal.close()
+                self.journal = None
+
+    def process_from_queue(self, queue_path: str = DEFAULT_QUEUE_PATH, save_format: str = "both", pages: int = 10,
+                           input_file: Optional[str] = None, worker_id: Optional[str] = None,
+                           lease_seconds: float = 300, max_attempts: int = 3) -> int:
+        """
+        作为worker从共享的爬取队列领取BV号并处理，可以在多个进程/多台机器上同时运行
+
+        每个BV号同一时间只租给一个worker，worker挂掉后租约过期，别的worker会接着处理。
+        队列为空且没有别的worker在处理时返回。
+
+        :param queue_path: 队列数据库路径，多台机器共用时放在共享盘上
+        :param input_file: 先把这个文件里的BV号加入队列（已经在队列里的跳过）
+        :return: 本worker成功处理的视频数
+        """
+        start_run()
+        queue = WorkQueue(queue_path, 'comment', lease_seconds=lease_seconds, max_attempts=max_attempts)
+        try:
+            if input_file:
+                self.logger.info(f"加入队列: {queue.enqueue_file(input_file)}个BV号")
+            # 数据集在关闭时才真正写完，之前一直持有租约
+            success = run_worker(queue, lambda bvid: self.process_video(bvid, save_format, pages), worker_id,
+                                 logger=self.logger, flush=self.close_dataset, defer_done=save_format == 'dataset')
+            self.logger.info(f"限速状态: {limiter_stats()}")
+            self.logger.info(f"指标汇总: {write_summary(self.save_dir)}")
+            return success
+        finally:
+            queue.close()
 
 def main():
     crawler = BilibiliCrawler()
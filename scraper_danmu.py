@@ -1,18 +1,335 @@
-import requests
 import xml.etree.ElementTree as ET
+import io
 import json
 import csv
 import os
 import logging
-from datetime import datetime
-from typing import Dict, Optional, List, Tuple
+from typing import Awaitable, Callable, Dict, Optional, List, Tuple, Iterable, Iterator, TextIO, Union
 import time
 import re
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import aiohttp
+
+from utils.http_client import get_client
+from utils.rate_limiter import limiter_stats, set_global_rate
+from utils.video_cache import get_video_cache
+from utils.danmaku_manifest import DanmakuManifest, content_hash
+from utils.danmaku_fastparse import HEADER_FIELDS, parse_xml_fast, columns_to_comments
+from utils.dm_protobuf import decode_segment, elem_to_comment, segment_count
+from utils.columnar import DANMAKU_SCHEMA, ParquetDataset, write_parquet
+from utils.sqlite_store import DEFAULT_STORE_PATH, SQLiteStore, get_store
+from utils.timefmt import format_timestamp
+from utils.danmaku_batch import DanmakuBatch
+from utils.crawl_journal import CrawlJournal, ErrorCapture, journal_path
+from utils.pipeline import Pipeline, Stage
+from utils.metrics import ITEMS, PARSE_SECONDS, WRITE_SECONDS, start_metrics_server, start_run, write_summary
+from utils.work_queue import DEFAULT_QUEUE_PATH, WorkQueue, run_worker
+from utils.raw_archive import RawArchive, get_archive
+from utils.task_context import bind, task_scope
+
+# 每个视频单独写出文件的保存格式，流水线模式下在解析进程中序列化，由写入阶段写出
+FILE_FORMATS = ('json', 'csv', 'both', 'parquet')
+
+# 弹幕CSV表头
+CSV_HEADER = [
+    '视频标题', '视频BV号', '弹幕出现时间', '类型', '字体大小',
+    '颜色', '发送时间', '弹幕池', '用户哈希', '弹幕ID', '弹幕内容', '分P', '分P标题'
+]
+
+
+def csv_row_builder(video_info: Dict):
+    """返回把一条弹幕转换为CSV行的函数，视频级字段只取一次"""
+    title = video_info['title']
+    bvid = video_info['bvid']
+
+    def build(comment: Dict) -> List:
+        return [
+            title,
+            bvid,
+            comment['time'],
+            comment['type'],
+            comment['size'],
+            comment['color'],
+            format_timestamp(comment['timestamp']),
+            comment['pool'],
+            comment['user_hash'],
+            comment['dmid'],
+            comment['content'],
+            comment.get('page'),
+            comment.get('part'),
+        ]
+    return build
+
+
+def segment_key(cid: str, index: int) -> str:
+    """分段弹幕在原始响应存档中的键"""
+    return f'{cid}:{index}'
+
+
+def video_pages(data: Dict) -> List[Dict]:
+    """从视频信息中取出全部分P，每个分P有自己的cid"""
+    pages = data.get('pages') or []
+    if not pages:
+        return [{'cid': data['cid'], 'page': 1, 'part': data['title'], 'duration': data.get('duration')}]
+    return [{'cid': page['cid'], 'page': page['page'], 'part': page['part'], 'duration': page.get('duration')}
+            for page in pages]
+
+
+def tag_part(comments: Iterable[Dict], page: Dict) -> Iterator[Dict]:
+    """给弹幕加上所属分P的序号和标题"""
+    for comment in comments:
+        comment['page'] = page['page']
+        comment['part'] = page['part']
+        yield comment
+
+
+def tag_comments(comments: Union[List[Dict], DanmakuBatch], page: Dict) -> Union[List[Dict], DanmakuBatch]:
+    """给一个分P的全部弹幕加上分P信息，DanmakuBatch 整批标记，不展开成字典"""
+    if isinstance(comments, DanmakuBatch):
+        comments.set_part(page['page'], page['part'])
+        return comments
+    return list(tag_part(comments, page))
+
+
+def element_to_comment(d: ET.Element) -> Optional[Dict]:
+    """把一个<d>元素转换为弹幕字典，p属性不完整时返回None"""
+    p = d.get('p', '').split(',')
+    if len(p) >= 8:
+        return {
+            'time': float(p[0]),
+            'type': int(p[1]),
+            'size': int(p[2]),
+            'color': int(p[3]),
+            'timestamp': int(p[4]),
+            'pool': int(p[5]),
+            'user_hash': p[6],
+            'dmid': p[7],
+            'content': d.text
+        }
+    return None
+
+
+def iter_xml_elements(chunks: Iterable[bytes]) -> Iterator[ET.Element]:
+    """增量解析XML，逐个产出已经闭合的一级子元素，处理完的元素立即从树上摘掉"""
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    root = None
+    depth = 0
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == 'start':
+                if root is None:
+                    root = elem
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                yield elem
+                # 只保留还没闭合的元素，已处理的子元素不再占用内存
+                root.clear()
+    parser.close()
+
+
+def parse_danmaku_xml(xml_content: Union[bytes, str], xml_engine: str = 'etree') -> Dict:
+    """
+    解析XML格式的弹幕内容，解析失败时抛出异常
+
+    :param xml_engine: 解析方式，含义同 BilibiliScraper 的同名参数
+    """
+    if xml_engine == 'fast':
+        header, columns = parse_xml_fast(xml_content)
+        return dict(header, comments=columns_to_comments(columns))
+    if xml_engine == 'batch':
+        header, columns = parse_xml_fast(xml_content)
+        return dict(header, comments=DanmakuBatch.from_columns(columns))
+
+    root = ET.fromstring(xml_content)
+    # 格式正确的HTML错误页也能解析，和快速解析一样按弹幕XML的结构检查
+    if root.tag != 'i' or root.find('chatid') is None:
+        raise ET.ParseError('不是弹幕XML：缺少 <i> 根元素或 <chatid>')
+
+    info = {
+        'chatserver': root.find('chatserver').text if root.find('chatserver') is not None else '',
+        'chatid': root.find('chatid').text if root.find('chatid') is not None else '',
+        'mission': root.find('mission').text if root.find('mission') is not None else '',
+        'maxlimit': root.find('maxlimit').text if root.find('maxlimit') is not None else '',
+        'state': root.find('state').text if root.find('state') is not None else '',
+        'real_name': root.find('real_name').text if root.find('real_name') is not None else '',
+        'source': root.find('source').text if root.find('source') is not None else '',
+        'comments': []
+    }
+
+    for d in root.findall('d'):
+        comment = element_to_comment(d)
+        if comment:
+            info['comments'].append(comment)
+
+    return info
+
+
+def merge_danmaku_segments(cid: str, segments: List[bytes], xml_engine: str = 'etree') -> Dict:
+    """解码各分段并按dmid去重合并，返回与 parse_danmaku_xml 相同结构的弹幕数据"""
+    comments = {}
+    for segment in segments:
+        for elem in decode_segment(segment):
+            comment = elem_to_comment(elem)
+            comments[comment['dmid']] = comment
+
+    info = {field: '' for field in HEADER_FIELDS}
+    info['chatid'] = str(cid)
+    info['source'] = 'seg.so'
+    info['comments'] = sorted(comments.values(), key=lambda c: (c['time'], int(c['dmid'])))
+    if xml_engine == 'batch':
+        info['comments'] = DanmakuBatch.from_dicts(info['comments'])
+    return info
+
+
+def parse_danmaku_parts(pages: List[Dict], raws: List, xml_engine: str = 'etree') -> Dict:
+    """
+    解析各分P的原始弹幕并按分P顺序合并，头部字段取第1P
+
+    只依赖参数，可以放到进程池中执行；raws中XML模式为XML文本，分段模式为各分段数据
+    """
+    merged = None
+    for page, raw in zip(pages, raws):
+        if isinstance(raw, list):
+            data = merge_danmaku_segments(str(page['cid']), raw, xml_engine)
+        else:
+            data = parse_danmaku_xml(raw, xml_engine)
+        comments = tag_comments(data['comments'], page)
+        if merged is None:
+            merged = dict(data, comments=comments)
+        else:
+            merged['comments'].extend(comments)
+    return merged
+
+
+def write_danmaku(outputs: List[Tuple[str, TextIO]], info: Dict, comments: Iterable[Dict], video_info: Dict):
+    """
+    只遍历一次弹幕，同时写JSON和CSV，输出内容与 BilibiliScraper.save_data 相同
+
+    只依赖参数，可以放到进程池中执行
+
+    :param outputs: (格式, 文本文件) 的列表，格式为 'json' 或 'csv'，CSV文件需要以 newline='' 打开
+    """
+    json_file = csv_writer = None
+    build_row = csv_row_builder(video_info)
+    for kind, f in outputs:
+        if kind == 'json':
+            json_file = f
+        else:
+            csv_writer = csv.writer(f)
+            csv_writer.writerow(CSV_HEADER)
+
+    # JSON先写出 "comments": [ 之前的部分，缩进与 json.dump(indent=2) 一致
+    json_tail = ''
+    if json_file:
+        skeleton = json.dumps({
+            'video_info': video_info,
+            'danmaku_data': dict(info, comments=[])
+        }, ensure_ascii=False, indent=2)
+        json_head, json_tail = skeleton.rsplit('"comments": []', 1)
+        json_file.write(json_head + '"comments": [')
+
+    count = 0
+    for comment in comments:
+        if json_file:
+            # DanmakuBatch 的行视图不是dict，default=dict 让它按字典序列化
+            item = json.dumps(comment, ensure_ascii=False, indent=2, default=dict).replace('\n', '\n      ')
+            json_file.write((',\n      ' if count else '\n      ') + item)
+        if csv_writer:
+            csv_writer.writerow(build_row(comment))
+        count += 1
+
+    if json_file:
+        json_file.write(('\n    ]' if count else ']') + json_tail)
+
+
+def open_output(path: str, suffix: str = '') -> TextIO:
+    """以与 save_data 相同的方式打开JSON/CSV输出文件"""
+    return open(path, 'w', encoding='utf-8', newline='' if path.endswith('.csv' + suffix) else None)
+
+
+def write_danmaku_files(paths: List[str], info: Dict, comments: Iterable[Dict], video_info: Dict,
+                        suffix: str = ''):
+    """
+    按扩展名把弹幕写成JSON和CSV文件，见 write_danmaku
+
+    :param suffix: 路径在扩展名之后的后缀，例如临时文件的 .tmp
+    """
+    files = [open_output(path, suffix) for path in paths]
+    try:
+        write_danmaku([('csv' if path.endswith('.csv' + suffix) else 'json', f) for path, f in zip(paths, files)],
+                      info, comments, video_info)
+    finally:
+        for f in files:
+            f.close()
+
+
+def parse_and_serialize(pages: List[Dict], raws: List, xml_engine: str = 'etree', paths: Optional[List[str]] = None,
+                        video_info: Optional[Dict] = None) -> Union[Dict, Tuple[int, List[Union[str, bytes]]]]:
+    """
+    流水线解析阶段在进程池中执行的函数：解析各分P的弹幕
+
+    给出paths（JSON/CSV/Parquet格式的输出路径）时在子进程中把弹幕序列化成各文件的内容，
+    返回 (弹幕条数, 与paths一一对应的内容)，JSON/CSV为文本，Parquet为字节；
+    序列化不占用主进程的GIL，写文件留给写入阶段。否则返回解析结果，由主进程写入
+    """
+    data = parse_danmaku_parts(pages, raws, xml_engine)
+    if not paths:
+        return data
+    info = {key: value for key, value in data.items() if key != 'comments'}
+    if paths[0].endswith('.parquet'):
+        buffer = io.BytesIO()
+        write_parquet(buffer, data['comments'], DANMAKU_SCHEMA, video_info, {'danmaku_info': info})
+        return len(data['comments']), [buffer.getvalue()]
+    comments = data['comments']
+    if isinstance(comments, DanmakuBatch):
+        comments = comments.iter_dicts()
+    # 不做换行转换，写文件时再按 open_output 的方式转换，与直接写文件的结果相同
+    buffers = [io.StringIO(newline='') for _ in paths]
+    write_danmaku([('csv' if path.endswith('.csv') else 'json', buffer) for path, buffer in zip(paths, buffers)],
+                  info, comments, video_info)
+    return len(data['comments']), [buffer.getvalue() for buffer in buffers]
+
+
+def write_outputs(paths: List[str], contents: List[Union[str, bytes]]):
+    """把 parse_and_serialize 序列化好的内容写到各输出文件"""
+    for path, content in zip(paths, contents):
+        if isinstance(content, bytes):
+            with open(path, 'wb') as f:
+                f.write(content)
+        else:
+            with open_output(path) as f:
+                f.write(content)
+
 
 class BilibiliScraper:
-    def __init__(self, save_dir: str = 'bilibili_data'):
-        """初始化爬虫"""
+    def __init__(self, save_dir: str = 'bilibili_data', xml_engine: str = 'etree',
+                 danmaku_source: str = 'xml', segment_workers: int = 4, part_workers: int = 4,
+                 metrics_port: Optional[int] = None, archive_path: Optional[str] = None):
+        """
+        初始化爬虫
+
+        :param xml_engine: 弹幕XML解析方式，'etree' 为ElementTree（参考实现），'fast' 为直接扫描字节的快速解析，
+                           'batch' 在 'fast' 的基础上把弹幕存进紧凑的 DanmakuBatch，而不是每条一个字典
+        :param danmaku_source: 弹幕来源，'xml' 为 comment.bilibili.com 的XML（受maxlimit限制，长视频会被截断），
+                               'seg' 为按6分钟分段的protobuf接口，可以拿到完整弹幕
+        :param segment_workers: 分段模式下同时请求的分段数
+        :param part_workers: 多P视频同时下载弹幕的分P数
+        :param metrics_port: 在本机这个端口上提供Prometheus格式的指标（/metrics），None 为不启动
+        :param archive_path: 把视频信息和弹幕的原始响应压缩保存到这个存档（utils/raw_archive.py），
+                             修改解析后用 reprocess.py 离线重新处理；None 为不保存
+        """
         self.save_dir = save_dir
+        self.xml_engine = xml_engine
+        self.danmaku_source = danmaku_source
+        self.segment_workers = segment_workers
+        self.part_workers = part_workers
         if not os.path.exists(save_dir):
             os.makedirs(save_dir)
             
@@ -30,49 +347,84 @@ class BilibiliScraper:
         # API URLs
         self.video_info_url = "https://api.bilibili.com/x/web-interface/view"
         self.danmaku_url = "https://comment.bilibili.com/{}.xml"
+        self.danmaku_seg_url = "https://api.bilibili.com/x/v2/dm/web/seg.so"
         
-        # 请求头
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Referer': 'https://www.bilibili.com'
-        }
+        # 共享的连接池客户端，请求头和超时统一在 utils/http_client.py 中设置
+        self.http = get_client()
+        # 视频信息缓存，与评论爬虫等共用
+        self.view_cache = get_video_cache()
+        # 弹幕变化检测清单，重复爬取时跳过没有变化的视频
+        self.manifest = DanmakuManifest(os.path.join(save_dir, 'danmaku_manifest.sqlite3'))
+        if metrics_port:
+            start_metrics_server(metrics_port)
+        # 原始响应存档，与评论爬虫共用
+        self.archive: Optional[RawArchive] = get_archive(archive_path) if archive_path else None
+
+        # save_format='dataset' 时所有视频追加写入的Parquet数据集，用到时才创建
+        self._dataset = None
+        # save_format='sqlite' 写入的数据库，与评论爬虫共用
+        self.store_path = DEFAULT_STORE_PATH
+
+        # 异步模式下的解析/保存线程池
+        self._executor = None
+
+    def archive_response(self, endpoint: str, key: str, body: bytes):
+        """启用了原始响应存档时保存一次响应"""
+        if self.archive is not None:
+            self.archive.put(endpoint, key, body)
+
+    def fetch_view(self, bvid: str) -> Optional[Dict]:
+        """请求视频信息接口，返回完整的视频信息（不经过缓存）"""
+        params = {'bvid': bvid}
+        response = self.http.get(self.video_info_url, params=params, endpoint='view')
+        
+        if response.status_code == 200:
+            data = response.json()
+            if data['code'] == 0:  # 请求成功
+                self.archive_response('view', bvid, response.content)
+                return data['data']
+            else:
+                self.logger.error(f"获取视频信息失败: {bvid}, 错误码: {data['code']}")
+        else:
+            self.logger.error(f"获取视频信息失败: {bvid}, 状态码: {response.status_code}")
+        
+        return None
 
     def get_video_info(self, bvid: str) -> Optional[Dict]:
         """获取视频信息，包括cid和标题"""
         try:
-            params = {'bvid': bvid}
-            response = requests.get(
-                self.video_info_url, 
-                params=params, 
-                headers=self.headers
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data['code'] == 0:  # 请求成功
-                    return {
-                        'title': data['data']['title'],
-                        'cid': data['data']['cid'],
-                        'bvid': bvid
-                    }
-                else:
-                    self.logger.error(f"获取视频信息失败: {bvid}, 错误码: {data['code']}")
-            else:
-                self.logger.error(f"获取视频信息失败: {bvid}, 状态码: {response.status_code}")
+            data = self.view_cache.get_or_fetch(bvid, self.fetch_view, fields=('title', 'cid'))
+            if data:
+                return {
+                    'title': data['title'],
+                    'cid': data['cid'],
+                    'bvid': bvid
+                }
                 
         except Exception as e:
             self.logger.error(f"获取视频信息异常: {bvid}, 错误: {str(e)}")
         
         return None
 
+    def get_video_pages(self, bvid: str) -> Optional[List[Dict]]:
+        """获取视频的全部分P（cid、序号、标题、时长）"""
+        try:
+            data = self.view_cache.get_or_fetch(bvid, self.fetch_view, fields=('title', 'cid', 'pages'))
+            if data:
+                return video_pages(data)
+        except Exception as e:
+            self.logger.error(f"获取分P信息异常: {bvid}, 错误: {str(e)}")
+        return None
+
     def get_danmaku(self, cid: str) -> Optional[str]:
         """获取弹幕XML内容"""
         try:
             url = self.danmaku_url.format(cid)
-            response = requests.get(url, headers=self.headers)
+            response = self.http.get(url, endpoint='danmaku')
             response.encoding = 'utf-8'
             
             if response.status_code == 200:
+                self.archive_response('danmaku', cid, response.content)
                 return response.text
             else:
                 self.logger.error(f"获取弹幕失败: {cid}, 状态码: {response.status_code}")
@@ -82,43 +434,305 @@ class BilibiliScraper:
         
         return None
 
+    def get_danmaku_count(self, bvid: str) -> Optional[int]:
+        """视频信息中的弹幕总数(stat.danmaku)，用于变化检测"""
+        try:
+            data = self.view_cache.get_or_fetch(bvid, self.fetch_view, fields=('stat',))
+            if data:
+                return data['stat']['danmaku']
+        except Exception as e:
+            self.logger.error(f"获取弹幕数异常: {bvid}, 错误: {str(e)}")
+        return None
+
+    def get_video_duration(self, video_info: Dict) -> Optional[int]:
+        """cid对应分P的时长（秒），用于计算弹幕分段数"""
+        try:
+            data = self.view_cache.get_or_fetch(video_info['bvid'], self.fetch_view, fields=('pages', 'duration'))
+            if data:
+                for page in data.get('pages') or []:
+                    if str(page['cid']) == str(video_info['cid']):
+                        return page['duration']
+                return data['duration']
+        except Exception as e:
+            self.logger.error(f"获取视频时长异常: {video_info['bvid']}, 错误: {str(e)}")
+        return None
+
+    def segment_params(self, cid: str, index: int) -> Dict:
+        """分段弹幕接口的请求参数，index从1开始"""
+        return {'type': 1, 'oid': cid, 'segment_index': index}
+
+    def fetch_segment(self, cid: str, index: int) -> Optional[bytes]:
+        """获取一个分段的protobuf弹幕数据"""
+        response = self.http.get(self.danmaku_seg_url, params=self.segment_params(cid, index), endpoint='danmaku')
+        if response.status_code == 200:
+            self.archive_response('danmaku_seg', segment_key(cid, index), response.content)
+            return response.content
+        self.logger.error(f"获取弹幕分段失败: {cid} 第{index}段, 状态码: {response.status_code}")
+        return None
+
+    def get_danmaku_segments(self, cid: str, duration: int) -> Optional[List[bytes]]:
+        """并发获取一个cid的全部分段，任意一段失败都返回None，避免保存不完整的弹幕"""
+        try:
+            indexes = range(1, segment_count(duration) + 1)
+            with ThreadPoolExecutor(max_workers=self.segment_workers) as executor:
+                segments = list(executor.map(bind(lambda index: self.fetch_segment(cid, index)), indexes))
+            if all(segment is not None for segment in segments):
+                return segments
+
+        except Exception as e:
+            self.logger.error(f"获取弹幕分段异常: {cid}, 错误: {str(e)}")
+
+        return None
+
+    def merge_segments(self, cid: str, segments: List[bytes]) -> Dict:
+        """解码各分段并按dmid去重合并，返回与 parse_xml 相同结构的弹幕数据"""
+        with PARSE_SECONDS.time('danmaku'):
+            data = merge_danmaku_segments(cid, segments, self.xml_engine)
+        ITEMS.inc('danmaku', amount=len(data['comments']))
+        return data
+
+    def fetch_segments(self, video_info: Dict) -> Optional[Tuple]:
+        """下载一个cid的全部分段，分段接口没有ETag，只比较内容哈希；返回值见 fetch_if_changed"""
+        duration = self.get_video_duration(video_info)
+        if duration is None:
+            return None
+        segments = self.get_danmaku_segments(str(video_info['cid']), duration)
+        if segments is None:
+            return None
+        return 200, segments, content_hash(b''.join(segments)), {}
+
+    def fetch_part(self, page: Dict):
+        """下载一个分P的原始弹幕：XML模式为XML文本，分段模式为各分段数据，失败返回None"""
+        cid = str(page['cid'])
+        if self.danmaku_source == 'seg':
+            return self.get_danmaku_segments(cid, page['duration'])
+        return self.get_danmaku(cid)
+
+    @staticmethod
+    def part_digest(raws: List) -> str:
+        """多P视频所有分P原始弹幕的整体哈希"""
+        hasher = hashlib.sha1()
+        for raw in raws:
+            for chunk in (raw if isinstance(raw, list) else [raw.encode('utf-8')]):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def parse_parts(self, pages: List[Dict], raws: List) -> Optional[Dict]:
+        """解析各分P的弹幕并按分P顺序合并，头部字段取第1P"""
+        try:
+            with PARSE_SECONDS.time('danmaku'):
+                data = parse_danmaku_parts(pages, raws, self.xml_engine)
+        except Exception as e:
+            self.logger.error(f"解析XML失败: {str(e)}")
+            return None
+        ITEMS.inc('danmaku', amount=len(data['comments']))
+        return data
+
+    def fetch_parts(self, video_info: Dict, pages: List[Dict]) -> Optional[Tuple]:
+        """
+        并发下载所有分P的原始弹幕，返回值见 fetch_if_changed
+
+        多个分P不能共用一个ETag，所以不发条件请求，比较所有分P原始数据的整体哈希。
+        """
+        try:
+            with ThreadPoolExecutor(max_workers=self.part_workers) as executor:
+                raws = list(executor.map(bind(self.fetch_part), pages))
+        except Exception as e:
+            self.logger.error(f"获取分P弹幕异常: {video_info['bvid']}, 错误: {str(e)}")
+            return None
+        if any(raw is None for raw in raws):
+            self.logger.error(f"部分分P弹幕获取失败: {video_info['bvid']}")
+            return None
+        return 200, raws, self.part_digest(raws), {}
+
+    def output_paths(self, video_info: Dict, save_format: str = 'both') -> List[str]:
+        """某个视频对应的输出文件路径"""
+        base_path = os.path.join(self.save_dir, self.sanitize_filename(video_info['title']))
+        paths = []
+        if save_format in ['json', 'both']:
+            paths.append(f'{base_path}.json')
+        if save_format in ['csv', 'both']:
+            paths.append(f'{base_path}.csv')
+        if save_format == 'parquet':
+            paths.append(f'{base_path}.parquet')
+        # 'dataset' 和 'sqlite' 写入共享的数据集/数据库，没有单独的输出文件
+        return paths
+
+    @property
+    def store(self) -> SQLiteStore:
+        """save_format='sqlite' 使用的数据库"""
+        return get_store(self.store_path)
+
+    @property
+    def dataset(self) -> ParquetDataset:
+        """save_format='dataset' 使用的分区数据集，位于保存目录下的 danmaku_dataset"""
+        if self._dataset is None:
+            self._dataset = ParquetDataset(os.path.join(self.save_dir, 'danmaku_dataset'), DANMAKU_SCHEMA)
+        return self._dataset
+
+    def close_dataset(self):
+        """写出数据集中还没落盘的行"""
+        if self._dataset is not None:
+            self._dataset.close()
+            self._dataset = None
+
+    def _manifest_entry(self, video_info: Dict, save_format: str, parts: int) -> Optional[Dict]:
+        """
+        读取变化检测记录，强制重新下载时视为没有记录：输出文件缺失，
+        或者上次的弹幕来源、分P数与这次不同（例如上次用会截断的XML，这次用分段）
+        """
+        if not all(os.path.exists(path) for path in self.output_paths(video_info, save_format)):
+            return None
+        entry = self.manifest.get(str(video_info['cid']))
+        if entry and (entry['source'], entry['parts']) != (self.danmaku_source, parts):
+            return None
+        return entry
+
+    def _compare_manifest(self, video_info: Dict, entry: Optional[Dict], status: int, digest: Optional[str],
+                          headers, danmaku_count: Optional[int], parts: int) -> Tuple[bool, Dict]:
+        """根据弹幕接口的响应判断内容是否变化，返回 (是否变化, 清单新记录)"""
+        if status == 304:
+            self.manifest.record('not_modified')
+            return False, dict(entry, danmaku_count=danmaku_count)
+
+        record = {
+            'cid': str(video_info['cid']),
+            'bvid': video_info['bvid'],
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'content_hash': digest,
+            'danmaku_count': danmaku_count,
+            'source': self.danmaku_source,
+            'parts': parts,
+        }
+        if entry and entry['content_hash'] == record['content_hash']:
+            self.manifest.record('hash_unchanged')
+            return False, record
+
+        self.manifest.record('changed')
+        return True, record
+
+    def _count_unchanged(self, entry: Optional[Dict], danmaku_count: Optional[int]) -> bool:
+        """视频信息中的弹幕数与清单记录相同，不用下载弹幕"""
+        if entry and danmaku_count is not None and entry['danmaku_count'] == danmaku_count:
+            self.manifest.record('count_unchanged')
+            return True
+        return False
+
+    def _resolve_change(self, video_info: Dict, entry: Optional[Dict], danmaku_count: Optional[int],
+                        fetched: Optional[Tuple], parts: int) -> Tuple[Optional[object], Optional[Dict]]:
+        """比较下载结果与清单记录，没有变化时直接更新清单；fetched 的含义见 fetch_if_changed"""
+        if fetched is None:
+            return None, None
+        status, content, digest, headers = fetched
+        changed, record = self._compare_manifest(video_info, entry, status, digest, headers, danmaku_count, parts)
+        if not changed:
+            self.manifest.update(**record)
+            return None, record
+        return content, record
+
+    def fetch_if_changed(self, video_info: Dict, save_format: str, fetch: Callable[[Optional[Dict]], Optional[Tuple]],
+                         parts: int = 1) -> Tuple[Optional[object], Optional[Dict]]:
+        """
+        按变化检测清单获取弹幕：弹幕数没变直接跳过，否则调用fetch下载并比较内容哈希
+
+        XML、分段、多P和流式下载都走这一流程，只是下载方式不同。
+
+        :param fetch: fetch(清单旧记录) 下载弹幕，返回 (状态码, 弹幕内容, 内容哈希, 响应头)，失败返回None；
+                      旧记录用于发条件请求，状态码为304时内容和哈希为None
+        :param parts: 分P数，与弹幕来源一起记在清单中
+        :return: (弹幕内容, 清单新记录)，弹幕没有变化时内容为None，下载失败时两者都为None
+        """
+        entry = self._manifest_entry(video_info, save_format, parts)
+        danmaku_count = self.get_danmaku_count(video_info['bvid'])
+        if self._count_unchanged(entry, danmaku_count):
+            return None, entry
+        return self._resolve_change(video_info, entry, danmaku_count, fetch(entry), parts)
+
+    def fetch_xml(self, cid: str, entry: Optional[Dict]) -> Optional[Tuple]:
+        """带条件请求头下载一个cid的XML弹幕，返回值见 fetch_if_changed"""
+        try:
+            response = self.http.get(
+                self.danmaku_url.format(cid),
+                headers=self.manifest.conditional_headers(entry),
+                endpoint='danmaku'
+            )
+            if response.status_code == 304:
+                return 304, None, None, response.headers
+            if response.status_code == 200:
+                self.archive_response('danmaku', cid, response.content)
+                return 200, response.content.decode('utf-8'), content_hash(response.content), response.headers
+            self.logger.error(f"获取弹幕失败: {cid}, 状态码: {response.status_code}")
+
+        except Exception as e:
+            self.logger.error(f"获取弹幕异常: {cid}, 错误: {str(e)}")
+
+        return None
+
+    def get_raw_danmaku_if_changed(self, video_info: Dict, pages: List[Dict],
+                                   save_format: str = 'both') -> Tuple[Optional[List], Optional[Dict]]:
+        """
+        按变化检测清单下载视频所有分P的原始弹幕，不解析
+
+        多P视频所有分P并发下载，合并成一份输出，清单以第1P的cid为键记录整个视频；
+        单P视频按弹幕来源下载XML（发条件请求）或各分段。
+
+        :return: (各分P原始弹幕, 清单新记录)，原始弹幕的含义同 fetch_part；
+                 弹幕没有变化时原始弹幕为None，下载失败时两者都为None
+        """
+        if len(pages) > 1:
+            self.logger.info(f"多P视频，共{len(pages)}P: {video_info['title']} ({video_info['bvid']})")
+            return self.fetch_if_changed(video_info, save_format, lambda entry: self.fetch_parts(video_info, pages),
+                                         parts=len(pages))
+        if self.danmaku_source == 'seg':
+            content, record = self.fetch_if_changed(video_info, save_format,
+                                                    lambda entry: self.fetch_segments(video_info))
+        else:
+            content, record = self.fetch_if_changed(video_info, save_format,
+                                                    lambda entry: self.fetch_xml(str(video_info['cid']), entry))
+        return (None if content is None else [content]), record
+
     def parse_xml(self, xml_content: str) -> Dict:
         """解析XML格式的弹幕内容"""
         try:
-            root = ET.fromstring(xml_content)
-            
-            info = {
-                'chatserver': root.find('chatserver').text if root.find('chatserver') is not None else '',
-                'chatid': root.find('chatid').text if root.find('chatid') is not None else '',
-                'mission': root.find('mission').text if root.find('mission') is not None else '',
-                'maxlimit': root.find('maxlimit').text if root.find('maxlimit') is not None else '',
-                'state': root.find('state').text if root.find('state') is not None else '',
-                'real_name': root.find('real_name').text if root.find('real_name') is not None else '',
-                'source': root.find('source').text if root.find('source') is not None else '',
-                'comments': []
-            }
-            
-            for d in root.findall('d'):
-                p = d.get('p', '').split(',')
-                if len(p) >= 8:
-                    comment = {
-                        'time': float(p[0]),
-                        'type': int(p[1]),
-                        'size': int(p[2]),
-                        'color': int(p[3]),
-                        'timestamp': int(p[4]),
-                        'pool': int(p[5]),
-                        'user_hash': p[6],
-                        'dmid': p[7],
-                        'content': d.text
-                    }
-                    info['comments'].append(comment)
-            
-            return info
-            
+            with PARSE_SECONDS.time('danmaku'):
+                data = parse_danmaku_xml(xml_content, self.xml_engine)
         except Exception as e:
             self.logger.error(f"解析XML失败: {str(e)}")
             return None
+        ITEMS.inc('danmaku', amount=len(data['comments']))
+        return data
+
+    def parse_xml_stream(self, chunks: Iterable[bytes]) -> Tuple[Dict, Iterator[Dict]]:
+        """
+        流式解析XML格式的弹幕内容
+
+        :param chunks: XML字节块，例如 response.iter_content()
+        :return: (头部字段, 弹幕生成器)，弹幕边读边解析，不会一次性全部放进内存
+        """
+        elements = iter_xml_elements(chunks)
+        info = {field: '' for field in HEADER_FIELDS}
+
+        # 头部字段都在<d>之前，先读到第一条弹幕为止
+        first = None
+        for elem in elements:
+            if elem.tag == 'd':
+                first = elem
+                break
+            if elem.tag in info:
+                info[elem.tag] = elem.text
+
+        def comments():
+            elem = first
+            while elem is not None:
+                if elem.tag == 'd':
+                    comment = element_to_comment(elem)
+                    if comment:
+                        ITEMS.inc('danmaku')
+                        yield comment
+                elem = next(elements, None)
+
+        return info, comments()
 
     def sanitize_filename(self, filename: str) -> str:
         """清理文件名，移除非法字符"""
@@ -130,11 +744,42 @@ class BilibiliScraper:
             filename = filename[:197] + '...'
         return filename
 
-    def save_data(self, data: Dict, video_info: Dict, save_format: str = 'both'):
-        """保存弹幕数据"""
+    def save_data(self, data: Dict, video_info: Dict, save_format: str = 'both') -> bool:
+        """
+        保存弹幕数据
+
+        :param save_format: 'json'、'csv'、'both'，'parquet' 为每个视频一个列式文件，
+                            'dataset' 为追加写入保存目录下的 danmaku_dataset 分区数据集，
+                            'sqlite' 为写入 store_path 数据库，按dmid去重
+        :return: 是否保存成功，失败的原因写入日志
+        """
+        start = time.perf_counter()
         try:
             # 使用视频标题作为文件名
             base_filename = self.sanitize_filename(video_info['title'])
+            info = {key: value for key, value in data.items() if key != 'comments'}
+
+            if save_format == 'parquet':
+                parquet_path = os.path.join(self.save_dir, f'{base_filename}.parquet')
+                write_parquet(parquet_path, data['comments'], DANMAKU_SCHEMA, video_info, {'danmaku_info': info})
+                self.logger.info(f"已保存Parquet文件: {parquet_path}")
+
+            if save_format == 'dataset':
+                rows = self.dataset.append(data['comments'], video_info, {'danmaku_info': info})
+                self.logger.info(f"已追加到数据集: {video_info['title']} ({rows}条)")
+
+            # 批次逐块还原成字典写出，不展开成整份字典列表；输出与下面的写法相同
+            batch = isinstance(data['comments'], DanmakuBatch)
+
+            if save_format == 'sqlite':
+                comments = data['comments'].iter_dicts() if batch else data['comments']
+                added = self.store.save_danmaku(video_info, comments, info)
+                self.logger.info(f"已写入数据库: {video_info['title']} (新增{added}条)")
+
+            if batch and save_format in ['json', 'csv', 'both']:
+                for path in self.save_data_stream(info, data['comments'].iter_dicts(), video_info, save_format):
+                    self.logger.info(f"已保存文件: {path}")
+                return True
             
             if save_format in ['json', 'both']:
                 # 保存JSON格式
@@ -151,28 +796,133 @@ class BilibiliScraper:
                 csv_path = os.path.join(self.save_dir, f'{base_filename}.csv')
                 with open(csv_path, 'w', encoding='utf-8', newline='') as f:
                     writer = csv.writer(f)
-                    writer.writerow([
-                        '视频标题', '视频BV号', '弹幕出现时间', '类型', '字体大小', 
-                        '颜色', '发送时间', '弹幕池', '用户哈希', '弹幕ID', '弹幕内容'
-                    ])
-                    for comment in data['comments']:
-                        writer.writerow([
-                            video_info['title'],
-                            video_info['bvid'],
-                            comment['time'],
-                            comment['type'],
-                            comment['size'],
-                            comment['color'],
-                            datetime.fromtimestamp(comment['timestamp']).strftime('%Y-%m-%d %H:%M:%S'),
-                            comment['pool'],
-                            comment['user_hash'],
-                            comment['dmid'],
-                            comment['content']
-                        ])
+                    writer.writerow(CSV_HEADER)
+                    writer.writerows(map(csv_row_builder(video_info), data['comments']))
                 self.logger.info(f"已保存CSV文件: {csv_path}")
+            return True
                 
         except Exception as e:
             self.logger.error(f"保存数据失败: {str(e)}")
+            return False
+        finally:
+            WRITE_SECONDS.observe(time.perf_counter() - start, 'danmaku', save_format)
+
+    def save_data_stream(self, info: Dict, comments: Iterable[Dict], video_info: Dict,
+                         save_format: str = 'both', suffix: str = '') -> List[str]:
+        """
+        流式保存弹幕数据，只遍历一次弹幕，同时写JSON和CSV，输出内容与 save_data 相同；Parquet按row group分批写入
+
+        :param suffix: 输出文件名后缀，用于先写临时文件
+        :return: 写入的文件路径
+        """
+        paths = [path + suffix for path in self.output_paths(video_info, save_format)]
+        if save_format == 'parquet':
+            write_parquet(paths[0], comments, DANMAKU_SCHEMA, video_info, {'danmaku_info': info})
+            return paths
+        if save_format == 'sqlite':
+            self.store.save_danmaku(video_info, comments, info)
+            return paths
+
+        write_danmaku_files(paths, info, comments, video_info, suffix)
+        return paths
+
+    def stream_to_tmp(self, video_info: Dict, page: Dict, entry: Optional[Dict],
+                      save_format: str = 'both') -> Optional[Tuple]:
+        """
+        带条件请求头流式下载XML弹幕，边下载边解析，写到输出路径加 .tmp 的临时文件
+
+        :return: 返回值见 fetch_if_changed，弹幕内容为写入的临时文件路径
+        """
+        cid = str(video_info['cid'])
+        response = self.http.get(
+            self.danmaku_url.format(cid),
+            headers=self.manifest.conditional_headers(entry),
+            endpoint='danmaku',
+            stream=True
+        )
+        with response:
+            if response.status_code == 304:
+                return 304, None, None, response.headers
+            if response.status_code != 200:
+                self.logger.error(f"获取弹幕失败: {cid}, 状态码: {response.status_code}")
+                return None
+
+            hasher = hashlib.sha1()
+            # 存档也边下载边压缩，不把整个XML留在内存里
+            writer = self.archive.writer('danmaku', cid) if self.archive is not None else None
+
+            def chunks():
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    hasher.update(chunk)
+                    if writer:
+                        writer.write(chunk)
+                    yield chunk
+
+            info, comments = self.parse_xml_stream(chunks())
+            tmp_paths = self.save_data_stream(info, tag_part(comments, page), video_info, save_format, suffix='.tmp')
+            if writer:
+                writer.commit()
+        return 200, tmp_paths, hasher.hexdigest(), response.headers
+
+    def process_video_stream(self, bvid: str, save_format: str = 'both') -> bool:
+        """
+        流式处理单个视频：边下载边解析边写入，内存占用与弹幕数量无关
+
+        输出先写到临时文件，内容哈希与上次相同时丢弃，不动原来的输出文件。
+        多P视频每P的弹幕都受maxlimit限制，交给 process_video 并发下载；
+        追加写入的数据集不能先写临时文件，也交给 process_video。
+        """
+        video_info = self.get_video_info(bvid)
+        if not video_info:
+            return False
+        pages = self.get_video_pages(bvid)
+        if not pages:
+            return False
+        if len(pages) > 1 or save_format == 'dataset':
+            return self.process_video(bvid, save_format)
+
+        self.logger.info(f"开始处理视频: {bvid}")
+
+        tmp_paths = [path + '.tmp' for path in self.output_paths(video_info, save_format)]
+        try:
+            written, record = self.fetch_if_changed(
+                video_info, save_format, lambda entry: self.stream_to_tmp(video_info, pages[0], entry, save_format)
+            )
+            if written is not None:
+                for tmp_path in written:
+                    os.replace(tmp_path, tmp_path[:-len('.tmp')])
+                    self.logger.info(f"已保存文件: {tmp_path[:-len('.tmp')]}")
+                self.manifest.update(**record)
+        except Exception as e:
+            self.logger.error(f"流式处理失败: {bvid}, 错误: {str(e)}")
+            return False
+        finally:
+            # 没有变化或者失败时丢弃临时文件
+            for tmp_path in tmp_paths:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        if not record:
+            return False
+        if written is None:
+            self.logger.info(f"弹幕无变化，跳过: {video_info['title']} ({bvid})")
+            return True
+        self.logger.info(f"视频处理完成: {video_info['title']} ({bvid})")
+        return True
+
+    def parse_and_save(self, video_info: Dict, pages: List[Dict], raws: List, record: Dict,
+                       save_format: str = 'both') -> bool:
+        """解析各分P的原始弹幕并保存，保存成功后才更新变化检测清单"""
+        danmaku_data = self.parse_parts(pages, raws)
+        if not danmaku_data:
+            return False
+
+        if not self.save_data(danmaku_data, video_info, save_format):
+            return False
+        self.manifest.update(**record)
+
+        self.logger.info(f"视频处理完成: {video_info['title']} ({video_info['bvid']})")
+        return True
 
     def process_video(self, bvid: str, save_format: str = 'both') -> bool:
         """处理单个视频"""
@@ -183,44 +933,534 @@ class BilibiliScraper:
         if not video_info:
             return False
             
-        # 获取弹幕
-        xml_content = self.get_danmaku(str(video_info['cid']))
-        if not xml_content:
+        pages = self.get_video_pages(bvid)
+        if not pages:
             return False
-            
-        # 解析弹幕
-        danmaku_data = self.parse_xml(xml_content)
-        if not danmaku_data:
+
+        # 获取弹幕，没有变化时不重新下载也不重写输出文件
+        raws, record = self.get_raw_danmaku_if_changed(video_info, pages, save_format)
+        if not record:
             return False
-            
-        # 保存数据
-        self.save_data(danmaku_data, video_info, save_format)
-        
-        self.logger.info(f"视频处理完成: {video_info['title']} ({bvid})")
-        return True
+        if raws is None:
+            self.logger.info(f"弹幕无变化，跳过: {video_info['title']} ({bvid})")
+            return True
+
+        # 解析并保存弹幕
+        return self.parse_and_save(video_info, pages, raws, record, save_format)
+
+    def fetch_raw(self, bvid: str, save_format: str = 'both') -> Optional[Dict]:
+        """
+        流水线的下载阶段：获取视频信息和各分P的原始弹幕，不解析
+
+        :return: {'video_info', 'pages', 'raws', 'record'}，弹幕没有变化时raws为None；失败返回None
+        """
+        self.logger.info(f"开始处理视频: {bvid}")
+        video_info = self.get_video_info(bvid)
+        if not video_info:
+            return None
+        pages = self.get_video_pages(bvid)
+        if not pages:
+            return None
+
+        raws, record = self.get_raw_danmaku_if_changed(video_info, pages, save_format)
+        if not record:
+            return None
+        return {'video_info': video_info, 'pages': pages, 'raws': raws, 'record': record}
 
-    def process_from_file(self, input_file: str, save_format: str = 'both'):
-        """从文件读取BV号并处理"""
+    def process_pipeline(self, bv_list: List[str], save_format: str = 'both', fetch_workers: int = 4,
+                         parse_workers: Optional[int] = None, queue_size: int = 8, write_batch: int = 8,
+                         journal: Optional[CrawlJournal] = None, report_interval: float = 10) -> int:
+        """
+        按流水线批量处理：下载（线程）-> 解析（进程池）-> 写入（单线程，按批取）
+
+        各阶段之间是容量为queue_size的有界队列，解析或写入跟不上时下载自动停下来等待，
+        内存中最多只有几个队列容量的视频。各阶段的队列深度每report_interval秒写一次日志，
+        结束时输出每个阶段的忙碌时间和等待下游的时间，用来判断瓶颈在哪一段。
+
+        :param parse_workers: 解析进程数，默认为CPU核数
+        :param journal: 断点日志，每个视频的结果写入其中
+        :return: 成功处理的视频数
+        """
+        parse_workers = parse_workers or os.cpu_count() or 1
+        success = 0
+        lock = threading.Lock()
+        errors = ErrorCapture()
+
+        def finish(bvid: str, ok: bool, reason: Optional[str] = None, throttled: bool = False):
+            nonlocal success
+            with lock:
+                success += ok
+            if journal:
+                journal.record(bvid, ok, reason, throttled, defer_done=save_format == 'dataset')
+
+        def fetch(bvid: str) -> Optional[Dict]:
+            with task_scope() as task:
+                try:
+                    job = self.fetch_raw(bvid, save_format)
+                except Exception as e:
+                    self.logger.error(f"下载失败: {bvid}, 错误: {str(e)}")
+                    job = None
+            if job is None:
+                finish(bvid, False, task.error or '未获取到数据', task.throttled > 0)
+                return None
+            if job['raws'] is None:
+                self.logger.info(f"弹幕无变化，跳过: {job['video_info']['title']} ({bvid})")
+                finish(bvid, True)
+                return None
+            return job
+
+        def parse(job: Dict) -> Optional[Dict]:
+            video_info = job['video_info']
+            paths = self.output_paths(video_info, save_format) if save_format in FILE_FORMATS else None
+            start = time.perf_counter()
+            try:
+                result = pool.submit(parse_and_serialize, job['pages'], job.pop('raws'), self.xml_engine,
+                                     paths, video_info).result()
+            except Exception as e:
+                self.logger.error(f"解析XML失败: {video_info['bvid']}, 错误: {str(e)}")
+                finish(video_info['bvid'], False, f"解析XML失败: {str(e)}")
+                return None
+            # 单独写文件的格式耗时包括序列化，写文件的耗时计入写入阶段
+            PARSE_SECONDS.observe(time.perf_counter() - start, 'danmaku')
+            if paths:
+                count, job['contents'] = result
+                job['paths'], job['data'] = paths, None
+            else:
+                count, job['data'] = len(result['comments']), result
+            ITEMS.inc('danmaku', amount=count)
+            return job
+
+        def write(jobs: List[Dict]) -> None:
+            for job in jobs:
+                video_info = job['video_info']
+                if job['data'] is not None:
+                    if not self.save_data(job['data'], video_info, save_format):
+                        finish(video_info['bvid'], False, '保存数据失败')
+                        continue
+                else:
+                    start = time.perf_counter()
+                    try:
+                        write_outputs(job['paths'], job.pop('contents'))
+                    except Exception as e:
+                        self.logger.error(f"保存数据失败: {str(e)}")
+                        finish(video_info['bvid'], False, f"保存数据失败: {str(e)}")
+                        continue
+                    finally:
+                        WRITE_SECONDS.observe(time.perf_counter() - start, 'danmaku', save_format)
+                    for path in job['paths']:
+                        self.logger.info(f"已保存文件: {path}")
+                self.manifest.update(**job['record'])
+                self.logger.info(f"视频处理完成: {video_info['title']} ({video_info['bvid']})")
+                finish(video_info['bvid'], True)
+                job['finished'] = True
+
+        def failed(items: List, e: Exception):
+            # 阶段处理函数抛出异常时，这一批中还没记录结果的视频记为失败，下一轮会重新处理
+            for item in items:
+                if isinstance(item, str):
+                    finish(item, False, f"下载失败: {str(e)}")
+                elif not item.get('finished'):
+                    finish(item['video_info']['bvid'], False, f"处理失败: {str(e)}")
+
+        logging.getLogger().addHandler(errors)
+        try:
+            with ProcessPoolExecutor(max_workers=parse_workers) as pool:
+                # 先把进程都启动起来，避免在下载线程运行时才fork
+                pool.submit(int).result()
+                pipeline = Pipeline([
+                    Stage('fetch', fetch, workers=fetch_workers, queue_size=queue_size, on_error=failed),
+                    Stage('parse', parse, workers=parse_workers, queue_size=queue_size, on_error=failed),
+                    Stage('write', write, workers=1, queue_size=queue_size, batch_size=write_batch,
+                          on_error=failed),
+                ], report_interval=report_interval, logger=self.logger)
+                pipeline.run(bv_list)
+        finally:
+            logging.getLogger().removeHandler(errors)
+        self.logger.info(f"流水线各阶段: {pipeline.stats()}")
+        return success
+
+    def open_journal(self, input_file: str, bv_list: List[str], resume: bool, retry_failed: bool) -> CrawlJournal:
+        """打开输入文件对应的断点日志，开始新的一轮"""
+        journal = CrawlJournal(journal_path(self.save_dir, input_file))
+        journal.begin(len(bv_list), resume=resume, retry_failed=retry_failed)
+        return journal
+
+    def log_journal(self, journal: CrawlJournal, bv_list: List[str]):
+        """记录整份输入的成功/失败统计，失败的视频逐个列出原因"""
+        summary = journal.summary(bv_list)
+        failures = summary.pop('failures')
+        self.logger.info(f"断点日志统计: {summary} ({journal.path})")
+        for bvid, reason in failures.items():
+            self.logger.info(f"失败: {bvid} - {reason}")
+
+    def process_from_file(self, input_file: str, save_format: str = 'both', stream: bool = False,
+                          resume: bool = True, retry_failed: bool = False, pipeline: bool = False):
+        """
+        从文件读取BV号并处理
+
+        处理结果逐个写入保存目录下的断点日志（journal/输入文件名.jsonl），中途被杀掉后重新运行只处理剩下的视频。
+
+        :param stream: 使用流式解析和写入，适合弹幕特别多的长视频（分段模式下每段本来就很小，忽略此参数）
+        :param resume: 接着上一轮没跑完的断点日志继续；为False或上一轮已经跑完时从头开始
+        :param retry_failed: 只重新处理断点日志中失败的视频
+        :param pipeline: 下载、解析、写入分成三个阶段同时进行，解析放到进程池中（见 process_pipeline）
+        """
+        # 结束时的指标汇总只统计这一轮
+        start_run()
+        journal = None
         try:
             with open(input_file, 'r', encoding='utf-8') as f:
                 bv_list = [line.strip() for line in f if line.strip()]
-            
-            total = len(bv_list)
+
+            journal = self.open_journal(input_file, bv_list, resume, retry_failed)
+            todo = journal.pending(bv_list, retry_failed)
+            total = len(todo)
             success = 0
+            self.logger.info(f"共{len(bv_list)}个BV号，本轮需要处理{total}个")
             
-            for i, bvid in enumerate(bv_list, 1):
-                self.logger.info(f"处理进度: {i}/{total} - {bvid}")
-                
-                if self.process_video(bvid, save_format):
-                    success += 1
-                    
-                # 添加延时，避免请求过快
-                time.sleep(1)
+            if pipeline:
+                success = self.process_pipeline(todo, save_format, journal=journal)
+            else:
+                process = self.process_video_stream if stream and self.danmaku_source != 'seg' else self.process_video
+                for i, bvid in enumerate(todo, 1):
+                    self.logger.info(f"处理进度: {i}/{total} - {bvid}")
+
+                    # 请求速率由各接口族的自适应限速器控制，不再固定sleep
+                    # 数据集在关闭时才真正写完，成功记录也推迟到那时
+                    if journal.track(bvid, lambda: process(bvid, save_format), defer_done=save_format == 'dataset'):
+                        success += 1
+            self.close_dataset()
+            journal.finish()
             
             self.logger.info(f"处理完成，成功: {success}/{total}")
+            self.log_journal(journal, bv_list)
+            self.logger.info(f"连接复用统计: {self.http.connection_stats()}")
+            self.logger.info(f"限速状态: {limiter_stats()}")
+            self.logger.info(f"指标汇总: {write_summary(self.save_dir)}")
+            self.logger.info(f"视频信息缓存: {self.view_cache.stats()}")
+            self.logger.info(f"弹幕变化检测: {self.manifest.stats()}")
+            if save_format == 'sqlite':
+                self.logger.info(f"数据库: {self.store.stats()}")
             
         except Exception as e:
             self.logger.error(f"处理文件失败: {str(e)}")
+        finally:
+            if journal:
+                journal.close()
+
+    def process_from_queue(self, queue_path: str = DEFAULT_QUEUE_PATH, save_format: str = 'both',
+                           input_file: Optional[str] = None, stream: bool = False, worker_id: Optional[str] = None,
+                           lease_seconds: float = 300, max_attempts: int = 3) -> int:
+        """
+        作为worker从共享的爬取队列领取BV号并处理，可以在多个进程/多台机器上同时运行
+
+        每个BV号同一时间只租给一个worker，worker挂掉后租约过期，别的worker会接着处理。
+        队列为空且没有别的worker在处理时返回。
+
+        :param queue_path: 队列数据库路径，多台机器共用时放在共享盘上
+        :param input_file: 先把这个文件里的BV号加入队列（已经在队列里的跳过）
+        :return: 本worker成功处理的视频数
+        """
+        start_run()
+        queue = WorkQueue(queue_path, 'danmaku', lease_seconds=lease_seconds, max_attempts=max_attempts)
+        try:
+            if input_file:
+                self.logger.info(f"加入队列: {queue.enqueue_file(input_file)}个BV号")
+            process = self.process_video_stream if stream and self.danmaku_source != 'seg' else self.process_video
+            # 数据集在关闭时才真正写完，之前一直持有租约
+            success = run_worker(queue, lambda bvid: process(bvid, save_format), worker_id, logger=self.logger,
+                                 flush=self.close_dataset, defer_done=save_format == 'dataset')
+            self.logger.info(f"限速状态: {limiter_stats()}")
+            self.logger.info(f"指标汇总: {write_summary(self.save_dir)}")
+            return success
+        finally:
+            queue.close()
+
+    async def fetch_view_async(self, session: aiohttp.ClientSession, bvid: str) -> Optional[Dict]:
+        """请求视频信息接口（异步版本，不经过缓存）"""
+        status, body, _ = await self.http.get_async(
+            session, self.video_info_url, params={'bvid': bvid}, endpoint='view'
+        )
+        if status == 200:
+            data = json.loads(body)
+            if data['code'] == 0:
+                self.archive_response('view', bvid, body)
+                return data['data']
+            else:
+                self.logger.error(f"获取视频信息失败: {bvid}, 错误码: {data['code']}")
+        else:
+            self.logger.error(f"获取视频信息失败: {bvid}, 状态码: {status}")
+
+        return None
+
+    async def get_video_info_async(self, session: aiohttp.ClientSession, bvid: str) -> Optional[Dict]:
+        """获取视频信息（异步版本）"""
+        try:
+            data = await self.view_cache.get_or_fetch_async(
+                bvid, lambda b: self.fetch_view_async(session, b), fields=('title', 'cid')
+            )
+            if data:
+                return {
+                    'title': data['title'],
+                    'cid': data['cid'],
+                    'bvid': bvid
+                }
+
+        except Exception as e:
+            self.logger.error(f"获取视频信息异常: {bvid}, 错误: {str(e)}")
+
+        return None
+
+    async def get_danmaku_async(self, session: aiohttp.ClientSession, cid: str) -> Optional[str]:
+        """获取弹幕XML内容（异步版本）"""
+        try:
+            status, body, _ = await self.http.get_async(session, self.danmaku_url.format(cid), endpoint='danmaku')
+            if status == 200:
+                self.archive_response('danmaku', cid, body)
+                return body.decode('utf-8')
+            else:
+                self.logger.error(f"获取弹幕失败: {cid}, 状态码: {status}")
+
+        except Exception as e:
+            self.logger.error(f"获取弹幕异常: {cid}, 错误: {str(e)}")
+
+        return None
+
+    async def get_video_pages_async(self, session: aiohttp.ClientSession, bvid: str) -> Optional[List[Dict]]:
+        """获取视频的全部分P（异步版本）"""
+        try:
+            data = await self.view_cache.get_or_fetch_async(
+                bvid, lambda b: self.fetch_view_async(session, b), fields=('title', 'cid', 'pages')
+            )
+            if data:
+                return video_pages(data)
+        except Exception as e:
+            self.logger.error(f"获取分P信息异常: {bvid}, 错误: {str(e)}")
+        return None
+
+    async def get_danmaku_count_async(self, session: aiohttp.ClientSession, bvid: str) -> Optional[int]:
+        """视频信息中的弹幕总数（异步版本）"""
+        try:
+            data = await self.view_cache.get_or_fetch_async(
+                bvid, lambda b: self.fetch_view_async(session, b), fields=('stat',)
+            )
+            if data:
+                return data['stat']['danmaku']
+        except Exception as e:
+            self.logger.error(f"获取弹幕数异常: {bvid}, 错误: {str(e)}")
+        return None
+
+    async def fetch_if_changed_async(self, session: aiohttp.ClientSession, video_info: Dict, save_format: str,
+                                     fetch: Callable[[Optional[Dict]], Awaitable[Optional[Tuple]]],
+                                     parts: int = 1) -> Tuple[Optional[object], Optional[Dict]]:
+        """按变化检测清单获取弹幕（异步版本），fetch 为协程函数，参数和返回值同 fetch_if_changed"""
+        entry = self._manifest_entry(video_info, save_format, parts)
+        danmaku_count = await self.get_danmaku_count_async(session, video_info['bvid'])
+        if self._count_unchanged(entry, danmaku_count):
+            return None, entry
+        return self._resolve_change(video_info, entry, danmaku_count, await fetch(entry), parts)
+
+    async def fetch_xml_async(self, session: aiohttp.ClientSession, cid: str,
+                              entry: Optional[Dict]) -> Optional[Tuple]:
+        """带条件请求头下载一个cid的XML弹幕（异步版本），返回值见 fetch_if_changed"""
+        try:
+            status, body, headers = await self.http.get_async(
+                session, self.danmaku_url.format(cid),
+                headers=self.manifest.conditional_headers(entry), endpoint='danmaku'
+            )
+            if status == 304:
+                return 304, None, None, headers
+            if status == 200:
+                self.archive_response('danmaku', cid, body)
+                return 200, body.decode('utf-8'), content_hash(body), headers
+            self.logger.error(f"获取弹幕失败: {cid}, 状态码: {status}")
+
+        except Exception as e:
+            self.logger.error(f"获取弹幕异常: {cid}, 错误: {str(e)}")
+
+        return None
+
+    async def get_video_duration_async(self, session: aiohttp.ClientSession, video_info: Dict) -> Optional[int]:
+        """cid对应分P的时长（异步版本）"""
+        try:
+            data = await self.view_cache.get_or_fetch_async(
+                video_info['bvid'], lambda b: self.fetch_view_async(session, b), fields=('pages', 'duration')
+            )
+            if data:
+                for page in data.get('pages') or []:
+                    if str(page['cid']) == str(video_info['cid']):
+                        return page['duration']
+                return data['duration']
+        except Exception as e:
+            self.logger.error(f"获取视频时长异常: {video_info['bvid']}, 错误: {str(e)}")
+        return None
+
+    async def fetch_segment_async(self, session: aiohttp.ClientSession, cid: str, index: int) -> Optional[bytes]:
+        """获取一个分段的protobuf弹幕数据（异步版本）"""
+        status, body, _ = await self.http.get_async(
+            session, self.danmaku_seg_url, params=self.segment_params(cid, index), endpoint='danmaku'
+        )
+        if status == 200:
+            self.archive_response('danmaku_seg', segment_key(cid, index), body)
+            return body
+        self.logger.error(f"获取弹幕分段失败: {cid} 第{index}段, 状态码: {status}")
+        return None
+
+    async def get_danmaku_segments_async(self, session: aiohttp.ClientSession, cid: str,
+                                         duration: int) -> Optional[List[bytes]]:
+        """并发获取一个cid的全部分段（异步版本），任意一段失败都返回None"""
+        try:
+            segments = await asyncio.gather(*(
+                self.fetch_segment_async(session, cid, index) for index in range(1, segment_count(duration) + 1)
+            ))
+            if all(segment is not None for segment in segments):
+                return list(segments)
+
+        except Exception as e:
+            self.logger.error(f"获取弹幕分段异常: {cid}, 错误: {str(e)}")
+
+        return None
+
+    async def fetch_segments_async(self, session: aiohttp.ClientSession, video_info: Dict) -> Optional[Tuple]:
+        """下载一个cid的全部分段（异步版本），返回值见 fetch_if_changed"""
+        duration = await self.get_video_duration_async(session, video_info)
+        if duration is None:
+            return None
+        segments = await self.get_danmaku_segments_async(session, str(video_info['cid']), duration)
+        if segments is None:
+            return None
+        return 200, segments, content_hash(b''.join(segments)), {}
+
+    async def fetch_part_async(self, session: aiohttp.ClientSession, page: Dict):
+        """下载一个分P的原始弹幕（异步版本），返回值同 fetch_part"""
+        cid = str(page['cid'])
+        if self.danmaku_source == 'seg':
+            return await self.get_danmaku_segments_async(session, cid, page['duration'])
+        return await self.get_danmaku_async(session, cid)
+
+    async def fetch_parts_async(self, session: aiohttp.ClientSession, video_info: Dict,
+                                pages: List[Dict]) -> Optional[Tuple]:
+        """所有分P在同一批请求中并发下载（异步版本），返回值见 fetch_if_changed"""
+        raws = await asyncio.gather(*(self.fetch_part_async(session, page) for page in pages))
+        if any(raw is None for raw in raws):
+            self.logger.error(f"部分分P弹幕获取失败: {video_info['bvid']}")
+            return None
+        return 200, list(raws), self.part_digest(raws), {}
+
+    async def get_raw_danmaku_if_changed_async(self, session: aiohttp.ClientSession, video_info: Dict,
+                                               pages: List[Dict], save_format: str = 'both'
+                                               ) -> Tuple[Optional[List], Optional[Dict]]:
+        """按变化检测清单下载视频所有分P的原始弹幕（异步版本），返回值同 get_raw_danmaku_if_changed"""
+        if len(pages) > 1:
+            self.logger.info(f"多P视频，共{len(pages)}P: {video_info['title']} ({video_info['bvid']})")
+            return await self.fetch_if_changed_async(
+                session, video_info, save_format, lambda entry: self.fetch_parts_async(session, video_info, pages),
+                parts=len(pages)
+            )
+        if self.danmaku_source == 'seg':
+            content, record = await self.fetch_if_changed_async(
+                session, video_info, save_format, lambda entry: self.fetch_segments_async(session, video_info)
+            )
+        else:
+            content, record = await self.fetch_if_changed_async(
+                session, video_info, save_format,
+                lambda entry: self.fetch_xml_async(session, str(video_info['cid']), entry)
+            )
+        return (None if content is None else [content]), record
+
+    async def process_video_async(self, session: aiohttp.ClientSession, bvid: str,
+                                  save_format: str = 'both') -> bool:
+        """处理单个视频（异步版本），解析和保存放到线程池中执行，不阻塞事件循环"""
+        self.logger.info(f"开始处理视频: {bvid}")
+        loop = asyncio.get_running_loop()
+
+        video_info = await self.get_video_info_async(session, bvid)
+        if not video_info:
+            return False
+        pages = await self.get_video_pages_async(session, bvid)
+        if not pages:
+            return False
+
+        raws, record = await self.get_raw_danmaku_if_changed_async(session, video_info, pages, save_format)
+        if not record:
+            return False
+        if raws is None:
+            self.logger.info(f"弹幕无变化，跳过: {video_info['title']} ({bvid})")
+            return True
+
+        return await loop.run_in_executor(self._executor, bind(self.parse_and_save),
+                                          video_info, pages, raws, record, save_format)
+
+    async def _crawl_async(self, bv_list: List[str], save_format: str, concurrency: int,
+                           journal: CrawlJournal) -> int:
+        """固定数量的worker从队列中取BV号，保证同时在处理的视频数不超过concurrency"""
+        queue = asyncio.Queue()
+        for item in enumerate(bv_list, 1):
+            queue.put_nowait(item)
+
+        total = len(bv_list)
+        success = 0
+
+        async def worker():
+            nonlocal success
+            while True:
+                try:
+                    i, bvid = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                self.logger.info(f"处理进度: {i}/{total} - {bvid}")
+                if await journal.track_async(bvid, lambda: self.process_video_async(session, bvid, save_format),
+                                             defer_done=save_format == 'dataset'):
+                    success += 1
+
+        async with self.http.async_session(limit=concurrency * 2, limit_per_host=concurrency) as session:
+            await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
+
+        return success
+
+    def process_from_file_async(self, input_file: str, save_format: str = 'both',
+                                concurrency: int = 8, max_rps: float = 5.0,
+                                resume: bool = True, retry_failed: bool = False):
+        """
+        从文件读取BV号并发处理，断点日志与 process_from_file 相同
+
+        :param concurrency: 同时处理的视频数
+        :param max_rps: 全局每秒请求数上限，由各接口族的限速器一并控制，各接口族在此之下按风控情况自适应限速
+        """
+        start_run()
+        journal = None
+        try:
+            with open(input_file, 'r', encoding='utf-8') as f:
+                bv_list = [line.strip() for line in f if line.strip()]
+
+            journal = self.open_journal(input_file, bv_list, resume, retry_failed)
+            todo = journal.pending(bv_list, retry_failed)
+            self.logger.info(f"共{len(bv_list)}个BV号，本轮需要处理{len(todo)}个")
+
+            set_global_rate(max_rps, burst=max(1, int(max_rps)))
+            try:
+                with ThreadPoolExecutor(max_workers=concurrency) as self._executor:
+                    success = asyncio.run(self._crawl_async(todo, save_format, concurrency, journal))
+            finally:
+                set_global_rate(None)
+            self.close_dataset()
+            journal.finish()
+
+            self.logger.info(f"处理完成，成功: {success}/{len(todo)}")
+            self.log_journal(journal, bv_list)
+            self.logger.info(f"连接复用统计: {self.http.connection_stats()}")
+            self.logger.info(f"限速状态: {limiter_stats()}")
+            self.logger.info(f"指标汇总: {write_summary(self.save_dir)}")
+            self.logger.info(f"视频信息缓存: {self.view_cache.stats()}")
+            self.logger.info(f"弹幕变化检测: {self.manifest.stats()}")
+            if save_format == 'sqlite':
+                self.logger.info(f"数据库: {self.store.stats()}")
+
+        except Exception as e:
+            self.logger.error(f"处理文件失败: {str(e)}")
+        finally:
+            if journal:
+                journal.close()
 
 def main():
     # 使用示例
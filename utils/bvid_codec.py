@@ -0,0 +1,136 @@
+import re
+from typing import Iterable, Optional
+
+import numpy as np
+
+# B站BV号与AV号（aid）的互转，2024年aid超过2^30之后的算法，同样适用于之前的视频：
+# aid 与 MAX_AID 按位或之后异或 XOR_CODE，按58进制写成9位，再交换两对位置，前面加上 "BV1"
+XOR_CODE = 23442827791579
+MASK_CODE = 2251799813685247
+MAX_AID = 1 << 51
+BASE = 58
+ALPHABET = 'FcwAPNKTMug3GV5Lj7EJnHpWsx4tb8haYeviqBz6rkCy12mUSDQX9RdoZf'
+PREFIX = 'BV1'
+BVID_LENGTH = 12
+# 交换的两对位置（在完整BV号中的下标）
+SWAPS = ((3, 9), (4, 7))
+
+BVID_PATTERN = re.compile(rf'^BV1[{ALPHABET}]{{9}}$')
+
+_INDEX = {c: i for i, c in enumerate(ALPHABET)}
+# 向量化转换用的查找表：字节 -> 58进制数字（无效字符为255），数字 -> 字节
+_DECODE_TABLE = np.full(256, 255, dtype=np.uint8)
+_DECODE_TABLE[np.frombuffer(ALPHABET.encode('ascii'), dtype=np.uint8)] = np.arange(BASE, dtype=np.uint8)
+_ENCODE_TABLE = np.frombuffer(ALPHABET.encode('ascii'), dtype=np.uint8)
+_PREFIX_BYTES = np.frombuffer(PREFIX.encode('ascii'), dtype=np.uint8)
+# 交换之后，第 i 位数字（从高到低）所在的列
+_DIGIT_COLUMNS = list(range(3, BVID_LENGTH))
+for _a, _b in SWAPS:
+    _DIGIT_COLUMNS[_a - 3], _DIGIT_COLUMNS[_b - 3] = _DIGIT_COLUMNS[_b - 3], _DIGIT_COLUMNS[_a - 3]
+
+
+def is_valid_bvid(bvid: str) -> bool:
+    """是否是格式正确的BV号（只检查字符，不代表能换算成aid，也不代表视频存在）"""
+    return bool(BVID_PATTERN.match(bvid))
+
+
+def bv_to_av(bvid: str) -> int:
+    """
+    BV号转aid，不发请求
+
+    :raises ValueError: 不是有效的BV号
+    """
+    if not is_valid_bvid(bvid):
+        raise ValueError(f'无效的BV号: {bvid}')
+    chars = list(bvid)
+    for a, b in SWAPS:
+        chars[a], chars[b] = chars[b], chars[a]
+    tmp = 0
+    for c in chars[3:]:
+        tmp = tmp * BASE + _INDEX[c]
+    aid = (tmp & MASK_CODE) ^ XOR_CODE
+    # 58进制的9位比51位多，只有最高位恰好是 MAX_AID 的才是某个aid编出来的BV号
+    if tmp >> 51 != 1 or aid == 0:
+        raise ValueError(f'无效的BV号: {bvid}')
+    return aid
+
+
+def av_to_bv(aid: int) -> str:
+    """
+    aid转BV号，不发请求
+
+    :raises ValueError: aid 超出范围
+    """
+    if not 0 < aid < MAX_AID:
+        raise ValueError(f'aid超出范围: {aid}')
+    chars = list(PREFIX + '0' * (BVID_LENGTH - len(PREFIX)))
+    tmp = (MAX_AID | aid) ^ XOR_CODE
+    for i in range(BVID_LENGTH - 1, len(PREFIX) - 1, -1):
+        chars[i] = ALPHABET[tmp % BASE]
+        tmp //= BASE
+    for a, b in SWAPS:
+        chars[a], chars[b] = chars[b], chars[a]
+    return ''.join(chars)
+
+
+def try_bv_to_av(bvid: str) -> Optional[int]:
+    """BV号转aid，无效的BV号返回None"""
+    try:
+        return bv_to_av(bvid)
+    except ValueError:
+        return None
+
+
+def bvs_to_avs(bvids: Iterable[str]) -> np.ndarray:
+    """
+    批量BV号转aid，numpy向量化，每秒可以转换数百万个
+
+    :param bvids: BV号列表，或 dtype 为 'U12'/'S12' 的数组
+    :return: int64数组，无效的BV号为 -1
+    """
+    array = np.asarray(bvids)
+    if array.dtype.kind == 'U':
+        try:
+            array = array.astype(f'S{array.dtype.itemsize // 4}')
+        except UnicodeEncodeError:
+            # 有非ASCII字符时逐个替换成 '?'，之后按无效字符处理
+            array = np.char.encode(array, 'ascii', 'replace')
+    array = array.astype(np.bytes_)
+    # 统一截断/补齐到12字节，长度不是12的记为无效（补齐的 \0 本身也是无效字符）
+    lengths = np.char.str_len(array) if array.dtype.itemsize > BVID_LENGTH else None
+    array = array.astype(f'S{BVID_LENGTH}')
+    raw = np.frombuffer(np.ascontiguousarray(array).tobytes(), dtype=np.uint8).reshape(-1, BVID_LENGTH)
+
+    digits = _DECODE_TABLE[raw[:, _DIGIT_COLUMNS]]
+    valid = (digits != 255).all(axis=1) & (raw[:, :3] == _PREFIX_BYTES).all(axis=1)
+    if lengths is not None:
+        valid &= lengths == BVID_LENGTH
+
+    tmp = np.zeros(len(raw), dtype=np.uint64)
+    for column in range(digits.shape[1]):
+        tmp = tmp * np.uint64(BASE) + digits[:, column]
+    aids = ((tmp & np.uint64(MASK_CODE)) ^ np.uint64(XOR_CODE)).astype(np.int64)
+    valid &= (tmp >> np.uint64(51) == 1) & (aids != 0)
+    aids[~valid] = -1
+    return aids
+
+
+def avs_to_bvs(aids: Iterable[int]) -> np.ndarray:
+    """
+    批量aid转BV号，numpy向量化
+
+    :return: dtype 为 'U12' 的数组
+    :raises ValueError: 有aid超出范围
+    """
+    aids = np.asarray(aids, dtype=np.int64)
+    if aids.size and (aids.min() <= 0 or aids.max() >= MAX_AID):
+        raise ValueError('aid超出范围')
+    tmp = (aids.astype(np.uint64) | np.uint64(MAX_AID)) ^ np.uint64(XOR_CODE)
+
+    raw = np.empty((len(aids), BVID_LENGTH), dtype=np.uint8)
+    raw[:, :3] = _PREFIX_BYTES
+    base = np.uint64(BASE)
+    for position in range(len(_DIGIT_COLUMNS) - 1, -1, -1):
+        raw[:, _DIGIT_COLUMNS[position]] = _ENCODE_TABLE[tmp % base]
+        tmp //= base
+    return raw.view(f'S{BVID_LENGTH}').ravel().astype(f'U{BVID_LENGTH}')
@@ -0,0 +1,200 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.danmaku_batch import DanmakuBatch
+
+# 弹幕列的类型，与 parse_xml 中弹幕字典的键一一对应
+DANMAKU_SCHEMA = pa.schema([
+    ('time', pa.float64()),
+    ('type', pa.int8()),
+    ('size', pa.uint16()),
+    ('color', pa.uint32()),
+    ('timestamp', pa.int64()),
+    ('pool', pa.int8()),
+    ('user_hash', pa.string()),
+    ('dmid', pa.int64()),
+    ('content', pa.string()),
+    ('page', pa.uint16()),
+    ('part', pa.string()),
+])
+
+# 评论列的类型，与 get_comments 中评论字典的键一一对应
+COMMENT_SCHEMA = pa.schema([
+    ('user', pa.string()),
+    ('content', pa.string()),
+    ('likes', pa.int64()),
+    ('reply_time', pa.timestamp('s')),
+    ('rpid', pa.int64()),
+    ('mid', pa.int64()),
+    # 楼中楼回复的根评论和被回复的评论，一级评论为空
+    ('root', pa.int64()),
+    ('parent', pa.int64()),
+])
+
+COMPRESSION = 'zstd'
+# 流式写入时每攒够这么多行写一个row group
+ROW_GROUP_SIZE = 128 * 1024
+
+_CONVERTERS = {
+    'dmid': int,
+    'rpid': int,
+    'mid': int,
+    'root': int,
+    'parent': int,
+    'reply_time': lambda value: datetime.strptime(value, '%Y-%m-%d %H:%M:%S'),
+}
+
+
+def batch_to_table(batch: DanmakuBatch, schema: pa.Schema = DANMAKU_SCHEMA) -> pa.Table:
+    """DanmakuBatch 的数值列直接按内存转换，不经过逐条字典"""
+    arrays = []
+    for field in schema:
+        name = field.name
+        if name in ('page', 'part') and batch.page is None:
+            arrays.append(pa.nulls(len(batch), type=field.type))
+        elif name == 'page':
+            pages = np.frombuffer(batch.page, dtype='H')
+            arrays.append(pa.array(pages, mask=pages == 0, type=field.type))
+        elif name in ('time', 'type', 'size', 'color', 'timestamp', 'pool') or \
+                (name == 'dmid' and not batch.dmid_overflow):
+            column = getattr(batch, name)
+            arrays.append(pa.array(np.frombuffer(column, dtype=column.typecode), type=field.type))
+        else:
+            values = batch.column(name)
+            convert = _CONVERTERS.get(name)
+            if convert:
+                values = [None if value in (None, '') else convert(value) for value in values]
+            arrays.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def rows_to_table(rows: Iterable[Dict], schema: pa.Schema) -> pa.Table:
+    """把弹幕/评论字典转换为列式表，只保留schema中的列，缺失的列为空值"""
+    if isinstance(rows, DanmakuBatch):
+        return batch_to_table(rows, schema)
+    rows = list(rows)
+    arrays = []
+    for field in schema:
+        values = [row.get(field.name) for row in rows]
+        convert = _CONVERTERS.get(field.name)
+        if convert:
+            values = [None if value in (None, '') else convert(value) for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def file_metadata(video_info: Dict, extra: Optional[Dict] = None) -> Dict[bytes, bytes]:
+    """视频级字段只在文件元数据里存一份，不在每一行重复"""
+    metadata = {b'video_info': json.dumps(video_info, ensure_ascii=False).encode('utf-8')}
+    for key, value in (extra or {}).items():
+        metadata[key.encode()] = json.dumps(value, ensure_ascii=False).encode('utf-8')
+    return metadata
+
+
+def read_metadata(path: str) -> Dict:
+    """读取 write_parquet 写入的视频级字段"""
+    metadata = pq.read_schema(path).metadata or {}
+    return {key.decode(): json.loads(value) for key, value in metadata.items() if not key.startswith(b'ARROW')}
+
+
+def write_parquet(path: str, rows: Iterable[Dict], schema: pa.Schema, video_info: Dict,
+                  extra: Optional[Dict] = None) -> int:
+    """
+    把弹幕/评论写成一个Parquet文件，rows可以是生成器，每 ROW_GROUP_SIZE 行写一个row group
+
+    :param extra: 其他需要写入文件元数据的字段，例如弹幕XML的头部信息
+    :return: 写入的行数
+    """
+    schema = schema.with_metadata(file_metadata(video_info, extra))
+    if isinstance(rows, DanmakuBatch):
+        pq.write_table(batch_to_table(rows, schema), path, compression=COMPRESSION, row_group_size=ROW_GROUP_SIZE)
+        return len(rows)
+    rows = iter(rows)
+    count = 0
+    with pq.ParquetWriter(path, schema, compression=COMPRESSION) as writer:
+        while True:
+            batch = list(islice(rows, ROW_GROUP_SIZE))
+            if not batch and count:
+                break
+            writer.write_table(rows_to_table(batch, schema))
+            count += len(batch)
+            if len(batch) < ROW_GROUP_SIZE:
+                break
+    return count
+
+
+class ParquetDataset:
+    """
+    把很多视频追加写入同一个分区数据集，而不是每个视频一个文件
+
+    目录结构为 root/dt=爬取日期/part-*.parquet，每次运行每个分区一个文件，
+    小视频攒够 row_group_size 行再写一个row group。每行带bvid列，
+    视频级字段写在 root/_videos 下的单独文件中。可以用 pyarrow.dataset.dataset(root, partitioning='hive') 读取。
+
+    :param root: 数据集根目录
+    :param schema: 行的schema，DANMAKU_SCHEMA 或 COMMENT_SCHEMA
+    """
+
+    def __init__(self, root: str, schema: pa.Schema, row_group_size: int = ROW_GROUP_SIZE):
+        self.root = root
+        self.schema = schema.insert(0, pa.field('bvid', pa.string()))
+        self.row_group_size = row_group_size
+        self._lock = threading.Lock()
+        self._writers = {}
+        self._pending = {}
+        self._videos = []
+        self._stamp = f'{time.strftime("%Y%m%d%H%M%S")}-{os.getpid()}'
+
+    def _writer(self, partition: str) -> pq.ParquetWriter:
+        writer = self._writers.get(partition)
+        if writer is None:
+            directory = os.path.join(self.root, partition)
+            os.makedirs(directory, exist_ok=True)
+            writer = pq.ParquetWriter(os.path.join(directory, f'part-{self._stamp}.parquet'),
+                                      self.schema, compression=COMPRESSION)
+            self._writers[partition] = writer
+        return writer
+
+    def _flush(self, partition: str):
+        tables = self._pending.pop(partition, [])
+        if tables:
+            self._writer(partition).write_table(pa.concat_tables(tables))
+
+    def append(self, rows: Iterable[Dict], video_info: Dict, extra: Optional[Dict] = None) -> int:
+        """追加一个视频的弹幕/评论，返回行数"""
+        table = rows_to_table(rows, self.schema.remove(0))
+        table = table.add_column(0, 'bvid', pa.array([video_info['bvid']] * table.num_rows, type=pa.string()))
+        partition = f'dt={time.strftime("%Y-%m-%d")}'
+        with self._lock:
+            pending = self._pending.setdefault(partition, [])
+            pending.append(table)
+            if sum(t.num_rows for t in pending) >= self.row_group_size:
+                self._flush(partition)
+            self._videos.append(dict(video_info, **(extra or {}), rows=table.num_rows))
+        return table.num_rows
+
+    def close(self):
+        """写出剩余的行和视频级字段"""
+        with self._lock:
+            for partition in list(self._pending):
+                self._flush(partition)
+            for writer in self._writers.values():
+                writer.close()
+            self._writers.clear()
+            if self._videos:
+                directory = os.path.join(self.root, '_videos')
+                os.makedirs(directory, exist_ok=True)
+                videos = pa.table({'bvid': [video['bvid'] for video in self._videos],
+                                   'video_info': [json.dumps(video, ensure_ascii=False) for video in self._videos]})
+                pq.write_table(videos, os.path.join(directory, f'videos-{self._stamp}.parquet'),
+                               compression=COMPRESSION)
+                self._videos = []
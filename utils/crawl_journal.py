@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+from utils.metrics import VIDEOS
+from utils.task_context import current_task, task_scope
+
+# 被风控而失败的视频多久之后再试（秒）
+RETRY_DELAY = 600
+
+# 视频的状态：done 成功，failed 失败，retry 因风控失败、retry_after 之后再试，
+# progress 处理到一半（评论记录了翻到的游标）
+DONE = 'done'
+FAILED = 'failed'
+RETRY = 'retry'
+PROGRESS = 'progress'
+
+
+class ErrorCapture(logging.Handler):
+    """
+    把错误日志记到当前处理的视频（utils.task_context.task_scope）上，作为失败原因写入日志
+
+    按上下文而不是线程区分视频：视频交给线程池的下载（用 bind 提交）里的错误也算在它头上，
+    同时处理的其他视频的错误不会混进来。
+    """
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+
+    def emit(self, record: logging.LogRecord):
+        task = current_task()
+        if task is not None:
+            task.error = record.getMessage()
+
+
+class CrawlJournal:
+    """
+    批量爬取的断点日志，只追加写入的JSON Lines文件
+
+    每处理完一个视频追加一行并fsync，进程被杀掉后已记录的视频不会丢；
+    最后一行写到一半的记录在下次打开时截掉。重新运行时跳过已记录的视频，
+    只处理剩下的；retry_failed 模式只处理失败的视频。
+    最终的成功/失败统计直接从日志得到，不需要扫描输出目录。
+
+    :param path: 日志文件路径
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self._lock = threading.Lock()
+        # bvid -> 最新的一条记录
+        self._state: Dict[str, Dict] = {}
+        self.complete = False
+        # dataset格式的成功记录要等数据集关闭、文件真正写完之后再落盘
+        self._deferred: List[Dict] = []
+        self._errors = ErrorCapture()
+        self._load()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        valid = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                valid += len(line)
+                self._apply(record)
+        # 崩溃时写到一半的最后一行
+        if valid < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid)
+
+    def _apply(self, record: Dict):
+        event = record.get('event')
+        if event == 'begin':
+            self.complete = False
+        elif event == 'complete':
+            self.complete = True
+        elif 'bvid' in record:
+            self._state[record['bvid']] = record
+
+    def _append(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._apply(record)
+
+    def begin(self, total: int, resume: bool = True, retry_failed: bool = False):
+        """
+        开始一轮爬取
+
+        上一轮已经全部跑完、或者 resume=False 时，旧日志改名为 .prev 后重新开始；
+        retry_failed 模式总是沿用原来的日志。
+        """
+        if not retry_failed and (self.complete or not resume) and self._state:
+            with self._lock:
+                self._file.close()
+                os.replace(self.path, self.path + '.prev')
+                self._file = open(self.path, 'a', encoding='utf-8')
+                self._state = {}
+                self.complete = False
+        self._append({'event': 'begin', 'time': time.time(), 'total': total, 'retry_failed': retry_failed})
+        logging.getLogger().addHandler(self._errors)
+
+    def finish(self):
+        """一轮爬取正常结束，写出推迟的成功记录"""
+        for record in self._deferred:
+            self._append(record)
+        self._deferred = []
+        self._append({'event': 'complete', 'time': time.time()})
+
+    def record(self, bvid: str, ok: bool, reason: Optional[str] = None, throttled: bool = False,
+               defer_done: bool = False):
+        """记录一个视频的结果，参数含义同 track"""
+        VIDEOS.inc(DONE if ok else RETRY if throttled else FAILED)
+        if ok and defer_done:
+            self._deferred.append({'bvid': bvid, 'status': DONE, 'time': time.time()})
+        elif ok:
+            self.done(bvid)
+        else:
+            self.failed(bvid, reason, throttled)
+
+    def track(self, bvid: str, process: Callable[[], bool], defer_done: bool = False) -> bool:
+        """
+        运行一个视频的处理函数并记录结果
+
+        处理函数返回False时，以这个视频最近一条错误日志作为失败原因；这个视频的请求被风控过的记为待重试。
+        处理函数抛出的异常记为失败，不会中断整轮爬取。
+
+        :param defer_done: 成功记录推迟到 finish 时写入，用于崩溃后数据会丢失的输出格式
+        """
+        with task_scope() as task:
+            try:
+                ok = bool(process())
+                reason = None if ok else task.error or '未获取到数据'
+            except Exception as e:
+                ok, reason = False, str(e)
+        self.record(bvid, ok, reason, task.throttled > 0, defer_done)
+        return ok
+
+    async def track_async(self, bvid: str, process: Callable[[], Awaitable[bool]],
+                          defer_done: bool = False) -> bool:
+        """track 的协程版本，每个协程有自己的上下文，并发处理的视频各记各的"""
+        with task_scope() as task:
+            try:
+                ok = bool(await process())
+                reason = None if ok else task.error or '未获取到数据'
+            except Exception as e:
+                ok, reason = False, str(e)
+        self.record(bvid, ok, reason, task.throttled > 0, defer_done)
+        return ok
+
+    def get(self, bvid: str) -> Optional[Dict]:
+        with self._lock:
+            return self._state.get(bvid)
+
+    def done(self, bvid: str, **fields):
+        self._append(dict(fields, bvid=bvid, status=DONE, time=time.time()))
+
+    def failed(self, bvid: str, reason: str, throttled: bool = False):
+        """记录失败；因风控失败的记为 retry，RETRY_DELAY 秒后的下一轮会重新处理"""
+        record = {'bvid': bvid, 'status': FAILED, 'reason': reason, 'time': time.time()}
+        if throttled:
+            record.update(status=RETRY, retry_after=record['time'] + RETRY_DELAY)
+        self._append(record)
+
+    def progress(self, bvid: str, cursor, page: int):
+        """评论翻页的进度：已经写入的页数和下一页的游标"""
+        self._append({'bvid': bvid, 'status': PROGRESS, 'cursor': cursor, 'page': page, 'time': time.time()})
+
+    def pending(self, bv_list: Iterable[str], retry_failed: bool = False) -> List[str]:
+        """
+        这一轮需要处理的BV号，保持输入顺序并去重
+
+        普通模式跳过已成功、已失败和还没到重试时间的视频；retry_failed 模式只保留失败和待重试的视频
+        """
+        now = time.time()
+        result = []
+        seen = set()
+        with self._lock:
+            for bvid in bv_list:
+                if bvid in seen:
+                    continue
+                seen.add(bvid)
+                record = self._state.get(bvid)
+                status = record['status'] if record else None
+                if retry_failed:
+                    keep = status in (FAILED, RETRY)
+                else:
+                    keep = status in (None, PROGRESS) or (status == RETRY and record['retry_after'] <= now)
+                if keep:
+                    result.append(bvid)
+        return result
+
+    def summary(self, bv_list: Optional[Iterable[str]] = None) -> Dict:
+        """
+        成功/失败统计
+
+        :param bv_list: 输入的BV号列表，给出时额外统计还没处理的视频数
+        :return: {'done', 'failed', 'retry', 'progress', 'pending', 'failures': {bvid: 原因}}
+        """
+        with self._lock:
+            records = dict(self._state)
+        counts = {DONE: 0, FAILED: 0, RETRY: 0, PROGRESS: 0}
+        failures = {}
+        for bvid, record in records.items():
+            counts[record['status']] += 1
+            if record['status'] in (FAILED, RETRY):
+                failures[bvid] = record.get('reason')
+        if bv_list is not None:
+            counts['pending'] = len(set(bv_list) - records.keys())
+        counts['failures'] = failures
+        return counts
+
+    def close(self):
+        logging.getLogger().removeHandler(self._errors)
+        with self._lock:
+            self._file.close()
+
+
+def journal_path(save_dir: str, input_file: str) -> str:
+    """每个输入文件一份日志，放在保存目录下"""
+    name = os.path.splitext(os.path.basename(input_file))[0]
+    return os.path.join(save_dir, 'journal', f'{name}.jsonl')
+
+
+def main():
+    """打印一份日志的统计：python -m utils.crawl_journal 日志路径"""
+    journal = CrawlJournal(sys.argv[1])
+    summary = journal.summary()
+    failures = summary.pop('failures')
+    print(json.dumps(summary, ensure_ascii=False))
+    for bvid, reason in failures.items():
+        print(f'{bvid}\t{reason}')
+    journal.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+from array import array
+from collections.abc import Mapping
+from itertools import accumulate
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+# 与 parse_xml 中弹幕字典相同的键和顺序
+KEYS = ('time', 'type', 'size', 'color', 'timestamp', 'pool', 'user_hash', 'dmid', 'content')
+PART_KEYS = ('page', 'part')
+_NUMERIC = (('time', 'd'), ('type', 'b'), ('size', 'H'), ('color', 'I'), ('timestamp', 'q'), ('pool', 'b'))
+_NUMERIC_NAMES = frozenset(name for name, _ in _NUMERIC)
+_INT64_MAX = (1 << 63) - 1
+
+
+class DanmakuRow(Mapping):
+    """DanmakuBatch 中一条弹幕的视图，按需从列中取值，用法与弹幕字典相同"""
+
+    __slots__ = ('_batch', '_index')
+
+    def __init__(self, batch: 'DanmakuBatch', index: int):
+        self._batch = batch
+        self._index = index
+
+    def __getitem__(self, key: str):
+        return self._batch.value(key, self._index)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._batch.keys())
+
+    def __len__(self) -> int:
+        return len(self._batch.keys())
+
+    def __setitem__(self, key: str, value):
+        self._batch.set_value(key, self._index, value)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+    def to_dict(self) -> Dict:
+        return dict(self)
+
+
+class DanmakuBatch:
+    """
+    紧凑的弹幕容器，代替 parse_xml 中每条弹幕一个字典
+
+    数值字段存放在类型数组中；dmid 转成 int64，user_hash 转成 uint32，
+    转换后不能原样还原的值（前导零、非十六进制、超出范围）单独记在溢出表里；
+    弹幕内容全部拼接在一个UTF-8缓冲区中，用偏移量定位。
+    按下标或迭代得到 DanmakuRow 视图，原来按字典访问弹幕的代码不需要修改。
+    """
+
+    def __init__(self):
+        for name, typecode in _NUMERIC:
+            setattr(self, name, array(typecode))
+        self.dmid = array('q')
+        self.user_hash = array('I')
+        self.text = bytearray()
+        self.offsets = array('q', [0])
+        # 溢出表：下标 -> 原始字符串
+        self.dmid_overflow: Dict[int, str] = {}
+        self.user_hash_overflow: Dict[int, str] = {}
+        # 内容为None的下标（空内容在XML中没有文本节点）
+        self.null_content = set()
+        # 分P序号，0表示未标记；分P标题按序号只存一份
+        self.page: Optional[array] = None
+        self.parts: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def __getitem__(self, index: int) -> DanmakuRow:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return DanmakuRow(self, index)
+
+    def __iter__(self) -> Iterator[DanmakuRow]:
+        return (DanmakuRow(self, index) for index in range(len(self)))
+
+    def keys(self):
+        return KEYS + PART_KEYS if self.page is not None else KEYS
+
+    # ---- 写入 ----
+
+    def _append_ids(self, index: int, dmid: str, user_hash: str):
+        try:
+            value = int(dmid)
+        except ValueError:
+            value = -1
+        if 0 <= value <= _INT64_MAX and str(value) == dmid:
+            self.dmid.append(value)
+        else:
+            self.dmid.append(0)
+            self.dmid_overflow[index] = dmid
+
+        try:
+            value = int(user_hash, 16)
+        except ValueError:
+            value = -1
+        if 0 <= value <= 0xffffffff and '%x' % value == user_hash:
+            self.user_hash.append(value)
+        else:
+            self.user_hash.append(0)
+            self.user_hash_overflow[index] = user_hash
+
+    def append(self, comment: Mapping):
+        """追加一条弹幕字典"""
+        index = len(self)
+        if self.page is not None or 'page' in comment:
+            self._ensure_page().append(comment.get('page') or 0)
+            if comment.get('page'):
+                self.parts[comment['page']] = comment.get('part')
+        for name, _ in _NUMERIC:
+            getattr(self, name).append(comment[name])
+        self._append_ids(index, comment['dmid'], comment['user_hash'])
+        content = comment['content']
+        if content is None:
+            self.null_content.add(index)
+        else:
+            self.text += content.encode('utf-8')
+        self.offsets.append(len(self.text))
+
+    def _ensure_page(self) -> array:
+        if self.page is None:
+            self.page = array('H', bytes(2 * len(self)))
+        return self.page
+
+    def extend(self, other: Union['DanmakuBatch', Iterable[Mapping]]):
+        """追加另一个批次或一组弹幕字典"""
+        if not isinstance(other, DanmakuBatch):
+            for comment in other:
+                self.append(comment)
+            return
+
+        base = len(self)
+        if self.page is not None or other.page is not None:
+            # 先补齐已有行的分P列，再追加数值列
+            self._ensure_page()
+            self.page.extend(other.page if other.page is not None else array('H', bytes(2 * len(other))))
+            self.parts.update(other.parts)
+        for name, _ in _NUMERIC + (('dmid', 'q'), ('user_hash', 'I')):
+            getattr(self, name).extend(getattr(other, name))
+        shift = len(self.text)
+        self.text += other.text
+        self.offsets.extend(offset + shift for offset in other.offsets[1:])
+        self.dmid_overflow.update((base + i, v) for i, v in other.dmid_overflow.items())
+        self.user_hash_overflow.update((base + i, v) for i, v in other.user_hash_overflow.items())
+        self.null_content.update(base + i for i in other.null_content)
+
+    def set_part(self, page: int, part: str, start: int = 0, stop: Optional[int] = None):
+        """把 [start, stop) 范围内的弹幕标记为第page P"""
+        stop = len(self) if stop is None else stop
+        pages = self._ensure_page()
+        for index in range(start, stop):
+            pages[index] = page
+        self.parts[page] = part
+
+    def set_value(self, key: str, index: int, value):
+        """只支持修改数值字段和分P，字符串字段存放在共享缓冲区中不能原地修改"""
+        if key == 'page':
+            self._ensure_page()[index] = value or 0
+        elif key == 'part':
+            page = self.value('page', index) if self.page is not None else None
+            if not page:
+                raise KeyError('先设置page再设置part')
+            self.parts[page] = value
+        elif key in _NUMERIC_NAMES:
+            getattr(self, key)[index] = value
+        else:
+            raise TypeError(f'DanmakuBatch 不支持修改字段 {key}')
+
+    # ---- 读取 ----
+
+    def value(self, key: str, index: int):
+        """第index条弹幕的某个字段，返回值与弹幕字典中的相同"""
+        if key in _NUMERIC_NAMES:
+            return getattr(self, key)[index]
+        if key == 'dmid':
+            overflow = self.dmid_overflow.get(index)
+            return overflow if overflow is not None else str(self.dmid[index])
+        if key == 'user_hash':
+            overflow = self.user_hash_overflow.get(index)
+            return overflow if overflow is not None else '%x' % self.user_hash[index]
+        if key == 'content':
+            if index in self.null_content:
+                return None
+            return self.text[self.offsets[index]:self.offsets[index + 1]].decode('utf-8')
+        if key in PART_KEYS:
+            if self.page is None:
+                raise KeyError(key)
+            page = self.page[index] or None
+            return page if key == 'page' else self.parts.get(page)
+        raise KeyError(key)
+
+    def column(self, key: str) -> Union[array, List]:
+        """整列的值：数值列直接返回类型数组，字符串列返回与弹幕字典中相同的值的列表"""
+        if key in _NUMERIC_NAMES:
+            return getattr(self, key)
+        return [self.value(key, index) for index in range(len(self))]
+
+    def _chunk_column(self, key: str, start: int, stop: int) -> List:
+        if key in _NUMERIC_NAMES:
+            return getattr(self, key)[start:stop].tolist()
+        if key == 'dmid':
+            values = [str(value) for value in self.dmid[start:stop]]
+            overflow = self.dmid_overflow
+        elif key == 'user_hash':
+            values = ['%x' % value for value in self.user_hash[start:stop]]
+            overflow = self.user_hash_overflow
+        elif key == 'content':
+            text, offsets = self.text, self.offsets
+            values = [text[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(start, stop)]
+            overflow = dict.fromkeys(self.null_content)
+        else:
+            return [self.value(key, index) for index in range(start, stop)]
+        if overflow:
+            for index in range(start, stop):
+                if index in overflow:
+                    values[index - start] = overflow[index]
+        return values
+
+    def iter_dicts(self, chunk_size: int = 4096) -> Iterator[Dict]:
+        """逐块把列还原成弹幕字典，比逐条访问行视图快，内存中同时只有一块字典"""
+        keys = self.keys()
+        for start in range(0, len(self), chunk_size):
+            stop = min(start + chunk_size, len(self))
+            columns = [self._chunk_column(key, start, stop) for key in keys]
+            for row in zip(*columns):
+                yield dict(zip(keys, row))
+
+    def to_dicts(self) -> List[Dict]:
+        return list(self.iter_dicts())
+
+    @property
+    def nbytes(self) -> int:
+        """各数组和缓冲区占用的字节数，不含溢出表"""
+        arrays = [getattr(self, name) for name, _ in _NUMERIC] + [self.dmid, self.user_hash, self.offsets]
+        if self.page is not None:
+            arrays.append(self.page)
+        return sum(a.itemsize * len(a) for a in arrays) + len(self.text)
+
+    # ---- 构造 ----
+
+    @classmethod
+    def from_dicts(cls, comments: Iterable[Mapping]) -> 'DanmakuBatch':
+        batch = cls()
+        batch.extend(comments)
+        return batch
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, Union[array, List]]) -> 'DanmakuBatch':
+        """由 parse_xml_fast 的列式结果构造，数值列直接复用"""
+        batch = cls()
+        for name, typecode in _NUMERIC:
+            values = columns[name]
+            setattr(batch, name, values if isinstance(values, array) and values.typecode == typecode
+                    else array(typecode, values))
+        for index, (dmid, user_hash) in enumerate(zip(columns['dmid'], columns['user_hash'])):
+            batch._append_ids(index, dmid, user_hash)
+        contents = columns['content']
+        encoded = [b'' if content is None else content.encode('utf-8') for content in contents]
+        batch.null_content = {index for index, content in enumerate(contents) if content is None}
+        batch.text = bytearray(b''.join(encoded))
+        batch.offsets = array('q', accumulate(map(len, encoded), initial=0))
+        return batch
+
@@ -0,0 +1,116 @@
+import operator
+import re
+from array import array
+from typing import Dict, List, Optional, Tuple, Union
+from xml.etree.ElementTree import ParseError
+
+# 弹幕XML开头的视频级字段
+HEADER_FIELDS = ('chatserver', 'chatid', 'mission', 'maxlimit', 'state', 'real_name', 'source')
+
+# <d p="...">内容</d> 或 <d p="..."/>
+_D_PATTERN = re.compile(rb'<d p="([^"]*)"\s*(?:/>|>([^<]*)</d>)')
+# XML声明之后紧接着 <i> 根元素
+_ROOT_PATTERN = re.compile(rb'\s*(?:<\?xml[^>]*\?>\s*)?<i>')
+_HEADER_PATTERN = re.compile(rb'<(' + b'|'.join(f.encode() for f in HEADER_FIELDS) + rb')>([^<]*)</\1>')
+_ENTITY_PATTERN = re.compile(r'&(#x[0-9a-fA-F]+|#[0-9]+|amp|lt|gt|quot|apos);')
+_ENTITIES = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+_count_commas = operator.methodcaller('count', b',')
+
+
+def _replace_entity(match: re.Match) -> str:
+    name = match.group(1)
+    if name[0] == '#':
+        return chr(int(name[2:], 16) if name[1] in 'xX' else int(name[1:]))
+    return _ENTITIES[name]
+
+
+def _decode_text(raw: Optional[bytes]) -> Optional[str]:
+    """解码弹幕内容，只有包含实体或回车时才做反转义，和ElementTree的结果保持一致"""
+    if not raw:
+        return None
+    text = raw.decode('utf-8')
+    if '&' in text:
+        text = _ENTITY_PATTERN.sub(_replace_entity, text)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def empty_columns() -> Dict[str, Union[array, List]]:
+    """弹幕列式存储的空列"""
+    return {
+        'time': array('d'),
+        'type': array('b'),
+        'size': array('H'),
+        'color': array('I'),
+        'timestamp': array('q'),
+        'pool': array('b'),
+        'user_hash': [],
+        'dmid': [],
+        'content': [],
+    }
+
+
+def parse_xml_fast(xml_content: Union[bytes, str]) -> Tuple[Dict[str, str], Dict[str, Union[array, List]]]:
+    """
+    直接扫描原始字节解析弹幕XML，不构建元素树，也不为每条弹幕创建字典
+
+    :return: (头部字段, 列式弹幕数据)，列名与 parse_xml 中弹幕字典的键相同
+    :raises ParseError: 不是弹幕XML（例如HTML或JSON错误页），没有 <i> 根元素或 <chatid>
+    """
+    if isinstance(xml_content, str):
+        xml_content = xml_content.encode('utf-8')
+
+    # 头部字段都在第一条弹幕之前
+    first = xml_content.find(b'<d ')
+    head = xml_content if first < 0 else xml_content[:first]
+    fields = _HEADER_PATTERN.findall(head)
+    # 正则扫描不会像ElementTree那样对错误页报错，按弹幕XML的结构检查，错误页不能当作0条弹幕保存
+    if not _ROOT_PATTERN.match(head) or not any(name == b'chatid' for name, _ in fields):
+        raise ParseError('不是弹幕XML：缺少 <i> 根元素或 <chatid>')
+    header = {field: '' for field in HEADER_FIELDS}
+    for name, value in fields:
+        header[name.decode()] = _decode_text(value)
+
+    records = _D_PATTERN.findall(xml_content, max(first, 0))
+    ps = [p for p, _ in records]
+    texts = [text for _, text in records]
+    columns = empty_columns()
+
+    comma_counts = set(map(_count_commas, ps))
+    if len(comma_counts) == 1 and min(comma_counts) >= 7:
+        # 所有p属性字段数相同：拼成一个大列表后按步长切片，一次性转换整列
+        width = comma_counts.pop() + 1
+        fields = b','.join(ps).split(b',')
+        columns['time'].extend(map(float, fields[0::width]))
+        columns['type'].extend(map(int, fields[1::width]))
+        columns['size'].extend(map(int, fields[2::width]))
+        columns['color'].extend(map(int, fields[3::width]))
+        columns['timestamp'].extend(map(int, fields[4::width]))
+        columns['pool'].extend(map(int, fields[5::width]))
+        columns['user_hash'] = [value.decode() for value in fields[6::width]]
+        columns['dmid'] = [value.decode() for value in fields[7::width]]
+        columns['content'] = list(map(_decode_text, texts))
+    else:
+        # 字段数不一致时逐条处理，跳过字段不足的记录
+        for p, text in zip(ps, texts):
+            fields = p.split(b',')
+            if len(fields) < 8:
+                continue
+            columns['time'].append(float(fields[0]))
+            columns['type'].append(int(fields[1]))
+            columns['size'].append(int(fields[2]))
+            columns['color'].append(int(fields[3]))
+            columns['timestamp'].append(int(fields[4]))
+            columns['pool'].append(int(fields[5]))
+            columns['user_hash'].append(fields[6].decode())
+            columns['dmid'].append(fields[7].decode())
+            columns['content'].append(_decode_text(text))
+
+    return header, columns
+
+
+def columns_to_comments(columns: Dict[str, Union[array, List]]) -> List[Dict]:
+    """把列式数据转换回 parse_xml 的弹幕字典列表"""
+    keys = ('time', 'type', 'size', 'color', 'timestamp', 'pool', 'user_hash', 'dmid', 'content')
+    return [dict(zip(keys, row)) for row in zip(*(columns[key] for key in keys))]
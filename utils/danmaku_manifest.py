@@ -0,0 +1,115 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+
+# 后来加入的列，旧的清单打开时补上；补上的列为NULL，与任何来源都不匹配，第一次会重新下载
+_ADDED_COLUMNS = [
+    ('source', 'TEXT'),
+    ('parts', 'INTEGER'),
+]
+
+
+def content_hash(content: bytes) -> str:
+    """弹幕XML内容的哈希，用于判断内容是否变化"""
+    return hashlib.sha1(content).hexdigest()
+
+
+class DanmakuManifest:
+    """
+    弹幕变化检测清单
+
+    每个cid记录上次下载时的 ETag/Last-Modified、内容哈希和视频信息中的弹幕数(stat.danmaku)，
+    以及弹幕来源（xml/seg）和分P数：XML会截断弹幕，换了来源或分P布局时上次的输出不能沿用。
+    再次爬取时：弹幕数没变直接跳过；否则发条件请求，304或内容哈希相同也不重写输出文件。
+
+    :param path: SQLite数据库路径
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS manifest (
+                cid TEXT PRIMARY KEY,
+                bvid TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                danmaku_count INTEGER,
+                updated_at REAL
+            )
+        ''')
+        for column, column_type in _ADDED_COLUMNS:
+            columns = {row[1] for row in self._conn.execute('PRAGMA table_info(manifest)')}
+            if column not in columns:
+                self._conn.execute(f'ALTER TABLE manifest ADD COLUMN {column} {column_type}')
+        self._conn.commit()
+
+        # 跳过原因统计
+        self.counts = {'count_unchanged': 0, 'not_modified': 0, 'hash_unchanged': 0, 'changed': 0}
+
+    def get(self, cid: str) -> Optional[Dict]:
+        """读取某个cid的记录"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT bvid, etag, last_modified, content_hash, danmaku_count, source, parts '
+                'FROM manifest WHERE cid = ?',
+                (cid,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'cid': cid,
+            'bvid': row[0],
+            'etag': row[1],
+            'last_modified': row[2],
+            'content_hash': row[3],
+            'danmaku_count': row[4],
+            'source': row[5],
+            'parts': row[6],
+        }
+
+    def update(self, cid: str, bvid: str, etag: Optional[str], last_modified: Optional[str],
+               content_hash: Optional[str], danmaku_count: Optional[int], source: str, parts: int):
+        """输出文件写入成功后更新记录"""
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO manifest '
+                '(cid, bvid, etag, last_modified, content_hash, danmaku_count, source, parts, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (cid, bvid, etag, last_modified, content_hash, danmaku_count, source, parts, time.time())
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def conditional_headers(entry: Optional[Dict]) -> Dict[str, str]:
+        """根据上次的记录生成条件请求头"""
+        headers = {}
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def record(self, reason: str):
+        """记录一次检测结果"""
+        with self._lock:
+            self.counts[reason] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
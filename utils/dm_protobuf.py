@@ -0,0 +1,156 @@
+from typing import Dict, Iterator, List, Tuple
+
+# 分段弹幕接口每段覆盖的视频时长（秒）
+SEGMENT_SECONDS = 360
+
+# DmSegMobileReply.elems 中 DanmakuElem 的字段编号
+_ELEM_FIELDS = {
+    1: 'id',
+    2: 'progress',
+    3: 'mode',
+    4: 'fontsize',
+    5: 'color',
+    6: 'midHash',
+    7: 'content',
+    8: 'ctime',
+    9: 'weight',
+    10: 'action',
+    11: 'pool',
+    12: 'idStr',
+    13: 'attr',
+}
+_STRING_FIELDS = {'midHash', 'content', 'action', 'idStr'}
+_INT32_FIELDS = {'progress', 'mode', 'weight', 'pool', 'attr'}
+
+
+def segment_count(duration: int) -> int:
+    """视频时长对应的弹幕分段数，每段6分钟"""
+    return max(1, -(-int(duration) // SEGMENT_SECONDS))
+
+
+def _read_varint(buf: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(buf: bytes) -> Iterator[Tuple[int, int, object]]:
+    """逐个产出 (字段编号, wire type, 值)，长度分隔的字段值为bytes"""
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            value = int.from_bytes(buf[pos:pos + 8], 'little')
+            pos += 8
+        elif wire_type == 5:
+            value = int.from_bytes(buf[pos:pos + 4], 'little')
+            pos += 4
+        else:
+            raise ValueError(f'不支持的wire type: {wire_type}')
+        yield number, wire_type, value
+
+
+def decode_elem(buf: bytes) -> Dict:
+    """解码一条 DanmakuElem，未知字段忽略"""
+    elem = {}
+    for number, _, value in _iter_fields(buf):
+        name = _ELEM_FIELDS.get(number)
+        if name is None:
+            continue
+        if name in _STRING_FIELDS:
+            value = value.decode('utf-8')
+        elif name in _INT32_FIELDS and value >= 1 << 63:
+            # 负数int32按64位补码编码
+            value -= 1 << 64
+        elem[name] = value
+    return elem
+
+
+def decode_segment(buf: bytes) -> List[Dict]:
+    """解码一个分段的 DmSegMobileReply，返回其中的弹幕"""
+    return [decode_elem(value) for number, wire_type, value in _iter_fields(buf)
+            if number == 1 and wire_type == 2]
+
+
+def elem_to_comment(elem: Dict) -> Dict:
+    """把 DanmakuElem 转换为与 parse_xml 相同结构的弹幕字典"""
+    return {
+        'time': elem.get('progress', 0) / 1000,
+        'type': elem.get('mode', 0),
+        'size': elem.get('fontsize', 0),
+        'color': elem.get('color', 0),
+        'timestamp': elem.get('ctime', 0),
+        'pool': elem.get('pool', 0),
+        'user_hash': elem.get('midHash', ''),
+        'dmid': elem.get('idStr') or str(elem.get('id', 0)),
+        'content': elem.get('content') or None,
+    }
+
+
+def _write_varint(out: bytearray, value: int):
+    if value < 0:
+        value += 1 << 64
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_elem(elem: Dict) -> bytes:
+    """编码一条 DanmakuElem，用于生成本地测试用的分段数据"""
+    out = bytearray()
+    for number, name in sorted(_ELEM_FIELDS.items()):
+        value = elem.get(name)
+        if value is None or value == '' or value == 0:
+            continue
+        if name in _STRING_FIELDS:
+            data = value.encode('utf-8')
+            _write_varint(out, number << 3 | 2)
+            _write_varint(out, len(data))
+            out += data
+        else:
+            _write_varint(out, number << 3)
+            _write_varint(out, value)
+    return bytes(out)
+
+
+def encode_segment(elems: List[Dict]) -> bytes:
+    """编码一个分段的 DmSegMobileReply"""
+    out = bytearray()
+    for elem in elems:
+        data = encode_elem(elem)
+        # DmSegMobileReply 的第1个字段: repeated DanmakuElem elems
+        _write_varint(out, 1 << 3 | 2)
+        _write_varint(out, len(data))
+        out += data
+    return bytes(out)
+
+
+def comment_to_elem(comment: Dict) -> Dict:
+    """elem_to_comment 的逆变换，用已保存的弹幕生成分段数据"""
+    return {
+        'id': int(comment['dmid']),
+        'progress': round(comment['time'] * 1000),
+        'mode': comment['type'],
+        'fontsize': comment['size'],
+        'color': comment['color'],
+        'midHash': comment['user_hash'],
+        'content': comment['content'] or '',
+        'ctime': comment['timestamp'],
+        'pool': comment['pool'],
+        'idStr': comment['dmid'],
+    }
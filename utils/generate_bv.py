@@ -1,17 +1,171 @@
-import random
-
-MAX = 1000
-for i in range(MAX):
-    bv = "BV"
-    for j in range(10):
-        n = random.randint(0,61)
-        if 0 <= n <= 9:
-            c = chr(n + ord('0'))
-        elif 10 <= n <= 35:
-            c = chr(n - 10 + ord('a'))
-        else:
-            c = chr(n - 36 + ord('A'))
-        bv += c
-    print(bv)
-    with open('results/bv_list.txt', 'a', encoding='utf-8') as file:
-        file.write(bv + "\n")
\ No newline at end of file
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.bvid_codec import MAX_AID, avs_to_bvs
+from utils.video_cache import DEFAULT_CACHE_PATH, VideoCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUT = 'results/bv_list.txt'
+# 写文件时每批的条数
+WRITE_BATCH = 1000000
+
+
+def _sorted_unique(aids: np.ndarray) -> np.ndarray:
+    """排序后比较相邻元素去重，数组很大时比 np.unique 快"""
+    aids = np.sort(aids)
+    if len(aids) < 2:
+        return aids
+    return aids[np.concatenate(([True], aids[1:] != aids[:-1]))]
+
+
+def uniform_aids(low: int, high: int, count: int, rng: np.random.Generator) -> np.ndarray:
+    """在 [low, high) 内不重复地均匀抽取 count 个aid，按大小排序"""
+    span = high - low
+    if span <= 0:
+        return np.empty(0, dtype=np.int64)
+    if count >= span:
+        return np.arange(low, high, dtype=np.int64)
+    if span <= 4 * count:
+        return np.sort(low + rng.choice(span, size=count, replace=False)).astype(np.int64)
+    # 范围远大于抽样数时重复很少，抽完去重再补齐
+    aids = _sorted_unique(rng.integers(low, high, size=count, dtype=np.int64))
+    while len(aids) < count:
+        aids = _sorted_unique(np.concatenate([aids, rng.integers(low, high, size=count - len(aids), dtype=np.int64)]))
+    return aids
+
+
+def dense_aids(start: int, count: int) -> np.ndarray:
+    """从 start 开始连续的 count 个aid"""
+    return np.arange(start, min(start + count, MAX_AID), dtype=np.int64)
+
+
+def time_strata(timeline: List[Tuple[int, int]], since: int, until: int, strata: int) -> List[Tuple[int, int]]:
+    """
+    把 [since, until) 等分成 strata 个时间段，按已知视频的 (发布时间, aid) 插值出每段对应的aid范围
+
+    aid大体随发布时间递增，插值前先把aid整理成单调不减。
+    """
+    if len(timeline) < 2:
+        raise ValueError('视频信息缓存中已知发布时间的视频不足2个，无法按时间分层')
+    pubdates = np.array([pubdate for pubdate, _ in timeline], dtype=np.float64)
+    aids = np.maximum.accumulate(np.array([aid for _, aid in timeline], dtype=np.float64))
+    if since < pubdates[0] or until > pubdates[-1]:
+        logger.warning(f'已知视频的发布时间只覆盖 {datetime.fromtimestamp(pubdates[0])} ~ '
+                       f'{datetime.fromtimestamp(pubdates[-1])}，超出部分的aid范围按端点截断')
+    edges = np.interp(np.linspace(since, until, strata + 1), pubdates, aids).astype(np.int64)
+    return [(int(low), int(high)) for low, high in zip(edges[:-1], edges[1:])]
+
+
+def stratified_aids(ranges: List[Tuple[int, int]], count: int, rng: np.random.Generator) -> np.ndarray:
+    """每个aid范围抽取相同数量的aid，避免某个时间段的视频过多或过少"""
+    per_stratum, extra = divmod(count, len(ranges))
+    parts = [uniform_aids(max(low, 1), high, per_stratum + (i < extra), rng)
+             for i, (low, high) in enumerate(ranges)]
+    return _sorted_unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+
+
+def filter_known(bvids: np.ndarray, cache: Optional[VideoCache]) -> np.ndarray:
+    """去掉视频信息缓存中已有的BV号（已经爬过或确认存在的视频）"""
+    if cache is None or not len(bvids):
+        return bvids
+    known = cache.known(bvids.tolist())
+    if not known:
+        return bvids
+    return bvids[~np.isin(bvids, list(known))]
+
+
+def write_bvids(path: str, bvids: Union[np.ndarray, Iterable[str]], append: bool = True) -> int:
+    """按批写出BV号，一行一个，返回写出的条数；numpy数组逐批切片转换，不会整个复制成列表"""
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    if not isinstance(bvids, np.ndarray):
+        bvids = list(bvids)
+    with open(path, 'a' if append else 'w', encoding='utf-8') as f:
+        for start in range(0, len(bvids), WRITE_BATCH):
+            batch = bvids[start:start + WRITE_BATCH]
+            f.write('\n'.join(batch.tolist() if isinstance(batch, np.ndarray) else batch) + '\n')
+    return len(bvids)
+
+
+def parse_date(value: str) -> int:
+    """'YYYY-MM-DD' 或 'YYYY-MM-DD HH:MM:SS'（本地时间）转时间戳"""
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return int(datetime.strptime(value, fmt).timestamp())
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f'时间格式错误: {value}，请使用 YYYY-MM-DD 或 YYYY-MM-DD HH:MM:SS')
+
+
+def main():
+    """
+    按aid范围生成有效的BV号，例如
+
+        python -m utils.generate_bv uniform --low 1 --high 1000000000 --count 100000
+        python -m utils.generate_bv stratified --since 2024-01-01 --until 2024-12-01 --strata 11 --count 11000
+        python -m utils.generate_bv dense --start 170001 --count 5000
+    """
+    parser = argparse.ArgumentParser(description='按aid范围生成有效的BV号，追加到BV号列表文件')
+    parser.add_argument('mode', choices=['uniform', 'stratified', 'dense'],
+                        help='uniform 在aid范围内均匀抽样，stratified 按发布时间分层抽样，dense 连续扫描')
+    parser.add_argument('--count', type=int, default=1000, help='生成的BV号个数（过滤已知视频之前）')
+    parser.add_argument('--low', type=int, default=1, help='uniform：aid下限（含）')
+    parser.add_argument('--high', type=int, help='uniform：aid上限（不含），默认为视频信息缓存中最大的aid')
+    parser.add_argument('--start', type=int, help='dense：起始aid')
+    parser.add_argument('--since', type=parse_date, help='stratified：开始时间')
+    parser.add_argument('--until', type=parse_date, help='stratified：结束时间')
+    parser.add_argument('--strata', type=int, default=10, help='stratified：时间段个数')
+    parser.add_argument('--seed', type=int, help='随机种子')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='BV号列表文件，已存在时追加')
+    parser.add_argument('--overwrite', action='store_true', help='覆盖而不是追加')
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help='视频信息缓存，其中已有的BV号不再输出')
+    parser.add_argument('--no-filter', action='store_true', help='不按视频信息缓存过滤')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    rng = np.random.default_rng(args.seed)
+    cache = VideoCache(args.cache) if os.path.exists(args.cache) else None
+
+    if args.mode == 'dense':
+        if args.start is None:
+            parser.error('dense 需要 --start')
+        aids = dense_aids(args.start, args.count)
+    elif args.mode == 'uniform':
+        high = args.high
+        if high is None:
+            timeline = cache.aid_timeline() if cache else []
+            if not timeline:
+                parser.error('视频信息缓存为空，请用 --high 指定aid上限')
+            high = max(aid for _, aid in timeline) + 1
+        aids = uniform_aids(args.low, min(high, MAX_AID), args.count, rng)
+    else:
+        if args.since is None or args.until is None or args.since >= args.until:
+            parser.error('stratified 需要 --since 和 --until，且开始时间早于结束时间')
+        try:
+            ranges = time_strata(cache.aid_timeline() if cache else [], args.since, args.until, args.strata)
+        except ValueError as e:
+            parser.error(str(e))
+        aids = stratified_aids(ranges, args.count, rng)
+
+    bvids = avs_to_bvs(aids[(aids > 0) & (aids < MAX_AID)])
+    generated = len(bvids)
+    if not args.no_filter:
+        bvids = filter_known(bvids, cache)
+    written = write_bvids(args.output, bvids, append=not args.overwrite)
+    print(f'生成 {generated} 个BV号，跳过视频信息缓存中已有的 {generated - written} 个，'
+          f'写入 {written} 个到 {args.output}')
+    if cache is not None:
+        cache.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+import asyncio
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Mapping, Optional, Tuple
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.metrics import DOWNLOADED_BYTES, ERRORS, REQUEST_SECONDS, RETRIES
+from utils.rate_limiter import THROTTLE_STATUS, THROTTLE_CODES, get_limiter
+
+try:
+    import brotli  # noqa: F401  urllib3 装了 brotli 才能解码 br
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+# 所有爬虫共用的请求头，只在这里维护
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Referer': 'https://www.bilibili.com',
+    'Accept-Encoding': ACCEPT_ENCODING,
+    'Connection': 'keep-alive',
+}
+
+# (连接超时, 读取超时)，单位秒
+DEFAULT_TIMEOUT = (5, 30)
+
+# 只在响应开头找返回码，不为了判断风控把整个JSON解析一遍
+_CODE_PATTERN = re.compile(rb'"code"\s*:\s*(-?\d+)')
+
+
+def record_response(endpoint: Optional[str], elapsed: float, status: int, body: bytes, size: int):
+    """记录一次请求的耗时、下载字节数和错误类型"""
+    endpoint = endpoint or 'other'
+    REQUEST_SECONDS.observe(elapsed, endpoint)
+    DOWNLOADED_BYTES.inc(endpoint, amount=size)
+    if status >= 400:
+        ERRORS.inc(endpoint, f'http_{status}')
+        return
+    match = _CODE_PATTERN.search(body[:64])
+    if match is not None and match.group(1) != b'0':
+        ERRORS.inc(endpoint, f'api_{int(match.group(1))}')
+
+
+def is_throttled(status: int, body_head: bytes) -> bool:
+    """判断响应是否被风控：HTTP 412 或接口返回码 -412/-799"""
+    if status == THROTTLE_STATUS:
+        return True
+    match = _CODE_PATTERN.search(body_head[:64])
+    return match is not None and int(match.group(1)) in THROTTLE_CODES
+
+
+class HttpClient:
+    """
+    带连接池的HTTP客户端，所有爬虫共用
+
+    每个host维护一个keep-alive连接池，避免每次请求都重新进行TCP+TLS握手。
+    同一个客户端也可以创建共享同样请求头/cookie/超时设置的 aiohttp 会话。
+
+    :param headers: 追加或覆盖默认请求头
+    :param cookies: 默认携带的cookie
+    :param timeout: 默认超时 (连接超时, 读取超时)
+    :param pool_maxsize: 每个host的最大连接数
+    :param max_retries: 被风控时的最大重试次数
+    """
+
+    def __init__(self, headers: Optional[Dict] = None, cookies: Optional[Dict] = None,
+                 timeout: Tuple[float, float] = DEFAULT_TIMEOUT, pool_maxsize: int = 16,
+                 max_retries: int = 3):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.headers = dict(DEFAULT_HEADERS)
+        if headers:
+            self.headers.update(headers)
+        self.cookies = dict(cookies or {})
+
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.cookies.update(self.cookies)
+        # pool_connections 是缓存的host连接池个数，设大一些避免连接池被淘汰后计数丢失
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # aiohttp 会话的连接统计：host -> {'connections', 'reused'}
+        self._async_stats = defaultdict(lambda: {'connections': 0, 'reused': 0})
+        self._lock = threading.Lock()
+
+    def get(self, url: str, params: Optional[Dict] = None, headers: Optional[Dict] = None,
+            timeout=None, endpoint: Optional[str] = None, **kwargs) -> requests.Response:
+        """
+        发送GET请求，未指定timeout时使用默认超时
+
+        :param endpoint: 接口族名称（view/danmaku/reply/search），指定后请求经过该接口族的
+                         自适应限速器，被风控时自动降速并重试
+        """
+        limiter = get_limiter(endpoint) if endpoint else None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                RETRIES.inc(endpoint)
+            if limiter:
+                limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(
+                    url,
+                    params=params,
+                    headers=headers,
+                    timeout=timeout or self.timeout,
+                    **kwargs
+                )
+            except requests.RequestException as e:
+                ERRORS.inc(endpoint or 'other', type(e).__name__)
+                raise
+            # 只有JSON接口才有返回码，其他响应（如弹幕XML）不读取响应体，保留流式读取的能力
+            body = response.content if 'json' in response.headers.get('Content-Type', '') else b''
+            # 流式读取时响应体还没下载，按 Content-Length 计
+            size = int(response.headers.get('Content-Length') or 0) if kwargs.get('stream') else len(response.content)
+            record_response(endpoint, time.perf_counter() - start, response.status_code, body, size)
+            if limiter is None:
+                return response
+            if not is_throttled(response.status_code, body):
+                limiter.on_success()
+                return response
+            ERRORS.inc(endpoint, 'throttled')
+            if attempt < self.max_retries and kwargs.get('stream'):
+                # 流式响应没读完不会归还连接，重试前先关掉，否则退避期间一直占着连接池
+                response.close()
+            limiter.on_throttle()
+        return response
+
+    async def get_async(self, session: aiohttp.ClientSession, url: str, params: Optional[Dict] = None,
+                        headers: Optional[Dict] = None,
+                        endpoint: Optional[str] = None) -> Tuple[int, bytes, Mapping[str, str]]:
+        """
+        异步GET请求，限速和风控重试逻辑与 get 相同
+
+        :return: (状态码, 响应体, 响应头（不区分大小写）)
+        """
+        limiter = get_limiter(endpoint) if endpoint else None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                RETRIES.inc(endpoint)
+            if limiter:
+                await limiter.acquire_async()
+            start = time.perf_counter()
+            try:
+                async with session.get(url, params=params, headers=headers) as response:
+                    status, body, response_headers = response.status, await response.read(), response.headers.copy()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                ERRORS.inc(endpoint or 'other', type(e).__name__)
+                raise
+            record_response(endpoint, time.perf_counter() - start, status, body, len(body))
+            if limiter is None:
+                return status, body, response_headers
+            if not is_throttled(status, body):
+                limiter.on_success()
+                return status, body, response_headers
+            ERRORS.inc(endpoint, 'throttled')
+            limiter.on_throttle()
+        return status, body, response_headers
+
+    def async_session(self, limit: int = 32, limit_per_host: int = 16) -> aiohttp.ClientSession:
+        """创建共享同样请求头/cookie/超时的 aiohttp 会话，连接复用情况计入 connection_stats"""
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            ctx.host = f'{params.url.host}:{params.url.port}'
+
+        async def on_connection_create_end(session, ctx, params):
+            with self._lock:
+                self._async_stats[ctx.host]['connections'] += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            with self._lock:
+                self._async_stats[ctx.host]['reused'] += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+
+        connect, read = self.timeout
+        return aiohttp.ClientSession(
+            headers=self.headers,
+            cookies=self.cookies,
+            connector=aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read),
+            trace_configs=[trace_config],
+        )
+
+    def connection_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        每个host的连接复用统计
+
+        :return: {host: {'connections': 新建连接数, 'requests': 请求数, 'reused': 复用连接的请求数}}
+        """
+        stats = {}
+        for adapter in set(self.session.adapters.values()):
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                host = f'{pool.host}:{pool.port}'
+                item = stats.setdefault(host, {'connections': 0, 'requests': 0, 'reused': 0})
+                item['connections'] += pool.num_connections
+                item['requests'] += pool.num_requests
+                item['reused'] += max(0, pool.num_requests - pool.num_connections)
+
+        with self._lock:
+            for host, counts in self._async_stats.items():
+                item = stats.setdefault(host, {'connections': 0, 'requests': 0, 'reused': 0})
+                item['connections'] += counts['connections']
+                item['requests'] += counts['connections'] + counts['reused']
+                item['reused'] += counts['reused']
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    """获取进程内共享的默认客户端"""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
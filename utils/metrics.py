@@ -0,0 +1,296 @@
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from utils.rate_limiter import limiter_stats
+
+# 耗时直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    """
+    只增不减的计数器，可以带标签
+
+    :param name: 指标名，按Prometheus的习惯以 _total 结尾
+    :param labels: 标签名，inc 时按同样顺序给出标签值
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        key = tuple(str(label) for label in labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self) -> Dict[Tuple, float]:
+        with self._lock:
+            return dict(self._values)
+
+    def values_since(self, since: Optional[Dict[Tuple, float]] = None) -> Dict[Tuple, float]:
+        """相对于 values() 快照的增量，没有变化的标签不列出"""
+        if not since:
+            return self.values()
+        deltas = {key: value - since.get(key, 0) for key, value in self.values().items()}
+        return {key: value for key, value in deltas.items() if value}
+
+    def total(self) -> float:
+        return sum(self.values().values())
+
+    def render(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+                for key, value in sorted(self.values().items())]
+
+    def summary(self, since: Optional[Dict[Tuple, float]] = None) -> Dict:
+        return {'/'.join(key) or 'total': value for key, value in sorted(self.values_since(since).items())}
+
+
+class Histogram:
+    """
+    分桶直方图，用于请求耗时、解析耗时等
+
+    :param buckets: 各桶的上界，自动追加 +Inf
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # 标签值 -> [各桶计数（非累计）, 总和, 次数]
+        self._values: Dict[Tuple, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        key = tuple(str(label) for label in labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                item = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            item[0][index] += 1
+            item[1] += value
+            item[2] += 1
+
+    @contextmanager
+    def time(self, *labels) -> Iterator[None]:
+        """统计 with 块的耗时"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def values(self) -> Dict[Tuple, List]:
+        with self._lock:
+            return {key: [list(counts), total, count] for key, (counts, total, count) in self._values.items()}
+
+    def values_since(self, since: Optional[Dict[Tuple, List]] = None) -> Dict[Tuple, List]:
+        """相对于 values() 快照的增量，没有新观测值的标签不列出"""
+        values = self.values()
+        if not since:
+            return values
+        deltas = {}
+        for key, (counts, total, count) in values.items():
+            old_counts, old_total, old_count = since.get(key, [[0] * len(counts), 0.0, 0])
+            if count > old_count:
+                deltas[key] = [[n - old for n, old in zip(counts, old_counts)], total - old_total, count - old_count]
+        return deltas
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in sorted(self.values().items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+    def _quantile(self, counts: List[int], count: int, q: float) -> Optional[float]:
+        """按分桶估计分位数，取落在的那个桶的上界"""
+        rank = q * count
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            if cumulative >= rank:
+                return bound if bound != math.inf else self.buckets[-2]
+        return None
+
+    def summary(self, since: Optional[Dict[Tuple, List]] = None) -> Dict:
+        return {
+            '/'.join(key) or 'total': {
+                'count': count,
+                'sum': round(total, 3),
+                'avg': round(total / count, 4) if count else None,
+                'p50': self._quantile(counts, count, 0.5),
+                'p95': self._quantile(counts, count, 0.95),
+            }
+            for key, (counts, total, count) in sorted(self.values_since(since).items())
+        }
+
+
+class Registry:
+    """
+    一个进程内的全部指标
+
+    /metrics 输出进程启动以来的累计值；summary 只统计最近一次 start_run 之后的部分，
+    同一个进程里先后跑多轮（重新处理、性能测试、队列worker）时每轮的汇总互不影响。
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+        self.started = time.time()
+        # start_run 时各指标的值
+        self._snapshot: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def start_run(self):
+        """开始新的一轮：记下各指标当前的值和开始时间"""
+        with self._lock:
+            metrics = list(self.metrics.values())
+            self._snapshot = {metric.name: metric.values() for metric in metrics}
+            self.started = time.time()
+
+    def _register(self, metric):
+        with self._lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        """Prometheus文本格式"""
+        lines = []
+        with self._lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> Dict:
+        """
+        一轮运行的汇总：各指标按标签汇总，外加每秒弹幕/评论数和各接口族的限速状态，
+        可以区分慢是因为被风控（backoffs、重试多）、解析还是写入
+        """
+        with self._lock:
+            metrics = list(self.metrics.values())
+            snapshot = self._snapshot
+            started = self.started
+        elapsed = time.time() - started
+        items = ITEMS.values_since(snapshot.get(ITEMS.name))
+        return {
+            'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started)),
+            'elapsed_seconds': round(elapsed, 1),
+            'per_second': {key[0]: round(value / elapsed, 2) for key, value in sorted(items.items())} if elapsed else {},
+            'metrics': {metric.name: metric.summary(snapshot.get(metric.name)) for metric in metrics},
+            'limiters': limiter_stats(),
+        }
+
+
+REGISTRY = Registry()
+
+# 爬虫各处使用的指标
+REQUEST_SECONDS = REGISTRY.histogram('bilibili_request_seconds', '每次HTTP请求的耗时', ['endpoint'])
+DOWNLOADED_BYTES = REGISTRY.counter('bilibili_downloaded_bytes_total', '下载的响应体字节数', ['endpoint'])
+ERRORS = REGISTRY.counter('bilibili_errors_total', '请求错误，按类型区分：http_状态码、api_返回码、throttled、异常类名',
+                          ['endpoint', 'type'])
+RETRIES = REGISTRY.counter('bilibili_retries_total', '被风控后的重试次数', ['endpoint'])
+PARSE_SECONDS = REGISTRY.histogram('bilibili_parse_seconds', '解析一个视频的弹幕/一页评论的耗时', ['kind'])
+WRITE_SECONDS = REGISTRY.histogram('bilibili_write_seconds', '保存一个视频的数据的耗时', ['kind', 'format'])
+ITEMS = REGISTRY.counter('bilibili_items_total', '解析出的弹幕/评论条数', ['kind'])
+VIDEOS = REGISTRY.counter('bilibili_videos_total', '处理完的视频数', ['status'])
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith('/metrics.json'):
+            body = json.dumps(REGISTRY.summary(), ensure_ascii=False).encode('utf-8')
+            content_type = 'application/json; charset=utf-8'
+        elif self.path.startswith('/metrics'):
+            body = REGISTRY.render().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int = 9108, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    在后台线程启动指标接口：/metrics 为Prometheus文本格式，/metrics.json 为JSON汇总
+
+    同一个进程只启动一次；默认只监听本机
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name='metrics-server', daemon=True).start()
+        return _server
+
+
+def start_run():
+    """每轮爬取开始时调用，之后的 write_summary 只统计这一轮"""
+    REGISTRY.start_run()
+
+
+def write_summary(save_dir: str) -> str:
+    """把这一轮的指标汇总写到保存目录下的 metrics/run-时间.json，返回路径"""
+    directory = os.path.join(save_dir, 'metrics')
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'run-{time.strftime("%Y%m%d-%H%M%S")}.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(REGISTRY.summary(), f, ensure_ascii=False, indent=2)
+    return path
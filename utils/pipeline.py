@@ -0,0 +1,160 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+# 输入结束的标记，沿着各阶段的队列依次传下去
+_DONE = object()
+
+
+class Stage:
+    """
+    流水线的一个阶段：若干线程从有界队列中取数据处理，结果交给下一阶段
+
+    CPU密集的阶段在处理函数里把工作提交给进程池并等待结果，线程只负责等待，不占用GIL。
+
+    :param name: 阶段名，用于统计和日志
+    :param func: 处理函数，返回None表示这条数据到此为止；batch_size>1时参数和返回值都是列表
+    :param workers: 线程数
+    :param queue_size: 输入队列容量，满了之后上一阶段阻塞等待（背压）
+    :param batch_size: 每次最多从队列中取多少条一起处理，取不满时不等待
+    :param on_error: 处理函数抛出异常时调用 on_error(这一批数据, 异常)，用来记录失败；不设置时只写日志
+    """
+
+    def __init__(self, name: str, func: Callable, workers: int = 1, queue_size: int = 8, batch_size: int = 1,
+                 on_error: Optional[Callable[[List, Exception], None]] = None):
+        self.name = name
+        self.func = func
+        self.on_error = on_error
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busy = 0.0
+        # 往下一阶段放数据时因队列已满而等待的时间，越长说明下游越慢
+        self.blocked = 0.0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+
+    def put(self, item):
+        """放入输入队列，队列满时阻塞"""
+        self.queue.put(item)
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def _take(self) -> List:
+        """取一批数据，遇到结束标记时放回去让同阶段的其他线程也能看到"""
+        items = [self.queue.get()]
+        while items[-1] is not _DONE and len(items) < self.batch_size:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if items[-1] is _DONE:
+            self.queue.put(_DONE)
+            items.pop()
+        return items
+
+    def stats(self) -> Dict:
+        return {
+            'depth': self.queue.qsize(),
+            'max_depth': self.max_depth,
+            'capacity': self.queue.maxsize,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'busy_seconds': round(self.busy, 2),
+            'blocked_seconds': round(self.blocked, 2),
+        }
+
+
+class Pipeline:
+    """
+    多阶段流水线：各阶段之间是有界队列，慢的阶段会让上游阻塞，内存占用不会无限增长
+
+    每个阶段的队列深度可以随时用 depths() 查看，队列长期满的阶段的下游就是瓶颈；
+    report_interval 大于0时定期把各阶段状态写入日志。
+
+    :param stages: 按顺序排列的阶段，最后一个阶段的返回值被丢弃
+    """
+
+    def __init__(self, stages: List[Stage], report_interval: float = 0,
+                 logger: Optional[logging.Logger] = None):
+        self.stages = stages
+        self.report_interval = report_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self._stop = threading.Event()
+
+    def _work(self, index: int):
+        stage = self.stages[index]
+        downstream = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            items = stage._take()
+            if not items:
+                return
+            start = time.perf_counter()
+            try:
+                results = stage.func(items) if stage.batch_size > 1 else [stage.func(items[0])]
+            except Exception as e:
+                self.logger.error(f"流水线阶段 {stage.name} 处理失败: {str(e)}")
+                with stage._lock:
+                    stage.errors += len(items)
+                if stage.on_error:
+                    try:
+                        stage.on_error(items, e)
+                    except Exception as hook_error:
+                        self.logger.error(f"流水线阶段 {stage.name} 记录失败时出错: {str(hook_error)}")
+                continue
+            finally:
+                with stage._lock:
+                    stage.busy += time.perf_counter() - start
+            results = [result for result in results or [] if result is not None]
+            with stage._lock:
+                stage.processed += len(items)
+                stage.dropped += len(items) - len(results)
+            if downstream:
+                for result in results:
+                    start = time.perf_counter()
+                    downstream.put(result)
+                    with stage._lock:
+                        stage.blocked += time.perf_counter() - start
+
+    def _report(self):
+        while not self._stop.wait(self.report_interval):
+            self.logger.info(f"流水线队列深度: {self.depths()}")
+
+    def run(self, items: Iterable):
+        """把输入逐个放进第一阶段，等所有阶段处理完再返回"""
+        threads = [
+            [threading.Thread(target=self._work, args=(index,), name=f'{stage.name}-{i}', daemon=True)
+             for i in range(stage.workers)]
+            for index, stage in enumerate(self.stages)
+        ]
+        for group in threads:
+            for thread in group:
+                thread.start()
+        if self.report_interval > 0:
+            threading.Thread(target=self._report, name='pipeline-report', daemon=True).start()
+
+        try:
+            for item in items:
+                self.stages[0].put(item)
+        finally:
+            # 上一阶段的线程全部结束后，下一阶段才会收到结束标记
+            for stage, group in zip(self.stages, threads):
+                stage.put(_DONE)
+                for thread in group:
+                    thread.join()
+            self._stop.set()
+
+    def depths(self) -> Dict[str, int]:
+        """各阶段输入队列当前的长度"""
+        return {stage.name: stage.queue.qsize() for stage in self.stages}
+
+    def stats(self) -> Dict[str, Dict]:
+        """各阶段的处理数、忙碌时间、等待下游的时间和队列深度"""
+        return {stage.name: stage.stats() for stage in self.stages}
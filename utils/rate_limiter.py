@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+from utils.task_context import current_task
+
+
+class TokenBucket:
+    """
+    令牌桶请求预算，替代固定的 time.sleep
+
+    同一个桶可以同时被线程（acquire）和协程（acquire_async）共享，
+    所有请求都从这里领取令牌，保证全局请求速率不超过 rate。
+
+    :param rate: 每秒补充的令牌数（即平均请求速率）
+    :param burst: 桶容量，允许的瞬时突发请求数
+    """
+
+    def __init__(self, rate: float = 5.0, burst: int = 1):
+        if rate <= 0:
+            raise ValueError("rate 必须大于0")
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """预定一个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # 令牌可以透支，透支部分就是调用方需要等待的时间
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """阻塞直到拿到一个令牌"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """协程版本，等待期间不阻塞事件循环"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+# B站的风控返回：HTTP 412，或者接口返回码 -412（请求被拦截）/ -799（请求过于频繁）
+THROTTLE_STATUS = 412
+THROTTLE_CODES = (-412, -799)
+
+
+class AdaptiveRateLimiter(TokenBucket):
+    """
+    AIMD自适应限速器
+
+    响应正常时速率线性增加（加性增），遇到风控时速率减半并暂停一段时间（乘性减），
+    这样可以贴着B站实际允许的速率运行，而不是用一个保守的固定间隔。
+
+    :param name: 接口族名称，用于日志和统计
+    :param rate: 初始速率（次/秒）
+    :param min_rate: 速率下限
+    :param max_rate: 速率上限
+    :param increase: 每次正常响应增加的速率
+    :param decrease: 遇到风控时速率乘以的系数
+    :param penalty: 遇到风控后额外暂停的秒数
+    """
+
+    def __init__(self, name: str, rate: float = 2.0, min_rate: float = 0.1, max_rate: float = 20.0,
+                 increase: float = 0.05, decrease: float = 0.5, penalty: float = 5.0, burst: int = 1):
+        super().__init__(rate=rate, burst=burst)
+        self.name = name
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.penalty = penalty
+        self.successes = 0
+        self.backoffs = 0
+        self.last_backoff = None
+
+    def _reserve(self) -> float:
+        """预定本接口族的令牌，设置了全局上限时同时预定一个全局令牌，两者的等待重叠，只等较长的一个"""
+        wait = super()._reserve()
+        cap = _global_cap
+        if cap is not None:
+            wait = max(wait, cap._reserve())
+        return wait
+
+    def on_success(self):
+        """正常响应：加性增"""
+        with self._lock:
+            self.successes += 1
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self):
+        """被风控：乘性减，并清空令牌让所有等待者一起暂停"""
+        # 每次被风控都记到当前处理的视频上，减速则按暂停周期合并
+        task = current_task()
+        if task is not None:
+            task.throttled += 1
+        with self._lock:
+            now = time.monotonic()
+            # 同一批并发请求可能同时被拦截，一个暂停周期内只减速一次
+            if self.last_backoff is not None and now - self.last_backoff < self.penalty:
+                return
+            self.backoffs += 1
+            self.last_backoff = now
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = min(self._tokens, 0.0) - self.penalty * self.rate
+            self._last = now
+
+    def stats(self) -> dict:
+        """当前限速状态"""
+        with self._lock:
+            return {
+                'rate': round(self.rate, 3),
+                'successes': self.successes,
+                'backoffs': self.backoffs,
+                'seconds_since_backoff': (
+                    round(time.monotonic() - self.last_backoff, 1) if self.last_backoff is not None else None
+                ),
+            }
+
+
+# 各接口族的初始速率，正常情况下会自动往上调
+ENDPOINT_RATES = {
+    'view': 5.0,      # /x/web-interface/view
+    'danmaku': 5.0,   # comment.bilibili.com/{cid}.xml
+    'reply': 2.0,     # /x/v2/reply/*
+    'search': 0.5,    # /x/web-interface/search/type
+}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+# 所有接口族合计的请求速率上限，由各接口族的限速器在领取令牌时一并预定，None 为不限
+_global_cap: Optional[TokenBucket] = None
+
+
+def set_global_rate(rate: Optional[float], burst: int = 1):
+    """设置所有接口族合计的每秒请求数上限，None 为取消；各接口族仍在此之下自适应限速"""
+    global _global_cap
+    _global_cap = TokenBucket(rate=rate, burst=burst) if rate else None
+
+
+def get_limiter(endpoint: str) -> AdaptiveRateLimiter:
+    """获取某个接口族共享的限速器"""
+    with _limiters_lock:
+        if endpoint not in _limiters:
+            _limiters[endpoint] = AdaptiveRateLimiter(endpoint, rate=ENDPOINT_RATES.get(endpoint, 1.0))
+        return _limiters[endpoint]
+
+
+def limiter_stats() -> dict:
+    """所有接口族的限速状态"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
+
@@ -0,0 +1,313 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+import zstandard as zstd
+
+DEFAULT_ARCHIVE_PATH = 'results/raw_archive.sqlite3'
+
+# 压缩级别：弹幕XML用字典压缩时，级别3的压缩比与不用字典的级别19相当，速度快几十倍
+DEFAULT_LEVEL = 3
+# 每个接口族攒够这么多条响应后训练压缩字典
+TRAIN_SAMPLES = 64
+# 字典大小，zstd的默认值
+DICT_SIZE = 112640
+
+logger = logging.getLogger(__name__)
+
+
+class RawArchive:
+    """
+    原始响应存档
+
+    把接口返回的原始响应体（弹幕XML、分段protobuf、视频信息和评论JSON）zstd压缩后存进SQLite，
+    以 (接口族, 键, 下载时间) 区分，同一个键可以有多次下载的记录。修改解析或字段映射后
+    用 reprocess.py 从存档重新解析保存，不需要重新爬取。
+
+    每个接口族攒够 train_samples 条响应后用这些响应训练一个zstd字典，之后的响应都用字典压缩；
+    弹幕XML的标签和属性高度重复，弹幕少的视频只有几KB，用字典压缩后还能再小约1/6。
+    字典也存在数据库里，每条记录记下压缩时用的字典，重新训练后旧记录照样能解压。
+
+    :param path: SQLite数据库路径
+    :param level: zstd压缩级别
+    :param train_samples: 自动训练字典需要的响应条数，0 为不自动训练
+    :param dict_size: 字典大小（字节）
+    """
+
+    def __init__(self, path: str = DEFAULT_ARCHIVE_PATH, level: int = DEFAULT_LEVEL,
+                 train_samples: int = TRAIN_SAMPLES, dict_size: int = DICT_SIZE):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.level = level
+        self.train_samples = train_samples
+        self.dict_size = dict_size
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS dictionaries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                endpoint TEXT NOT NULL,
+                samples INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                data BLOB NOT NULL
+            )
+        ''')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                endpoint TEXT NOT NULL,
+                key TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                dict_id INTEGER,
+                size INTEGER NOT NULL,
+                body BLOB NOT NULL,
+                PRIMARY KEY (endpoint, key, fetched_at)
+            )
+        ''')
+        self._conn.commit()
+
+        # 字典id -> ZstdCompressionDict，各接口族当前使用的字典id
+        self._dicts: Dict[int, zstd.ZstdCompressionDict] = {}
+        self._current: Dict[str, int] = {}
+        for dict_id, endpoint, data in self._conn.execute('SELECT id, endpoint, data FROM dictionaries ORDER BY id'):
+            self._dicts[dict_id] = zstd.ZstdCompressionDict(data)
+            self._current[endpoint] = dict_id
+        for dict_id in self._current.values():
+            self._dicts[dict_id].precompute_compress(level=level)
+        # 各接口族还没有字典时，下一次尝试训练的记录数
+        self._next_train: Dict[str, int] = {}
+
+    def _dictionary(self, dict_id: int) -> zstd.ZstdCompressionDict:
+        """按id取字典，别的进程后来训练的字典从数据库中加载"""
+        trained = self._dicts.get(dict_id)
+        if trained is None:
+            with self._lock:
+                row = self._conn.execute('SELECT data FROM dictionaries WHERE id = ?', (dict_id,)).fetchone()
+            trained = self._dicts[dict_id] = zstd.ZstdCompressionDict(row[0])
+        return trained
+
+    def _compressor(self, dict_id: Optional[int]) -> zstd.ZstdCompressor:
+        # 压缩器不是线程安全的，每次新建；字典在训练时已经预先处理过，新建的开销很小
+        if dict_id is None:
+            return zstd.ZstdCompressor(level=self.level)
+        return zstd.ZstdCompressor(level=self.level, dict_data=self._dictionary(dict_id))
+
+    def _decompress(self, body: bytes, dict_id: Optional[int], size: int) -> bytes:
+        # 流式写入的记录帧头里没有原始大小，按记下的大小解压
+        if dict_id is None:
+            return zstd.ZstdDecompressor().decompress(body, max_output_size=size)
+        return zstd.ZstdDecompressor(dict_data=self._dictionary(dict_id)).decompress(body, max_output_size=size)
+
+    def put(self, endpoint: str, key: str, body: bytes, fetched_at: Optional[float] = None):
+        """压缩并保存一次响应，这个接口族攒够样本后顺便训练字典"""
+        dict_id = self._current.get(endpoint)
+        self._insert(endpoint, key, dict_id, len(body), self._compressor(dict_id).compress(body), fetched_at)
+
+    def writer(self, endpoint: str, key: str) -> 'ArchiveWriter':
+        """边下载边压缩保存一次响应，流式处理时不用把整个响应放进内存"""
+        return ArchiveWriter(self, endpoint, key)
+
+    def _insert(self, endpoint: str, key: str, dict_id: Optional[int], size: int, compressed: bytes,
+                fetched_at: Optional[float] = None):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (endpoint, key, fetched_at, dict_id, size, body) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (endpoint, str(key), fetched_at or time.time(), dict_id, size, compressed)
+            )
+            self._conn.commit()
+        if dict_id is None and self.train_samples:
+            self._maybe_train(endpoint)
+
+    def _maybe_train(self, endpoint: str):
+        with self._lock:
+            if endpoint in self._current:
+                return
+            count = self._conn.execute(
+                'SELECT COUNT(*) FROM responses WHERE endpoint = ?', (endpoint,)
+            ).fetchone()[0]
+            if count < self._next_train.get(endpoint, self.train_samples):
+                return
+            # 样本太少或太小训练不出字典时，再攒一批重试
+            self._next_train[endpoint] = count + self.train_samples
+        self.train(endpoint)
+
+    def _samples(self, endpoint: str, limit: int) -> List[bytes]:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT body, dict_id, size FROM responses WHERE endpoint = ? ORDER BY fetched_at DESC LIMIT ?',
+                (endpoint, limit)
+            ).fetchall()
+        return [self._decompress(*row) for row in rows]
+
+    def train(self, endpoint: str, samples: Optional[int] = None) -> Optional[int]:
+        """
+        用这个接口族最近的响应训练字典，之后的响应用新字典压缩
+
+        :param samples: 使用的响应条数，默认为 train_samples
+        :return: 新字典的id，训练失败返回None
+        """
+        bodies = self._samples(endpoint, samples or self.train_samples or TRAIN_SAMPLES)
+        try:
+            trained = zstd.train_dictionary(self.dict_size, bodies)
+        except zstd.ZstdError as e:
+            logger.warning(f"训练压缩字典失败: {endpoint} ({len(bodies)}条样本) {str(e)}")
+            return None
+        trained.precompute_compress(level=self.level)
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO dictionaries (endpoint, samples, created_at, data) VALUES (?, ?, ?, ?)',
+                (endpoint, len(bodies), time.time(), trained.as_bytes())
+            )
+            self._conn.commit()
+            self._dicts[cursor.lastrowid] = trained
+            self._current[endpoint] = cursor.lastrowid
+        logger.info(f"已训练压缩字典: {endpoint} ({len(bodies)}条样本, {len(trained.as_bytes())}字节)")
+        return cursor.lastrowid
+
+    def recompress(self, endpoint: str) -> int:
+        """用这个接口族当前的字典重新压缩没有用它压缩的记录，返回重新压缩的条数"""
+        dict_id = self._current.get(endpoint)
+        if dict_id is None:
+            return 0
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT key, fetched_at, dict_id, size, body FROM responses WHERE endpoint = ? AND dict_id IS NOT ?',
+                (endpoint, dict_id)
+            ).fetchall()
+        compressor = self._compressor(dict_id)
+        with self._lock:
+            for key, fetched_at, old_id, size, body in rows:
+                self._conn.execute(
+                    'UPDATE responses SET dict_id = ?, body = ? WHERE endpoint = ? AND key = ? AND fetched_at = ?',
+                    (dict_id, compressor.compress(self._decompress(body, old_id, size)), endpoint, key, fetched_at)
+                )
+            self._conn.commit()
+        return len(rows)
+
+    def get(self, endpoint: str, key: str, before: Optional[float] = None) -> Optional[bytes]:
+        """
+        读取某个键最近一次下载的原始响应
+
+        :param before: 只取这个时间（含）之前下载的记录
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT body, dict_id, size FROM responses WHERE endpoint = ? AND key = ? AND fetched_at <= ? '
+                'ORDER BY fetched_at DESC LIMIT 1',
+                (endpoint, str(key), before if before is not None else float('inf'))
+            ).fetchone()
+        if row is None:
+            return None
+        return self._decompress(*row)
+
+    def get_json(self, endpoint: str, key: str, before: Optional[float] = None) -> Optional[Dict]:
+        body = self.get(endpoint, key, before)
+        return None if body is None else json.loads(body)
+
+    def keys(self, endpoint: str) -> Iterator[str]:
+        """某个接口族存档过的全部键，按首次下载时间排序"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT key FROM responses WHERE endpoint = ? GROUP BY key ORDER BY MIN(fetched_at)', (endpoint,)
+            ).fetchall()
+        return (row[0] for row in rows)
+
+    def stats(self) -> Dict[str, Dict]:
+        """各接口族的记录数、原始/压缩后字节数、压缩比和当前字典"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT endpoint, COUNT(*), SUM(size), SUM(LENGTH(body)) FROM responses GROUP BY endpoint'
+            ).fetchall()
+        return {
+            endpoint: {
+                'responses': count,
+                'raw_bytes': raw,
+                'stored_bytes': stored,
+                'ratio': round(raw / stored, 2) if stored else None,
+                'dictionary': self._current.get(endpoint),
+            }
+            for endpoint, count, raw, stored in rows
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ArchiveWriter:
+    """RawArchive.writer 返回的流式写入器，write 压缩一块数据，commit 后才写入存档"""
+
+    def __init__(self, archive: RawArchive, endpoint: str, key: str):
+        self.archive = archive
+        self.endpoint = endpoint
+        self.key = key
+        self.dict_id = archive._current.get(endpoint)
+        self.size = 0
+        self._compressor = archive._compressor(self.dict_id).compressobj()
+        self._parts: List[bytes] = []
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        self._parts.append(self._compressor.compress(chunk))
+
+    def commit(self):
+        self._parts.append(self._compressor.flush())
+        self.archive._insert(self.endpoint, self.key, self.dict_id, self.size, b''.join(self._parts))
+        self._parts = []
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def get_archive(path: str = DEFAULT_ARCHIVE_PATH) -> RawArchive:
+    """获取进程内共享的存档，同一路径只打开一个连接"""
+    with _archives_lock:
+        archive = _archives.get(path)
+        if archive is None:
+            archive = _archives[path] = RawArchive(path)
+        return archive
+
+
+def main():
+    """
+    命令行工具
+
+        python -m utils.raw_archive stats
+        python -m utils.raw_archive train danmaku --recompress
+    """
+    parser = argparse.ArgumentParser(description='原始响应存档')
+    parser.add_argument('--archive', default=DEFAULT_ARCHIVE_PATH, help='存档数据库路径')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help='查看各接口族的记录数和压缩比')
+    train = commands.add_parser('train', help='用最近的响应重新训练某个接口族的压缩字典')
+    train.add_argument('endpoint')
+    train.add_argument('--samples', type=int, default=1000, help='使用的响应条数')
+    train.add_argument('--recompress', action='store_true', help='训练后用新字典重新压缩已有记录')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    archive = RawArchive(args.archive)
+    try:
+        if args.command == 'train':
+            if archive.train(args.endpoint, args.samples) is not None and args.recompress:
+                print(f'重新压缩: {archive.recompress(args.endpoint)}条')
+        for endpoint, item in archive.stats().items():
+            print(f'{endpoint}: {item}')
+    finally:
+        archive.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,23 @@
-import requests
+import os
 import re
-import time
-import random
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.http_client import get_client
 
 class BilibiliCrawler:
     def __init__(self, proxy=None):
         """
         初始化爬虫，增加反反爬策略
         """
+        self.http = get_client()
+        # 页面请求额外的请求头，通用请求头在 utils/http_client.py 中
         self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Referer': 'https://www.bilibili.com/',
             'Accept': 'text/html,application/xhtml+xml,application/xml',
             'Accept-Language': 'zh-CN,zh;q=0.9',
-            'Cookie': 'buvid3=123456; _uuid=randomstring'  # 添加模拟Cookie
         }
+        self.cookies = {'buvid3': '123456', '_uuid': 'randomstring'}  # 添加模拟Cookie
         self.proxy = proxy
     
     def crawl_homepage_bvs(self, count=50, max_retries=3):
@@ -42,9 +45,10 @@ class BilibiliCrawler:
                     # time.sleep(random.uniform(1, 3))
                     
                     # 发送请求获取内容
-                    response = requests.get(
+                    response = self.http.get(
                         url, 
                         headers=self.headers,
+                        cookies=self.cookies,
                         proxies=self.proxy,
                         timeout=15,
                         allow_redirects=True
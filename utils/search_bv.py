@@ -1,12 +1,44 @@
-import requests
 import csv
-from urllib.parse import quote
+import os
+import sys
 import time
-import random
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
 # import tqdm # tqdm用于显示进度条
 from tqdm import tqdm
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.http_client import get_client
+from utils.seen_set import DEFAULT_SEEN_PATH, open_seen_set
+
+SEARCH_API_URL = "https://api.bilibili.com/x/web-interface/search/type"
+
+# 搜索接口需要额外的请求头，通用请求头在 utils/http_client.py 中
+SEARCH_HEADERS = {
+    "Referer": "https://search.bilibili.com/",
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Language": "zh-CN,zh;q=0.9",
+    "Origin": "https://search.bilibili.com",
+    "Sec-Fetch-Dest": "empty",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "same-site",
+}
+
+# 保存的字段，与 convert_video 一致
+SEARCH_FIELDS = ["BV号", "标题", "作者", "播放量", "弹幕数", "发布时间", "视频链接"]
+
+# 搜索接口每页20条，最多只能翻到第50页，一个时间窗口内超出的结果要缩小窗口才能拿到
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_CAP = 50
+# 按天切分搜索的时间窗口
+DAY_SECONDS = 86400
+# 时间窗口切分到这么短（秒）就不再切分，即使仍然到了页数上限
+MIN_WINDOW_SECONDS = 60
+# 请求失败的页重新排队的次数
+SEARCH_RETRIES = 3
+
 
 def convert_to_timestamp(date_str):
     """
@@ -27,6 +59,61 @@ def convert_to_timestamp(date_str):
         return None
 
 
+def convert_video(video: Dict) -> Dict:
+    """把搜索接口返回的一条视频转换成保存的字段"""
+    return {
+        "BV号": video.get("bvid", ""),
+        "标题": video.get("title", "")
+        .replace('<em class="keyword">', "")
+        .replace("</em>", ""),
+        "作者": video.get("author", ""),
+        "播放量": video.get("play", 0),
+        "弹幕数": video.get("video_review", 0),
+        "发布时间": time.strftime(
+            "%Y-%m-%d %H:%M:%S", time.localtime(video.get("pubdate", 0))
+        ),
+        "视频链接": f"https://www.bilibili.com/video/{video.get('bvid', '')}",
+    }
+
+
+def fetch_search_page(keyword: str, start_time: int, end_time: int, page: int) -> Optional[Dict]:
+    """
+    请求一页搜索结果，限速由 search 接口族共享的限速器控制，多个线程同时调用时总速率不变
+
+    :return: 接口返回的data字段（包含 result、numPages、numResults），失败返回None
+    """
+    params = {
+        "keyword": keyword,
+        "from_source": "webtop_search",
+        "spm_id_from": "333.1007",
+        "search_source": 5,
+        "search_type": "video",
+        "page": page,
+        # "order": "pubdate",
+        "pubtime_begin_s": start_time,
+        "pubtime_end_s": end_time,
+    }
+
+    try:
+        response = get_client().get(SEARCH_API_URL, params=params, headers=SEARCH_HEADERS, endpoint="search")
+
+        if response.status_code != 200:
+            tqdm.write(f"请求失败，状态码：{response.status_code}")
+            return None
+
+        data = response.json()
+
+        if data.get("code") != 0:
+            tqdm.write(f"API返回错误：{data.get('message')}")
+            return None
+
+        return data.get("data") or {}
+
+    except Exception as e:
+        tqdm.write(f"发生错误：{e}")
+        return None
+
+
 def get_bilibili_search_results(keyword, start_time, end_time, max_pages=10):
     """
     爬取B站搜索结果
@@ -38,85 +125,202 @@ def get_bilibili_search_results(keyword, start_time, end_time, max_pages=10):
     :return: 视频信息列表
     """
 
-    encoded_keyword = quote(keyword)
-
     video_list = []
-
-    # 请求头
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36",
-        "Referer": "https://search.bilibili.com/",
-        "Accept": "application/json, text/plain, */*",
-        "Accept-Language": "zh-CN,zh;q=0.9",
-        "Cookie": "",
-        "Origin": "https://search.bilibili.com",
-        "Sec-Fetch-Dest": "empty",
-        "Sec-Fetch-Mode": "cors",
-        "Sec-Fetch-Site": "same-site",
-    }
     # tqdm用于显示进度条
     for page in tqdm(range(1, max_pages + 1)):
-    # for page in range(1, max_pages + 1):
-        # print(f"正在爬取第 {page} 页...")
-        # tqdm.write(f"正在爬取第 {page} 页...")
-        
-        url = (
-            f"https://api.bilibili.com/x/web-interface/search/type?"
-            f"keyword={encoded_keyword}"
-            f"&from_source=webtop_search&spm_id_from=333.1007&search_source=5"
-            f"&search_type=video"
-            f"&page={page}"
-            # f"&order=pubdate"
-            f"&pubtime_begin_s={start_time}"
-            f"&pubtime_end_s={end_time}"
-        )
-        # print(url)
-        
-        try:
-            response = requests.get(url, headers=headers)
-
-            if response.status_code != 200:
-                print(f"请求失败，状态码：{response.status_code}")
-                break
-
-            data = response.json()
-
-            if data.get("code") != 0:
-                print(f"API返回错误：{data.get('message')}")
-                break
-
-            results = data.get("data", {}).get("result", [])
-
-            if not results:
-                print(f"at page {page} no results")
-                break
-
-            for video in results:
-                video_info = {
-                    "BV号": video.get("bvid", ""),
-                    "标题": video.get("title", "")
-                    .replace('<em class="keyword">', "")
-                    .replace("</em>", ""),
-                    "作者": video.get("author", ""),
-                    "播放量": video.get("play", 0),
-                    "弹幕数": video.get("video_review", 0),
-                    "发布时间": time.strftime(
-                        "%Y-%m-%d %H:%M:%S", time.localtime(video.get("pubdate", 0))
-                    ),
-                    "视频链接": f"https://www.bilibili.com/video/{video.get('bvid', '')}",
-                }
-                video_list.append(video_info)
-
-            # 随机延时，避免被封
-            time.sleep(random.uniform(1, 3))
-
-        except Exception as e:
-            print(f"发生错误：{e}")
+        data = fetch_search_page(keyword, start_time, end_time, page)
+        if data is None:
+            break
+
+        results = data.get("result", [])
+
+        if not results:
+            print(f"at page {page} no results")
             break
 
+        video_list += [convert_video(video) for video in results]
+
+    return video_list
+
+
+def day_windows(start_time: int, end_time: int, window: int = DAY_SECONDS) -> List[Tuple[int, int]]:
+    """把时间范围切成首尾相接、互不重叠的时间窗口（两端都包含）"""
+    return [(begin, min(begin + window - 1, end_time)) for begin in range(start_time, end_time + 1, window)]
+
+
+def split_window(start_time: int, end_time: int) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """把时间窗口对半切开"""
+    middle = (start_time + end_time) // 2
+    return (start_time, middle), (middle + 1, end_time)
+
+
+def iter_search_pages(keyword: str, windows: List[Tuple[int, int]], workers: int = 4,
+                      page_cap: int = SEARCH_PAGE_CAP, min_window: int = MIN_WINDOW_SECONDS,
+                      retries: int = SEARCH_RETRIES, stats: Optional[Dict] = None) -> Iterator[List[Dict]]:
+    """
+    并发爬取多个时间窗口的搜索结果，按完成顺序逐页产出视频信息列表
+
+    每个窗口先请求第1页拿到 numPages，之后的页并发请求；第1页就到了页数上限的窗口
+    说明结果被截断，对半切开后重新搜索，直到每个窗口都在上限以内。
+    所有请求共用 search 限速器，workers 只决定同时等待响应的请求数。
+    待请求的页先放在队列里，最多 2*workers 个交给线程池，结果逐页交出，内存与总页数无关。
+    请求失败的页重新排到队尾，重试 retries 次仍然失败时打印缺失的时间窗口和页码。
+
+    :param windows: 时间窗口列表，每个为 (开始时间戳, 结束时间戳)，两端都包含
+    :param workers: 并发请求数
+    :param page_cap: 搜索接口最多能翻到的页数
+    :param min_window: 窗口跨度（秒）不超过这个值时不再切分
+    :param retries: 请求失败的页最多重试的次数
+    :param stats: 传入字典时记录 requests、split、truncated、retried、failed 次数，
+                  missing 为最终失败的 (时间窗口, 页码) 列表，第1页失败意味着整个窗口缺失
+    """
+    stats = stats if stats is not None else {}
+    for key in ('requests', 'split', 'truncated', 'retried', 'failed'):
+        stats.setdefault(key, 0)
+    stats.setdefault('missing', [])
+
+    with ThreadPoolExecutor(max_workers=workers) as pool, tqdm(total=len(windows), unit="页") as pbar:
+        pending = {}
+        # 待请求的页: (时间窗口, 页码, 已失败次数)
+        queue = deque((window, 1, 0) for window in windows)
+
+        def enqueue(window, page, failures=0):
+            queue.append((window, page, failures))
+
+        while queue or pending:
+            while queue and len(pending) < 2 * workers:
+                window, page, failures = queue.popleft()
+                pending[pool.submit(fetch_search_page, keyword, window[0], window[1], page)] = (window, page, failures)
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                window, page, failures = pending.pop(future)
+                data = future.result()
+                stats['requests'] += 1
+                pbar.update()
+                if data is None:
+                    if failures < retries:
+                        stats['retried'] += 1
+                        enqueue(window, page, failures + 1)
+                        pbar.total += 1
+                        pbar.refresh()
+                        continue
+                    stats['failed'] += 1
+                    stats['missing'].append((window, page))
+                    lost = '整个窗口的结果' if page == 1 else f'第{page}页的结果'
+                    tqdm.write(f"时间窗口 {window[0]}-{window[1]} 第{page}页重试{retries}次仍然失败，{lost}缺失")
+                    continue
+
+                if page == 1:
+                    num_pages = data.get("numPages") or 0
+                    if num_pages >= page_cap and window[1] - window[0] + 1 > min_window:
+                        stats['split'] += 1
+                        for half in split_window(*window):
+                            enqueue(half, 1)
+                        pbar.total += 2
+                        pbar.refresh()
+                        continue
+                    if num_pages >= page_cap:
+                        stats['truncated'] += 1
+                        tqdm.write(f"时间窗口 {window[0]}-{window[1]} 已不能再切分，结果可能不完整")
+                    for following in range(2, min(num_pages, page_cap) + 1):
+                        enqueue(window, following)
+                    pbar.total += max(min(num_pages, page_cap) - 1, 0)
+                    pbar.refresh()
+
+                results = data.get("result") or []
+                if results:
+                    yield [convert_video(video) for video in results]
+
+
+def search_videos(keyword: str, start_time: int, end_time: int, workers: int = 4,
+                  window: int = DAY_SECONDS, stats: Optional[Dict] = None) -> List[Dict]:
+    """
+    按天切分时间范围并发搜索，到了页数上限的窗口自动切小，返回全部视频信息
+
+    :param window: 初始时间窗口的跨度（秒）
+    """
+    video_list = []
+    for videos in iter_search_pages(keyword, day_windows(start_time, end_time, window), workers, stats=stats):
+        video_list += videos
     return video_list
 
 
+class SearchResultWriter:
+    """
+    逐页追加写出搜索结果，已写出过的BV号由持久化的已见集合过滤掉
+
+    每页写完立即刷到磁盘，再把BV号记为已见；进程中途崩溃时已写出的结果不会丢，
+    重新运行也不会重复写出。
+
+    :param csv_file: 视频信息CSV文件，已存在时在后面追加
+    :param bv_file: BV号txt文件，已存在时在后面追加
+    :param seen: 已见集合，跨时间窗口、关键词和多次运行共用
+    """
+
+    def __init__(self, csv_file: str, bv_file: str, seen):
+        for path in (csv_file, bv_file):
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+        self.seen = seen
+        self.written = 0
+        self.duplicates = 0
+        new_csv = not os.path.exists(csv_file) or os.path.getsize(csv_file) == 0
+        self._csv_file = open(csv_file, "a", newline="", encoding="utf-8-sig")
+        self._writer = None if new_csv else csv.DictWriter(self._csv_file, SEARCH_FIELDS)
+        self._bv_file = open(bv_file, "a", encoding="utf-8")
+
+    def write(self, video_list: List[Dict]) -> int:
+        """写出一页中没见过的视频，返回写出的条数"""
+        new = set(self.seen.unseen(video["BV号"] for video in video_list))
+        videos = []
+        for video in video_list:
+            if video["BV号"] in new:
+                videos.append(video)
+                new.discard(video["BV号"])
+        self.duplicates += len(video_list) - len(videos)
+        if not videos:
+            return 0
+
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._csv_file, SEARCH_FIELDS)
+            self._writer.writeheader()
+        self._writer.writerows(videos)
+        self._bv_file.writelines(f"{video['BV号']}\n" for video in videos)
+        self._csv_file.flush()
+        self._bv_file.flush()
+        self.seen.add(video["BV号"] for video in videos)
+        self.written += len(videos)
+        return len(videos)
+
+    def close(self):
+        self._csv_file.close()
+        self._bv_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def crawl_to_files(keyword: str, start_time: int, end_time: int, csv_file: str, bv_file: str, seen,
+                   workers: int = 4, window: int = DAY_SECONDS, stats: Optional[Dict] = None) -> int:
+    """
+    按天切分时间范围并发搜索，逐页去重后追加写入CSV和txt，返回新写出的视频数
+
+    :param seen: 已见集合，见 utils/seen_set.py
+    :param stats: 传入字典时除了 iter_search_pages 的统计，还记录 written、duplicates
+    """
+    stats = stats if stats is not None else {}
+    with SearchResultWriter(csv_file, bv_file, seen) as writer:
+        for videos in iter_search_pages(keyword, day_windows(start_time, end_time, window), workers, stats=stats):
+            writer.write(videos)
+    stats['written'] = writer.written
+    stats['duplicates'] = writer.duplicates
+    return writer.written
+
+
 def save_to_csv(video_list, filename="bilibili_videos.csv"):
     """
     保存视频信息到CSV文件
@@ -159,33 +363,33 @@ def main():
     keyword = "的"
     start_time_str = "2024-11-01 00:00:00"
     end_time_str = "2024-11-27 23:59:59"
-    max_pages = 100
+    workers = 4
 
     start_time = convert_to_timestamp(start_time_str)-8*60*60 # 实验发现是按照utc-8时间来计算的
     end_time = convert_to_timestamp(end_time_str)-8*60*60
     
     print(f"开始时间：{start_time}, {start_time_str}")
     print(f"结束时间：{end_time}, {end_time_str}")
-    print(f"最大页数：{max_pages}")
+    print(f"并发请求数：{workers}")
 
     # 检查时间转换是否成功
     if start_time is None or end_time is None:
         return
 
-    # video_list = get_bilibili_search_results(keyword, start_time, end_time, max_pages)
-
-    video_list = []
-    
-    # for time_stride in range(start_time, end_time, 86400):
-
-    # tqdm
-    for time_stride in tqdm(range(start_time, end_time, 86400)):
-        video_list += get_bilibili_search_results(keyword, time_stride, time_stride+86400, max_pages)
-
-
-    print(f"共找到 {len(video_list)} 个视频")
-    save_to_csv(video_list, f"results/keyword_'{keyword}'_bilibili_videos.csv")
-    save_bv_to_txt(video_list, f"results/keyword_'{keyword}'_bilibili_bv.txt")
+    # 按天切分的时间窗口并发搜索，某天结果超过页数上限时自动切成更小的窗口；
+    # 每页结果去重后直接追加到文件，已见过的BV号记录在 results/search_seen.sqlite3，跨关键词和多次运行共用
+    stats = {}
+    seen = open_seen_set(DEFAULT_SEEN_PATH)
+    try:
+        crawl_to_files(keyword, start_time, end_time, f"results/keyword_'{keyword}'_bilibili_videos.csv",
+                       f"results/keyword_'{keyword}'_bilibili_bv.txt", seen, workers, stats=stats)
+    finally:
+        seen.close()
+
+    print(f"新写出 {stats['written']} 个视频，跳过重复 {stats['duplicates']} 个，请求 {stats['requests']} 次，"
+          f"切分窗口 {stats['split']} 次，重试 {stats['retried']} 次，失败 {stats['failed']} 次")
+    for (begin, end), page in stats['missing']:
+        print(f"缺失：{datetime.fromtimestamp(begin)} ~ {datetime.fromtimestamp(end)} 第{page}页")
 
 
 if __name__ == "__main__":
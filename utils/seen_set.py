@@ -0,0 +1,162 @@
+import hashlib
+import math
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+from typing import Iterable, List, Union
+
+DEFAULT_SEEN_PATH = 'results/search_seen.sqlite3'
+
+# 布隆过滤器文件头：魔数、位数、哈希函数个数、已加入的条目数
+_BLOOM_MAGIC = b'BLM1'
+_BLOOM_HEADER = struct.Struct('<4sQIQ')
+
+
+def _unique(keys: Iterable[str]) -> List[str]:
+    """去掉同一批中的重复键，保持原来的顺序"""
+    return list(dict.fromkeys(keys))
+
+
+class SeenSet:
+    """
+    持久化的已见集合，SQLite中以键为主键的表，相当于一个磁盘上的哈希集合
+
+    跨时间窗口、关键词和多次运行去重，内存占用与已见条目数无关。
+    先用 unseen 找出新条目，写完输出后再 add，进程在两步之间崩溃时下次只会重复写出，不会漏掉。
+
+    :param path: SQLite数据库路径
+    """
+
+    def __init__(self, path: str = DEFAULT_SEEN_PATH):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS seen (
+                key TEXT PRIMARY KEY,
+                first_seen REAL NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        self._conn.commit()
+
+    def unseen(self, keys: Iterable[str]) -> List[str]:
+        """一批键中还没见过的，保持原来的顺序"""
+        keys = _unique(keys)
+        if not keys:
+            return []
+        with self._lock:
+            placeholders = ','.join('?' * len(keys))
+            seen = {row[0] for row in self._conn.execute(
+                f'SELECT key FROM seen WHERE key IN ({placeholders})', keys)}
+        return [key for key in keys if key not in seen]
+
+    def add(self, keys: Iterable[str]):
+        """把一批键记为已见"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany('INSERT OR IGNORE INTO seen (key, first_seen) VALUES (?, ?)',
+                                   ((key, now) for key in keys))
+            self._conn.commit()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM seen WHERE key = ?', (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class BloomSeenSet:
+    """
+    布隆过滤器实现的已见集合，位数组用mmap映射到文件，适合上亿条目的超大规模运行
+
+    占用的磁盘和内存只由 capacity 和 error_rate 决定；代价是会以 error_rate 的概率
+    把没见过的键误判为已见（漏掉），不会把见过的键判为没见过。
+    位数组的修改直接落在页缓存中，进程崩溃不会丢失，close 时再刷到磁盘。
+
+    :param path: 位数组文件路径，已存在时沿用文件中的参数
+    :param capacity: 预计的条目数
+    :param error_rate: 达到 capacity 时的误判率
+    """
+
+    def __init__(self, path: str, capacity: int = 10_000_000, error_rate: float = 1e-4):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self._lock = threading.Lock()
+        if not os.path.exists(path):
+            bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+            hashes = max(1, round(bits / capacity * math.log(2)))
+            with open(path, 'wb') as f:
+                f.write(_BLOOM_HEADER.pack(_BLOOM_MAGIC, bits, hashes, 0))
+                f.truncate(_BLOOM_HEADER.size + (bits + 7) // 8)
+
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, self.bits, self.hashes, self.count = _BLOOM_HEADER.unpack_from(self._map, 0)
+        if magic != _BLOOM_MAGIC:
+            raise ValueError(f'不是布隆过滤器文件: {path}')
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        # 双重哈希模拟 k 个独立的哈希函数
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def _test(self, key: str) -> bool:
+        offset = _BLOOM_HEADER.size
+        return all(self._map[offset + pos // 8] >> (pos % 8) & 1 for pos in self._positions(key))
+
+    def unseen(self, keys: Iterable[str]) -> List[str]:
+        """一批键中还没见过的，保持原来的顺序"""
+        with self._lock:
+            return [key for key in _unique(keys) if not self._test(key)]
+
+    def add(self, keys: Iterable[str]):
+        """把一批键记为已见"""
+        offset = _BLOOM_HEADER.size
+        with self._lock:
+            for key in keys:
+                if self._test(key):
+                    continue
+                for pos in self._positions(key):
+                    self._map[offset + pos // 8] |= 1 << (pos % 8)
+                self.count += 1
+            _BLOOM_HEADER.pack_into(self._map, 0, _BLOOM_MAGIC, self.bits, self.hashes, self.count)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return self._test(key)
+
+    def __len__(self) -> int:
+        """加入过的条目数（近似，误判为已见的键不计入）"""
+        return self.count
+
+    def close(self):
+        with self._lock:
+            self._map.flush()
+            self._map.close()
+            self._file.close()
+
+
+def open_seen_set(path: str = DEFAULT_SEEN_PATH, **kwargs) -> Union[SeenSet, BloomSeenSet]:
+    """按文件扩展名打开已见集合：.bloom 为布隆过滤器，其他为SQLite"""
+    if path.endswith('.bloom'):
+        return BloomSeenSet(path, **kwargs)
+    return SeenSet(path)
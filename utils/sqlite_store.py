@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from itertools import islice
+from typing import Dict, Iterable, Optional
+
+DEFAULT_STORE_PATH = 'results/bilibili.sqlite3'
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS videos (
+        bvid TEXT PRIMARY KEY,
+        title TEXT,
+        info TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS danmaku (
+        dmid INTEGER PRIMARY KEY,
+        bvid TEXT NOT NULL,
+        page INTEGER,
+        part TEXT,
+        time REAL,
+        type INTEGER,
+        size INTEGER,
+        color INTEGER,
+        timestamp INTEGER,
+        pool INTEGER,
+        user_hash TEXT,
+        content TEXT,
+        first_seen REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_danmaku_bvid ON danmaku(bvid);
+    CREATE INDEX IF NOT EXISTS idx_danmaku_timestamp ON danmaku(timestamp);
+    CREATE INDEX IF NOT EXISTS idx_danmaku_user ON danmaku(user_hash);
+    CREATE TABLE IF NOT EXISTS comments (
+        rpid INTEGER PRIMARY KEY,
+        bvid TEXT NOT NULL,
+        mid INTEGER,
+        user TEXT,
+        content TEXT,
+        likes INTEGER,
+        reply_time TEXT,
+        root INTEGER,
+        parent INTEGER,
+        first_seen REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_comments_bvid ON comments(bvid);
+    CREATE INDEX IF NOT EXISTS idx_comments_reply_time ON comments(reply_time);
+    CREATE INDEX IF NOT EXISTS idx_comments_user ON comments(mid);
+'''
+
+# 建表之后新增的列，旧数据库打开时补上: (表, 列, 类型)
+_ADDED_COLUMNS = [
+    ('comments', 'root', 'INTEGER'),
+    ('comments', 'parent', 'INTEGER'),
+]
+
+_INDEXES = '''
+    CREATE INDEX IF NOT EXISTS idx_comments_root ON comments(root);
+'''
+
+# 弹幕发出后不会变，已有的dmid直接跳过
+_INSERT_DANMAKU = '''
+    INSERT INTO danmaku (dmid, bvid, page, part, time, type, size, color, timestamp, pool, user_hash, content, first_seen)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(dmid) DO NOTHING
+'''
+
+# 评论的点赞数会变，已有的rpid只在点赞数变化时更新
+_UPSERT_COMMENT = '''
+    INSERT INTO comments (rpid, bvid, mid, user, content, likes, reply_time, root, parent, first_seen)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(rpid) DO UPDATE SET likes = excluded.likes WHERE likes != excluded.likes
+'''
+
+# 同一个视频的弹幕爬虫和评论爬虫各写一部分视频信息，合并保存
+_UPSERT_VIDEO = '''
+    INSERT INTO videos (bvid, title, info, updated_at) VALUES (?, ?, ?, ?)
+    ON CONFLICT(bvid) DO UPDATE SET
+        title = excluded.title, info = json_patch(videos.info, excluded.info), updated_at = excluded.updated_at
+'''
+
+
+class SQLiteStore:
+    """
+    弹幕和评论的嵌入式数据库存储，弹幕爬虫和评论爬虫共用
+
+    弹幕按dmid、评论按rpid去重，重复爬取只会写入新增的行；
+    bvid、时间和用户列都有索引，跨视频查询不需要打开大量文件。
+
+    :param path: SQLite数据库路径
+    :param batch_size: 每批executemany的行数，每批单独在一个事务中提交
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH, batch_size: int = 5000):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        for table, column, column_type in _ADDED_COLUMNS:
+            columns = {row[1] for row in self._conn.execute(f'PRAGMA table_info({table})')}
+            if column not in columns:
+                self._conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+        self._conn.executescript(_INDEXES)
+        self._conn.commit()
+
+    def _write(self, sql: str, rows: Iterable[tuple], video_info: Dict) -> int:
+        """
+        分批写入一个视频的行，返回实际新增或更新的行数
+
+        rows 可能是边下载边解析的生成器，每批先在锁外取出，再加锁在一个事务中提交，
+        不会在持有写锁和打开事务时等待网络。中途失败时已提交的批次保留，
+        弹幕和评论都按主键去重，重新写入不会重复。
+        """
+        rows = iter(rows)
+        video_row = (video_info['bvid'], video_info.get('title'),
+                     json.dumps(video_info, ensure_ascii=False), time.time())
+        changes = 0
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            with self._lock:
+                before = self._conn.total_changes
+                with self._conn:
+                    # 视频信息随第一批写入，不计入返回的行数
+                    if video_row is not None:
+                        self._conn.execute(_UPSERT_VIDEO, video_row)
+                        before += 1
+                    self._conn.executemany(sql, batch)
+                changes += self._conn.total_changes - before
+            video_row = None
+            if len(batch) < self.batch_size:
+                return changes
+
+    def save_danmaku(self, video_info: Dict, comments: Iterable[Dict], info: Optional[Dict] = None) -> int:
+        """
+        写入一个视频的弹幕，comments可以是生成器；没有dmid的弹幕无法去重，跳过并记录日志
+
+        :param info: 弹幕XML的头部字段，合并到视频信息中保存
+        :return: 新增的弹幕数
+        """
+        now = time.time()
+        bvid = video_info['bvid']
+        skipped = 0
+
+        def danmaku_rows():
+            nonlocal skipped
+            for c in comments:
+                try:
+                    dmid = int(c['dmid'])
+                except (KeyError, TypeError, ValueError):
+                    skipped += 1
+                    continue
+                yield (dmid, bvid, c.get('page'), c.get('part'), c['time'], c['type'], c['size'],
+                       c['color'], c['timestamp'], c['pool'], c['user_hash'], c['content'], now)
+
+        if info:
+            video_info = dict(video_info, danmaku_info=info)
+        added = self._write(_INSERT_DANMAKU, danmaku_rows(), video_info)
+        if skipped:
+            logger.warning(f"跳过{skipped}条没有有效dmid的弹幕: {bvid}")
+        return added
+
+    def save_comments(self, video_info: Dict, comments: Iterable[Dict]) -> int:
+        """
+        写入一个视频的评论
+
+        :return: 新增的评论数加上点赞数有变化的评论数
+        """
+        now = time.time()
+        bvid = video_info['bvid']
+        rows = ((int(c['rpid']), bvid, int(c['mid']) if c.get('mid') else None, c['user'], c['content'],
+                 c['likes'], c['reply_time'], int(c['root']) if c.get('root') else None,
+                 int(c['parent']) if c.get('parent') else None, now)
+                for c in comments)
+        return self._write(_UPSERT_COMMENT, rows, video_info)
+
+    def stats(self) -> Dict[str, int]:
+        """各表的行数"""
+        with self._lock:
+            return {
+                table: self._conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in ('videos', 'danmaku', 'comments')
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path: str = DEFAULT_STORE_PATH) -> SQLiteStore:
+    """获取进程内共享的存储，同一路径只打开一个连接"""
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = SQLiteStore(path)
+        return store
@@ -0,0 +1,46 @@
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+
+class TaskOutcome:
+    """一个视频处理期间最近一条错误日志和被风控的次数，作为断点日志/队列中的失败原因"""
+
+    def __init__(self):
+        self.error: Optional[str] = None
+        self.throttled = 0
+
+
+_current: contextvars.ContextVar[Optional[TaskOutcome]] = contextvars.ContextVar('crawl_task', default=None)
+
+
+def current_task() -> Optional[TaskOutcome]:
+    """当前正在处理的视频，不在 task_scope 中时为None"""
+    return _current.get()
+
+
+@contextmanager
+def task_scope() -> Iterator[TaskOutcome]:
+    """
+    处理一个视频期间的错误和风控都记到返回的 TaskOutcome 上
+
+    基于contextvars，协程并发处理多个视频时各记各的；子协程自动继承，
+    交给线程池的函数需要用 bind 包一层才能带上调用方的上下文。
+    """
+    outcome = TaskOutcome()
+    token = _current.set(outcome)
+    try:
+        yield outcome
+    finally:
+        _current.reset(token)
+
+
+def bind(func: Callable) -> Callable:
+    """在调用方当前上下文中运行func，用于 executor.submit/map 和 run_in_executor"""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # 同一个上下文不能被多个线程同时进入，每次调用用一份副本，副本中的 TaskOutcome 是同一个对象
+        return context.copy().run(func, *args, **kwargs)
+
+    return run
@@ -1,10 +1,15 @@
 import requests
+import os
 import re
+import sys
 import json
 import logging
 from typing import Optional, Dict, Union, Tuple
 from urllib.parse import parse_qs, urlparse
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from utils.video_cache import get_video_cache
+
 class BilibiliCIDFetcher:
     def __init__(self):
         """初始化CID获取器"""
@@ -40,35 +45,41 @@ class BilibiliCIDFetcher:
             return url
         return None
 
+    def fetch_view(self, bvid: str) -> Optional[Dict]:
+        """请求视频信息接口"""
+        params = {'bvid': bvid}
+        response = requests.get(
+            self.api_url,
+            params=params,
+            headers=self.headers,
+            timeout=10
+        )
+        
+        if response.status_code == 200:
+            data = response.json()
+            if data['code'] == 0 and 'data' in data:
+                return data['data']
+        
+        self.logger.error(f"API请求失败: {response.status_code}")
+        return None
+
     def get_cid_from_api(self, bvid: str) -> Optional[Dict]:
-        """通过API获取CID"""
+        """通过API获取CID，结果与弹幕/评论爬虫共用同一份视频信息缓存"""
         try:
-            params = {'bvid': bvid}
-            response = requests.get(
-                self.api_url,
-                params=params,
-                headers=self.headers,
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data['code'] == 0 and 'data' in data:
-                    video_data = data['data']
-                    # 获取所有分P的信息
-                    pages = video_data['pages']
-                    result = {
-                        'title': video_data['title'],
-                        'pages': [{
-                            'cid': page['cid'],
-                            'page': page['page'],
-                            'part': page['part']
-                        } for page in pages]
-                    }
-                    return result
-            
-            self.logger.error(f"API请求失败: {response.status_code}")
-            return None
+            video_data = get_video_cache().get_or_fetch(bvid, self.fetch_view, fields=('title', 'pages'))
+            if video_data is None:
+                return None
+            # 获取所有分P的信息
+            pages = video_data['pages']
+            result = {
+                'title': video_data['title'],
+                'pages': [{
+                    'cid': page['cid'],
+                    'page': page['page'],
+                    'part': page['part']
+                } for page in pages]
+            }
+            return result
             
         except Exception as e:
             self.logger.error(f"获取CID时发生错误: {str(e)}")
@@ -1,7 +1,12 @@
-import requests
+from requests.exceptions import RequestException
 import json
+import os
+import sys
 from datetime import datetime
-import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.http_client import get_client
+from utils.video_cache import get_video_cache
 
 def get_video_info(bv_number):
     """
@@ -13,13 +18,11 @@ def get_video_info(bv_number):
     """
     # 构建API URL
     url = f'https://api.bilibili.com/x/web-interface/view?bvid={bv_number}'
-    
-    try:
+    api_error = {}
+
+    def fetch_view(bvid):
         # 发送请求
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers)
+        response = get_client().get(url, endpoint='view')
         response.raise_for_status()
         
         # 解析JSON响应
@@ -27,12 +30,19 @@ def get_video_info(bv_number):
         
         # 检查API返回状态
         if data['code'] != 0:
+            api_error['message'] = data['message']
+            return None
+        return data['data']
+    
+    try:
+        # 播放量等统计数据需要较新的缓存
+        video_data = get_video_cache().get_or_fetch(
+            bv_number, fetch_view, fields=('title', 'pubdate', 'owner', 'stat')
+        )
+        if video_data is None:
             return {
-                'error': f"API返回错误: {data['message']}"
+                'error': f"API返回错误: {api_error.get('message')}"
             }
-            
-        # 提取视频信息
-        video_data = data['data']
         
         # 将时间戳转换为可读格式
         publish_time = datetime.fromtimestamp(video_data['pubdate'])
@@ -50,7 +60,7 @@ def get_video_info(bv_number):
             'favorite_count': video_data['stat']['favorite']
         }
         
-    except requests.exceptions.RequestException as e:
+    except RequestException as e:
         return {
             'error': f"网络请求错误: {str(e)}"
         }
@@ -81,8 +91,7 @@ def process_video_list(input_file):
                 'bv': bv,
                 'info': info
             })
-            # 添加延时避免请求过快
-            time.sleep(1)
+            # 请求速率由 view 接口的自适应限速器控制
             
         # 将结果保存到文件
         with open('results/video_info_results.json', 'w', encoding='utf-8') as f:
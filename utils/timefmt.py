@@ -0,0 +1,54 @@
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# 一天内每分钟的 'HH:MM:' 和每秒的 'SS'，拼接代替逐行strftime
+_CLOCK = tuple(f'{hour:02d}:{minute:02d}:' for hour in range(24) for minute in range(60))
+_SECONDS = tuple(f'{second:02d}' for second in range(60))
+
+
+class TimestampFormatter:
+    """
+    把Unix时间戳格式化为本地时间 '%Y-%m-%d %H:%M:%S'，结果与 datetime.fromtimestamp(ts).strftime 完全一致
+
+    按本地日期缓存 'YYYY-mm-dd ' 前缀和当天0点的时间戳，同一天内的时间戳只需要做整数运算和字符串拼接。
+    只缓存当天时区偏移不变的日期，夏令时切换的那天、非整数时间戳仍然逐个调用strftime。
+    """
+
+    def __init__(self):
+        # UTC日期序号 -> 与这一天有重叠的本地日期 [(当天0点, 次日0点, 日期前缀)]
+        self._days: Dict[int, List[Tuple[int, int, str]]] = {}
+
+    def _register(self, ts: int) -> Optional[Tuple[int, int, str]]:
+        t = time.localtime(ts)
+        lo = ts - (t.tm_hour * 3600 + t.tm_min * 60 + t.tm_sec)
+        hi = lo + 86400
+        # 当天首尾都要对得上，说明这一天没有时区偏移变化
+        start, end = time.localtime(lo), time.localtime(hi - 1)
+        if (start.tm_hour, start.tm_min, start.tm_sec) != (0, 0, 0) or \
+                (end.tm_hour, end.tm_min, end.tm_sec) != (23, 59, 59) or start.tm_yday != end.tm_yday:
+            return None
+        entry = (lo, hi, time.strftime('%Y-%m-%d ', t))
+        for day in {lo // 86400, (hi - 1) // 86400}:
+            self._days.setdefault(day, []).append(entry)
+        return entry
+
+    def __call__(self, ts) -> str:
+        if type(ts) is int:
+            for lo, hi, prefix in self._days.get(ts // 86400, ()):
+                if lo <= ts < hi:
+                    minute, second = divmod(ts - lo, 60)
+                    return prefix + _CLOCK[minute] + _SECONDS[second]
+            entry = self._register(ts)
+            if entry:
+                minute, second = divmod(ts - entry[0], 60)
+                return entry[2] + _CLOCK[minute] + _SECONDS[second]
+        return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+
+    def clear(self):
+        """清空缓存，修改了进程时区（time.tzset）之后需要调用"""
+        self._days.clear()
+
+
+# 进程内共享的格式化器，弹幕和评论的CSV写入共用
+format_timestamp = TimestampFormatter()
@@ -0,0 +1,253 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+# 各字段的有效期（秒），None 表示永不过期。cid/aid/标题/分P 基本不会变，播放量等统计数据变化很快
+FIELD_TTL = {
+    'bvid': None,
+    'aid': None,
+    'cid': None,
+    'title': None,
+    'pages': None,
+    'pubdate': None,
+    'owner': 7 * 86400,
+    'stat': 3600,
+}
+# 未列出的字段默认有效期
+DEFAULT_TTL = 86400
+
+DEFAULT_CACHE_PATH = 'results/video_cache.sqlite3'
+
+
+class _Flight:
+    """正在进行中的一次查询，同一个bvid的并发查询共享它的结果"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class VideoCache:
+    """
+    /x/web-interface/view 接口的本地持久化缓存
+
+    以bvid为键保存完整的视频信息，弹幕爬虫、评论爬虫和各个工具脚本共用，
+    同一个视频只需要请求一次接口。
+
+    :param path: SQLite数据库路径
+    :param max_entries: 最大缓存条数，超出后按最近访问时间淘汰（LRU）
+    :param field_ttl: 覆盖默认的字段有效期
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 200000,
+                 field_ttl: Optional[Dict[str, Optional[float]]] = None):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.field_ttl = dict(FIELD_TTL)
+        if field_ttl:
+            self.field_ttl.update(field_ttl)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS videos (
+                bvid TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_videos_last_access ON videos(last_access)')
+        self._conn.commit()
+
+        self._inflight = {}
+        self._async_inflight = {}
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.coalesced = 0
+
+    def _ttl(self, fields: Iterable[str]) -> Optional[float]:
+        """需要的字段中最短的有效期"""
+        ttls = [self.field_ttl.get(field, DEFAULT_TTL) for field in fields]
+        ttls = [ttl for ttl in ttls if ttl is not None]
+        return min(ttls) if ttls else None
+
+    def get(self, bvid: str, fields: Iterable[str] = ('cid', 'title')) -> Optional[Dict]:
+        """
+        读取缓存
+
+        :param fields: 调用方需要的字段，决定缓存是否还新鲜
+        :return: 完整的视频信息，未命中或已过期时返回None
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT payload, fetched_at FROM videos WHERE bvid = ?', (bvid,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            ttl = self._ttl(fields)
+            if ttl is not None and now - row[1] > ttl:
+                self.misses += 1
+                self.stale += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute('UPDATE videos SET last_access = ? WHERE bvid = ?', (now, bvid))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, bvid: str, payload: Dict):
+        """写入缓存"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO videos (bvid, payload, fetched_at, last_access) VALUES (?, ?, ?, ?)',
+                (bvid, json.dumps(payload, ensure_ascii=False), now, now)
+            )
+            self._puts += 1
+            # 每写入一批检查一次容量，避免每次都COUNT
+            if self._puts % 1000 == 0:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """超出容量时淘汰最久未访问的记录"""
+        count = self._conn.execute('SELECT COUNT(*) FROM videos').fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                'DELETE FROM videos WHERE bvid IN '
+                '(SELECT bvid FROM videos ORDER BY last_access LIMIT ?)', (excess,)
+            )
+
+    def get_or_fetch(self, bvid: str, loader: Callable[[str], Optional[Dict]],
+                     fields: Iterable[str] = ('cid', 'title')) -> Optional[Dict]:
+        """
+        先查缓存，未命中时调用loader请求接口
+
+        多个线程同时查询同一个bvid时只有一个会真正调用loader，其余等待并共享结果。
+
+        :param loader: 请求接口的函数，返回视频信息（view接口的data字段），失败返回None
+        """
+        payload = self.get(bvid, fields)
+        if payload is not None:
+            return payload
+
+        with self._lock:
+            flight = self._inflight.get(bvid)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[bvid] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = loader(bvid)
+            if flight.result is not None:
+                self.put(bvid, flight.result)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[bvid]
+            flight.event.set()
+        return flight.result
+
+    async def get_or_fetch_async(self, bvid: str, loader: Callable[[str], Awaitable[Optional[Dict]]],
+                                 fields: Iterable[str] = ('cid', 'title')) -> Optional[Dict]:
+        """get_or_fetch 的协程版本，同一事件循环内的并发查询合并为一次请求"""
+        payload = self.get(bvid, fields)
+        if payload is not None:
+            return payload
+
+        future = self._async_inflight.get(bvid)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._async_inflight[bvid] = future
+        try:
+            result = await loader(bvid)
+            if result is not None:
+                self.put(bvid, result)
+            future.set_result(result)
+        except Exception as e:
+            future.set_exception(e)
+            # 标记异常已被读取，没有其他等待者时也不会产生告警
+            future.exception()
+            raise
+        finally:
+            del self._async_inflight[bvid]
+        return result
+
+    def known(self, bvids: Iterable[str]) -> Set[str]:
+        """bvids 中已经在缓存里的（不论是否过期），按批查询"""
+        bvids = list(bvids)
+        found = set()
+        with self._lock:
+            for start in range(0, len(bvids), 500):
+                chunk = bvids[start:start + 500]
+                found.update(row[0] for row in self._conn.execute(
+                    f'SELECT bvid FROM videos WHERE bvid IN ({",".join("?" * len(chunk))})', chunk))
+        return found
+
+    def aid_timeline(self) -> List[Tuple[int, int]]:
+        """缓存中所有视频的 (发布时间, aid)，按发布时间排序"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT json_extract(payload, '$.pubdate'), json_extract(payload, '$.aid') FROM videos"
+            ).fetchall()
+        return sorted((int(pubdate), int(aid)) for pubdate, aid in rows if pubdate and aid)
+
+    def stats(self) -> Dict[str, int]:
+        """命中统计"""
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM videos').fetchone()[0]
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'coalesced': self.coalesced,
+            'entries': entries,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_video_cache() -> VideoCache:
+    """获取进程内共享的默认缓存"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = VideoCache()
+        return _default_cache
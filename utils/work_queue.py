@@ -0,0 +1,377 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from utils.crawl_journal import ErrorCapture
+from utils.metrics import VIDEOS
+from utils.task_context import task_scope
+
+DEFAULT_QUEUE_PATH = 'results/work_queue.sqlite3'
+
+# 条目状态：pending 等待领取，leased 已被某个worker领取，done 完成，failed 超过最大尝试次数
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS items (
+        queue TEXT NOT NULL,
+        bvid TEXT NOT NULL,
+        state TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        owner TEXT,
+        beat INTEGER NOT NULL DEFAULT 0,
+        enqueued_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        last_error TEXT,
+        PRIMARY KEY (queue, bvid)
+    );
+    CREATE INDEX IF NOT EXISTS idx_items_state ON items(queue, state);
+'''
+
+
+class WorkQueue:
+    """
+    多进程/多机共用的爬取队列，基于SQLite的租约
+
+    worker领取BV号时获得一段时间的租约，处理期间定期续约；worker崩溃后租约过期，
+    条目自动重新分给其他worker。领取在 BEGIN IMMEDIATE 事务中完成，同一个BV号同一时间只会租给一个worker。
+
+    多台机器共用时把数据库放在所有机器都能访问、支持文件锁的共享盘上，因此不使用需要同一台机器共享内存的WAL，
+    而是默认的回滚日志。各台机器的时钟可能不一致，租约是否过期不比较不同机器写下的时间：
+    持有者每次续约把数据库中的心跳计数加一，领取时本进程连续 lease_seconds 秒（本机单调时钟）
+    看到同一个owner的心跳计数没有变化，才认为租约已经过期。
+
+    :param path: 队列数据库路径
+    :param name: 队列名，弹幕和评论爬虫各用一个队列，可以放在同一个数据库里
+    :param lease_seconds: 租约时长，超过这么久没有续约就认为worker已经挂掉
+    :param max_attempts: 每个条目最多尝试的次数，超过后标记为failed
+    """
+
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH, name: str = 'danmaku', lease_seconds: float = 300,
+                 max_attempts: int = 3):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # 别人持有的条目最近一次的 (owner, 心跳计数, 第一次看到这个计数时的本机单调时钟)
+        self._observed: Dict[str, tuple] = {}
+        # 自己管理事务，领取时需要 BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60, isolation_level=None)
+        # 网络文件系统上不能用WAL，回滚日志只依赖文件锁
+        self._conn.execute('PRAGMA journal_mode=DELETE')
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(items)')}
+        if 'beat' not in columns:
+            self._conn.execute('ALTER TABLE items ADD COLUMN beat INTEGER NOT NULL DEFAULT 0')
+
+    def _transaction(self, func: Callable[[sqlite3.Connection], object]):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = func(self._conn)
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+            return result
+
+    def enqueue(self, bvids: Iterable[str]) -> int:
+        """加入BV号，已经在队列里的跳过，返回新加入的条数"""
+        now = time.time()
+        rows = [(self.name, bvid.strip(), PENDING, now) for bvid in bvids if bvid.strip()]
+
+        def insert(conn):
+            before = conn.total_changes
+            conn.executemany('INSERT OR IGNORE INTO items (queue, bvid, state, enqueued_at) VALUES (?, ?, ?, ?)', rows)
+            return conn.total_changes - before
+
+        return self._transaction(insert)
+
+    def enqueue_file(self, input_file: str) -> int:
+        """从BV号列表文件加入队列"""
+        with open(input_file, 'r', encoding='utf-8') as f:
+            return self.enqueue(f)
+
+    def _expired(self, conn: sqlite3.Connection) -> List[tuple]:
+        """被领取的条目中租约已经过期的 (bvid, 尝试次数)：连续 lease_seconds 秒心跳计数没有变化"""
+        now = time.monotonic()
+        observed = {}
+        expired = []
+        for bvid, owner, beat, attempts in conn.execute(
+                'SELECT bvid, owner, beat, attempts FROM items WHERE queue = ? AND state = ?', (self.name, LEASED)):
+            seen = self._observed.get(bvid)
+            if seen is None or seen[:2] != (owner, beat):
+                seen = (owner, beat, now)
+            elif now - seen[2] >= self.lease_seconds:
+                expired.append((bvid, attempts))
+            observed[bvid] = seen
+        self._observed = observed
+        return expired
+
+    def lease(self, owner: str, count: int = 1) -> List[str]:
+        """
+        领取最多count个BV号：租约已经过期的条目优先，然后是等待中的条目
+
+        过期条目的尝试次数已经用完时标记为failed，不再分出去
+        """
+        def take(conn):
+            now = time.time()
+            expired = self._expired(conn)
+            conn.executemany(
+                'UPDATE items SET state = ?, owner = NULL, last_error = ?, finished_at = ? WHERE queue = ? AND bvid = ?',
+                [(FAILED, '租约过期', now, self.name, bvid)
+                 for bvid, attempts in expired if attempts >= self.max_attempts]
+            )
+            bvids = [bvid for bvid, attempts in expired if attempts < self.max_attempts][:count]
+            bvids += [row[0] for row in conn.execute(
+                'SELECT bvid FROM items WHERE queue = ? AND state = ? ORDER BY attempts, rowid LIMIT ?',
+                (self.name, PENDING, count - len(bvids))
+            )]
+            conn.executemany(
+                'UPDATE items SET state = ?, owner = ?, beat = beat + 1, attempts = attempts + 1, started_at = ? '
+                'WHERE queue = ? AND bvid = ?',
+                [(LEASED, owner, now, self.name, bvid) for bvid in bvids]
+            )
+            return bvids
+
+        return self._transaction(take)
+
+    def heartbeat(self, owner: str, bvids: Iterable[str]) -> int:
+        """为仍然属于自己的条目续约（心跳计数加一），返回续约成功的条数"""
+        bvids = list(bvids)
+        if not bvids:
+            return 0
+
+        def extend(conn):
+            before = conn.total_changes
+            conn.executemany(
+                'UPDATE items SET beat = beat + 1 WHERE queue = ? AND bvid = ? AND state = ? AND owner = ?',
+                [(self.name, bvid, LEASED, owner) for bvid in bvids]
+            )
+            return conn.total_changes - before
+
+        return self._transaction(extend)
+
+    def _finish(self, owner: str, bvid: str, state: str, error: Optional[str]) -> bool:
+        # state 可以是SQL表达式，按尝试次数决定放回队列还是标记失败
+        def update(conn):
+            cursor = conn.execute(
+                f'UPDATE items SET state = {state}, last_error = ?, finished_at = ? '
+                'WHERE queue = ? AND bvid = ? AND state = ? AND owner = ?',
+                (error, time.time(), self.name, bvid, LEASED, owner)
+            )
+            return cursor.rowcount > 0
+
+        return self._transaction(update)
+
+    def complete(self, owner: str, bvid: str) -> bool:
+        """标记完成；租约已经过期并被别人领走时返回False"""
+        return self._finish(owner, bvid, f"'{DONE}'", None)
+
+    def fail(self, owner: str, bvid: str, error: str) -> bool:
+        """处理失败：还有尝试次数时放回队列，否则标记为failed"""
+        state = f"CASE WHEN attempts >= {int(self.max_attempts)} THEN '{FAILED}' ELSE '{PENDING}' END"
+        return self._finish(owner, bvid, state, error)
+
+    def retry_failed(self) -> int:
+        """把failed的条目重新放回队列，尝试次数清零"""
+        def reset(conn):
+            return conn.execute(
+                'UPDATE items SET state = ?, attempts = 0, owner = NULL WHERE queue = ? AND state = ?',
+                (PENDING, self.name, FAILED)
+            ).rowcount
+
+        return self._transaction(reset)
+
+    def idle(self, owner: Optional[str] = None) -> bool:
+        """没有等待中和被领取中的条目；给出owner时不算这个worker自己持有的条目"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT COUNT(*) FROM items WHERE queue = ? AND (state = ? OR (state = ? AND owner IS NOT ?))',
+                (self.name, PENDING, LEASED, owner)
+            ).fetchone()
+        return row[0] == 0
+
+    def stats(self, window: float = 600) -> Dict:
+        """
+        队列状态和吞吐统计
+
+        :param window: 统计最近多少秒内完成的条目，用于计算当前吞吐
+        """
+        now = time.time()
+        with self._lock:
+            counts = dict(self._conn.execute(
+                'SELECT state, COUNT(*) FROM items WHERE queue = ? GROUP BY state', (self.name,)
+            ).fetchall())
+            recent, avg_seconds, first, last = self._conn.execute(
+                'SELECT SUM(finished_at >= ?), AVG(finished_at - started_at), MIN(started_at), MAX(finished_at) '
+                'FROM items WHERE queue = ? AND state = ?', (now - window, self.name, DONE)
+            ).fetchone()
+            retried = self._conn.execute(
+                'SELECT COUNT(*) FROM items WHERE queue = ? AND attempts > 1', (self.name,)
+            ).fetchone()[0]
+            workers = dict(self._conn.execute(
+                'SELECT owner, COUNT(*) FROM items WHERE queue = ? AND state = ? GROUP BY owner', (self.name, DONE)
+            ).fetchall())
+        done = counts.get(DONE, 0)
+        return {
+            'queue': self.name,
+            **{state: counts.get(state, 0) for state in (PENDING, LEASED, DONE, FAILED)},
+            'retried': retried,
+            'avg_seconds': round(avg_seconds, 3) if avg_seconds is not None else None,
+            # 从第一个条目开始处理到最后一个完成的整体吞吐，以及最近window秒的吞吐
+            'per_minute': round(done / (last - first) * 60, 2) if done and last > first else None,
+            'recent_per_minute': round((recent or 0) / window * 60, 2),
+            'workers': workers,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class LeaseKeeper:
+    """
+    后台线程定期为当前持有的条目续约
+
+    :param interval: 续约间隔，默认为租约时长的三分之一
+    """
+
+    def __init__(self, queue: WorkQueue, owner: str, interval: Optional[float] = None):
+        self.queue = queue
+        self.owner = owner
+        self.interval = interval or queue.lease_seconds / 3
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='lease-keeper', daemon=True)
+
+    def hold(self, bvid: str):
+        with self._lock:
+            self._held.add(bvid)
+
+    def release(self, bvid: str):
+        with self._lock:
+            self._held.discard(bvid)
+
+    def _run(self):
+        logger = logging.getLogger(__name__)
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                held = list(self._held)
+            try:
+                if self.queue.heartbeat(self.owner, held) < len(held):
+                    logger.warning(f"部分租约已经过期: {held}")
+            except sqlite3.Error as e:
+                logger.error(f"续约失败: {str(e)}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def default_owner() -> str:
+    """worker标识：主机名-进程号"""
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def _complete(queue: WorkQueue, owner: str, keeper: LeaseKeeper, bvids: List[str], logger: logging.Logger):
+    for bvid in bvids:
+        keeper.release(bvid)
+        if not queue.complete(owner, bvid):
+            logger.warning(f"租约已过期，{bvid} 可能被其他worker重复处理")
+    bvids.clear()
+
+
+def run_worker(queue: WorkQueue, process: Callable[[str], bool], owner: Optional[str] = None,
+               poll_interval: float = 1.0, logger: Optional[logging.Logger] = None,
+               flush: Optional[Callable[[], None]] = None, defer_done: bool = False) -> int:
+    """
+    从队列中逐个领取BV号并处理，直到队列中没有等待和被领取的条目
+
+    别的worker持有的租约还没过期时继续等待，它们挂掉的话这些条目会重新分出来。
+
+    :param process: 处理一个BV号，返回是否成功
+    :param flush: 结束前调用，写出还没落盘的数据
+    :param defer_done: 成功的条目继续持有租约，flush 之后才标记完成，用于崩溃后数据会丢失的输出格式
+    :return: 本worker成功处理的条数
+    """
+    owner = owner or default_owner()
+    logger = logger or logging.getLogger(__name__)
+    errors = ErrorCapture()
+    logging.getLogger().addHandler(errors)
+    success = 0
+    deferred = []
+    try:
+        with LeaseKeeper(queue, owner) as keeper:
+            while True:
+                bvids = queue.lease(owner)
+                if not bvids:
+                    if queue.idle(owner):
+                        break
+                    time.sleep(poll_interval)
+                    continue
+                for bvid in bvids:
+                    keeper.hold(bvid)
+                    with task_scope() as task:
+                        try:
+                            ok = process(bvid)
+                            error = None if ok else task.error or '未获取到数据'
+                        except Exception as e:
+                            ok, error = False, str(e)
+                    VIDEOS.inc(DONE if ok else FAILED)
+                    if ok:
+                        success += 1
+                        deferred.append(bvid)
+                        if not defer_done:
+                            _complete(queue, owner, keeper, deferred, logger)
+                    else:
+                        keeper.release(bvid)
+                        queue.fail(owner, bvid, error)
+            if flush:
+                flush()
+            _complete(queue, owner, keeper, deferred, logger)
+    finally:
+        logging.getLogger().removeHandler(errors)
+    logger.info(f"worker {owner} 结束，成功处理{success}个，队列状态: {queue.stats()}")
+    return success
+
+
+def main():
+    """管理队列：python -m utils.work_queue enqueue/stats/retry-failed"""
+    parser = argparse.ArgumentParser(description='爬取队列管理')
+    parser.add_argument('command', choices=['enqueue', 'stats', 'retry-failed'])
+    parser.add_argument('input_file', nargs='?', help='enqueue 时的BV号列表文件')
+    parser.add_argument('--db', default=DEFAULT_QUEUE_PATH)
+    parser.add_argument('--queue', default='danmaku', help='队列名，danmaku 或 comment')
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.db, args.queue)
+    if args.command == 'enqueue':
+        print(f'新加入 {queue.enqueue_file(args.input_file)} 个BV号')
+    elif args.command == 'retry-failed':
+        print(f'重新放回 {queue.retry_failed()} 个失败的BV号')
+    print(json.dumps(queue.stats(), ensure_ascii=False, indent=2))
+    queue.close()
+
+
+if __name__ == '__main__':
+    main()